@@ -1,12 +1,101 @@
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point
-import zipfile
+import logging
 import os
-import fiona
-import concurrent.futures
+import queue
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
+from api.core.coverage import extrair_poligonos, listar_kmz
+from api.core.excel_styler import EscritorExcel, nome_aba_resumo
+from api.core.exportacao import EscritorSidecar, colunas_combinadas, combinar_abas, identificar_linhas
+from api.core.leitor_pontos import ler_blocos_pontos, listar_abas
 from api.core.models.ptp_model import PTPModel
+from api.core.scheduler import estimar_linhas
+from api.core.settings import EnvConfig
+from api.core.workers import WorkerPools
+
+
+class AnaliseCancelada(Exception):
+    """Levantada nos pontos de verificação quando o cancelamento da análise foi pedido."""
+
+
+class _ResultadoEmMemoria:
+    """Junta os blocos analisados de cada aba em um DataFrame por aba."""
+
+    def __init__(self, abas):
+        self.blocos = {aba: [] for aba in abas}
+
+    def adicionar(self, aba, df):
+        self.blocos[aba].append(df)
+
+    def finalizar(self, resumo_abas):
+        """DataFrame completo de cada aba, na ordem da planilha."""
+        abas = {aba: pd.concat(blocos) for aba, blocos in self.blocos.items()}
+        self.blocos = {}
+        return abas
+
+    def descartar(self):
+        self.blocos = {}
+
+
+class _ResultadoEmDisco:
+    """
+    Grava cada bloco analisado no .xlsx formatado e no sidecar Arrow assim que
+    fica pronto: a memória não cresce com a planilha. Com várias abas, o .xlsx
+    repete as abas da entrada e o sidecar junta todas, aba por aba (colunas Aba
+    e Linha na Aba na frente), mesmo com os blocos chegando fora de ordem.
+    """
+
+    def __init__(self, arquivo_resultado: str, abas_colunas, colunas_texto, nome_resumo: str):
+        self.arquivo_resultado = arquivo_resultado
+        self.nome_resumo = nome_resumo
+        self.multiplas = len(abas_colunas) > 1
+        # As colunas da análise misturam números e "---" de um bloco para outro
+        partes = list(abas_colunas) if len(abas_colunas) > 1 else [None]
+        self.sidecar = EscritorSidecar(arquivo_resultado, texto=colunas_texto, partes=partes)
+        self.colunas_sidecar = colunas_combinadas(abas_colunas.values()) if self.multiplas else None
+        self.excel = EscritorExcel(arquivo_resultado)
+        if self.multiplas:
+            for aba, colunas in abas_colunas.items():
+                self.excel.nova_aba(aba, colunas)
+        else:
+            # Uma aba: mesmo arquivo do salvar_excel
+            self.excel.nova_aba("Sheet1", next(iter(abas_colunas.values())))
+
+    def adicionar(self, aba, df):
+        self.excel.adicionar(df, aba if self.multiplas else None)
+        if self.multiplas:
+            # Colunas de outras abas entram vazias (sem tipo): o esquema fica com o tipo de quem tem valores
+            faltando = {c: None for c in self.colunas_sidecar if c not in df.columns}
+            df = df.assign(**{**faltando, **identificar_linhas(df, aba)})[self.colunas_sidecar]
+        try:
+            self.sidecar.adicionar(df, aba if self.multiplas else None)
+        except Exception as e:
+            # O sidecar é recriado do .xlsx quando necessário
+            logging.getLogger("uvicorn.info").warning(f"Arquivo colunar não gravado ({e}).")
+            self.sidecar.descartar()
+
+    def finalizar(self, resumo_abas):
+        if self.multiplas:
+            self.excel.adicionar_resumo(self.nome_resumo, resumo_abas)
+        self.excel.fechar()
+        try:
+            self.sidecar.fechar()
+        except Exception as e:
+            logging.getLogger("uvicorn.info").warning(f"Arquivo colunar não gravado ({e}).")
+            self.sidecar.descartar()
+        return None
+
+    def descartar(self):
+        try:
+            self.excel.fechar()
+        finally:
+            self.sidecar.descartar()
+            if os.path.exists(self.arquivo_resultado):
+                os.remove(self.arquivo_resultado)
+
 
 class GeoAnalyzer:
     def __init__(
@@ -16,7 +105,9 @@ class GeoAnalyzer:
         raio_km: float, 
         coluna_coordenadas: str, 
         coluna_velocidade, 
-        type_busca: int
+        type_busca: int,
+        cancelamento=None,
+        arquivo_resultado: str = None
     ):
         self.pasta_kmz = pasta_kmz
         self.arquivo_excel_path = arquivo_excel_path
@@ -24,9 +115,24 @@ class GeoAnalyzer:
         self.type_busca = type_busca
         self.RAIO_PROXIMIDADE_METROS = float(raio_km) * 1000
 
+        # Sinal de cancelamento (qualquer objeto com is_set(), ex.: Event do multiprocessing)
+        self.cancelamento = cancelamento
+        self._cancelado = False
+        # Análise interrompida (erro ou gerador abandonado): as threads das abas param
+        self._interrompido = False
+
+        # Análise fora da memória: resultado gravado direto neste .xlsx (e no sidecar)
+        self.arquivo_resultado = arquivo_resultado
+
         # --- ATRIBUTOS DE RESULTADO ---
         self.df_final = None
         self.resumo = None
+        # Planilhas com várias abas: DataFrame (em memória) e resumo de cada aba
+        self.abas_final = None
+        self.resumo_abas = None
+        self.nome_resumo = None
+        # Linhas já enviadas como resultado parcial (limitadas por ANALYSIS_PARTIAL_MAX_ROWS)
+        self.linhas_parciais_enviadas = 0
         
         # Constantes
         separa_coordenadas = coluna_coordenadas.split(',', 2)
@@ -51,7 +157,14 @@ class GeoAnalyzer:
         """
         Gerador que executa a análise passo a passo e produz (yields)
         atualizações de progresso.
+        Os pontos são processados em blocos de ANALYSIS_CHUNK_ROWS; cada bloco
+        concluído também é produzido como (-2, linhas) com o resultado parcial.
+        Todas as abas com as colunas de coordenada são analisadas, em paralelo
+        (até ANALYSIS_SHEET_WORKERS threads), contra as mesmas manchas.
+        Com `arquivo_resultado`, a planilha é lida e o resultado gravado bloco a
+        bloco (fora da memória) e `df_final` fica None.
         """
+        saida = None
         try:
             
             # Verificando Tipo de busca;
@@ -64,286 +177,430 @@ class GeoAnalyzer:
             
             yield 1, f"Tipo de busca: {tipo_busca}"
             
+            gdf_manchas_global = gdf_manchas_proj = None
+
             # ============================================================
-            # TYPE_BUSCA = 1  → SOMENTE BANCO DE DADOS
+            # TYPE_BUSCA 2 e 3 → SEGUEM O KMZ NORMAL
+            # (TYPE_BUSCA = 1 → SOMENTE BANCO DE DADOS, sem KMZ)
             # ============================================================
-            
-            if self.type_busca == 1:
-                yield 10, "Preparando dados para busca PTP..."
-
-                df_pontos = pd.read_excel(self.arquivo_excel_path)
-                # Inicializa colunas
-                df_pontos["Status"] = ""
-                df_pontos["Rede PTP"] = ""
-
-                modo_coordenadas = self._validar_colunas_pontos(df_pontos)
-                
-                # Função auxiliar para processar uma única linha (será executada em paralelo)
-                def processar_linha(args):
-                    index, row = args
-                    try:
-                        # Usa sua função _extrair_coord (assumindo que ela existe na classe)
-                        lat, lon = self._extrair_coord(row, modo_coordenadas)
-                        
-                        if lat is None or lon is None:
-                            return index, "Coordenada Inválida", ""
+            if self.type_busca != 1:
+                # --- Etapa 1: Carregar polígonos ---
+                yield 5, "Carregando arquivos KMZ..."
+                arquivos_kmz = listar_kmz(self.pasta_kmz)
+                if not arquivos_kmz:
+                    os.remove(self.arquivo_excel_path)
+                    raise ValueError(f"Nenhum arquivo .kmz encontrado em '{self.pasta_kmz}'")
 
-                        # Chamada ao banco
-                        resultado = PTPModel.rede_ptp(lat, lon) 
-                        
-                        if resultado and resultado.get('redes'):
-                            return index, "Analisar (Rede/SW na Cidade)", resultado['redes']
-                        else:
-                            return index, "Inviável", "---"
-                    except Exception:
-                        return index, "Coordenada Inválida", ""
+                lista_poligonos_gdfs = []
+                for i, kmz_file_path in enumerate(arquivos_kmz):
+                    self._checar_cancelamento()
+                    # Usando um método auxiliar para manter o código limpo
+                    gdf_poligonos = self._extrair_poligonos(kmz_file_path)
+                    if gdf_poligonos is not None:
+                        gdf_poligonos['Mancha GPON'] = os.path.basename(kmz_file_path).split('.')[0]
+                        lista_poligonos_gdfs.append(gdf_poligonos)
+                    yield 10 + int(20 * (i + 1) / len(arquivos_kmz)), f"Processando KMZ {i + 1}/{len(arquivos_kmz)}"
 
-                # Prepara os dados para o executor (lista de tuplas)
-                linhas_para_processar = list(df_pontos.iterrows())
-                total_linhas = len(linhas_para_processar)
+                if not lista_poligonos_gdfs:
+                    os.remove(self.arquivo_excel_path)
+                    raise ValueError("Nenhum polígono válido foi carregado dos arquivos KMZ.")
                 
-                yield 15, "Iniciando consultas paralelas..."
-
-                # Executa em paralelo (ajuste max_workers conforme a capacidade do seu banco)
-                # max_workers=10 ou 20 costuma ser seguro para consultas rápidas
-                with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
-                    # Submete as tarefas
-                    futures = [executor.submit(processar_linha, item) for item in linhas_para_processar]
-                    
-                    # Processa os resultados à medida que ficam prontos
-                    for i, future in enumerate(concurrent.futures.as_completed(futures)):
-                        idx, status, rede = future.result()
-                        
-                        # Atualiza o DataFrame (acesso direto pelo índice é rápido)
-                        df_pontos.at[idx, "Status"] = status
-                        df_pontos.at[idx, "Rede PTP"] = rede
-                        
-                        # Atualiza o progresso a cada X linhas para não floodar o frontend
-                        if i % 10 == 0:
-                            progresso = 15 + int(85 * (i + 1) / total_linhas)
-                            yield progresso, f"Consultando {i + 1}/{total_linhas}"
-
-                self.df_final = df_pontos
-                self.resumo = df_pontos["Status"].value_counts().to_dict()
-                
-                yield 100, "Análise concluída (modo: somente PTP)"
-                return
-            
-            
-            # ============================================================
-            # TYPE_BUSCA 2 e 3 → SEGUEM O KMZ NORMAL
-            # ============================================================
-            
-            # --- Etapa 1: Carregar polígonos ---
-            yield 5, "Carregando arquivos KMZ..."
-            arquivos_kmz = [os.path.join(self.pasta_kmz, f) for f in os.listdir(self.pasta_kmz) if f.lower().endswith('.kmz')]
-            if not arquivos_kmz:
-                os.remove(self.arquivo_excel_path)
-                raise ValueError(f"Nenhum arquivo .kmz encontrado em '{self.pasta_kmz}'")
-
-            lista_poligonos_gdfs = []
-            for i, kmz_file_path in enumerate(arquivos_kmz):
-                # Usando um método auxiliar para manter o código limpo
-                gdf_poligonos = self._extrair_poligonos(kmz_file_path)
-                if gdf_poligonos is not None:
-                    gdf_poligonos['Mancha GPON'] = os.path.basename(kmz_file_path).split('.')[0]
-                    lista_poligonos_gdfs.append(gdf_poligonos)
-                yield 10 + int(20 * (i + 1) / len(arquivos_kmz)), f"Processando KMZ {i + 1}/{len(arquivos_kmz)}"
-
-            if not lista_poligonos_gdfs:
-                os.remove(self.arquivo_excel_path)
-                raise ValueError("Nenhum polígono válido foi carregado dos arquivos KMZ.")
-            
-            gdf_manchas_global = gpd.GeoDataFrame(pd.concat(lista_poligonos_gdfs, ignore_index=True), crs=self.CRS_GEOGRAFICO)
+                gdf_manchas_global = gpd.GeoDataFrame(pd.concat(lista_poligonos_gdfs, ignore_index=True), crs=self.CRS_GEOGRAFICO)
+                # Projetadas uma única vez (o índice espacial de cada uma é reaproveitado por todos os blocos)
+                gdf_manchas_proj = gdf_manchas_global.to_crs(self.CRS_PROJETADO) if self.RAIO_PROXIMIDADE_METROS > 0 else None
             
             # ============================================================
             # ANALISAR ARQUIVO DE PONTOS
             # ============================================================
             
             # --- Etapa 2 & 3: Carregar e processar pontos ---
+            self._checar_cancelamento()
             yield 35, "Lendo e validando arquivo de pontos..."
-            df_pontos = pd.read_excel(self.arquivo_excel_path)
-            
-            # ... (Lógica de validação e criação de geometria idêntica à anterior) ...
-            modo_coordenadas = self._validar_colunas_pontos(df_pontos)
-            
-            df_pontos['geometry'] = df_pontos.apply(
-                lambda row: self._criar_ponto(row, modo_coordenadas), 
-                axis=1
-            )
-            
-            invalidos_mask = df_pontos['geometry'].isna()
-                
-            # --- Etapa 4, 5, 6: Análise Espacial ---
-            df_validos = df_pontos[~invalidos_mask]
+            abas = self._abas_com_coordenadas()
+            multiplas = len(abas) > 1
+            if any(linhas is None for _, _, linhas in abas.values()):
+                total = estimar_linhas(self.arquivo_excel_path)
+            else:
+                total = sum(linhas for _, _, linhas in abas.values())
+            if multiplas:
+                yield 38, f"{len(abas)} abas com coordenadas: {', '.join(abas)}"
 
-            # ============================================================
-            # ANÁLISE ESPACIAL (KMZ NORMAL)
-            # ============================================================
-            if not df_validos.empty:
-                gdf_pontos = gpd.GeoDataFrame(df_validos, geometry='geometry', crs=self.CRS_GEOGRAFICO)
-                if self.COLUNA_VELOCIDADE in gdf_pontos.columns:
-                    gdf_pontos['velocidade_num'] = pd.to_numeric(gdf_pontos[self.COLUNA_VELOCIDADE].astype(str).str.extract(r'(\d+)')[0], errors='coerce').fillna(0)
-                else:
-                    gdf_pontos['velocidade_num'] = 0
-                
-                # Dentro da Mancha
-                yield 50, "Analisando pontos DENTRO das manchas..."
-                # ... (Lógica sjoin e agregação para 'dentro') ...
-                gdf_dentro_bruto = gpd.sjoin(gdf_pontos, gdf_manchas_global, how="inner", predicate="within")
-                gdf_dentro_agregado = self._aggregate_results(gdf_dentro_bruto, 'dentro', gdf_pontos)
-
-                # Próximo a Mancha
-                yield 70, "Analisando pontos PRÓXIMOS às manchas..."
-                # ... (Lógica sjoin_nearest e agregação para 'próximo') ...
-                indices_encontrados = gdf_dentro_agregado.index
-                gdf_pontos_fora = gdf_pontos.drop(indices_encontrados)
-                gdf_proximos_agregado = pd.DataFrame()
-                
-                if not gdf_pontos_fora.empty and self.RAIO_PROXIMIDADE_METROS > 0:
-                    gdf_pontos_proj = gdf_pontos_fora.to_crs(self.CRS_PROJETADO)
-                    gdf_manchas_proj = gdf_manchas_global.to_crs(self.CRS_PROJETADO)
-                    gdf_proximos_bruto = gpd.sjoin_nearest(gdf_pontos_proj, gdf_manchas_proj, max_distance=self.RAIO_PROXIMIDADE_METROS, how="inner")
-                    if not gdf_proximos_bruto.empty:
-                        yield 85, "Agregando resultados de proximidade..."
-                        # ... cálculo de distância ...
-                        nearest_polygons = gdf_manchas_proj.loc[gdf_proximos_bruto['index_right'], 'geometry']
-                        aligned_polygons = gpd.GeoSeries(nearest_polygons.values, index=gdf_proximos_bruto.index, crs=self.CRS_PROJETADO)
-                        gdf_proximos_bruto['Dist. GPON (mts)'] = gdf_proximos_bruto.geometry.distance(aligned_polygons)
-                        gdf_proximos_agregado = self._aggregate_results(gdf_proximos_bruto, 'proximo', gdf_pontos)
-
-                # resultados_geo = pd.concat([gdf_dentro_agregado, gdf_proximos_agregado]).rename(columns={self.COLUNA_NOME_MANCHA: 'Nome da Mancha'})
-                resultados_geo = pd.concat([gdf_dentro_agregado, gdf_proximos_agregado])
+            colunas_fixas = self._colunas_resultado()
+            self.nome_resumo = nome_aba_resumo(abas)
+            if self.arquivo_resultado:
+                abas_colunas = {aba: self._colunas_saida(colunas) for aba, (_, colunas, _) in abas.items()}
+                saida = _ResultadoEmDisco(self.arquivo_resultado, abas_colunas, colunas_fixas, self.nome_resumo)
             else:
-                resultados_geo = pd.DataFrame()
-            
-            # ============================================================
-            # CONSOLIDAR RESULTADOS
-            # ============================================================
-            
-            # --- Etapa 7: Consolidar ---
-            yield 95, "Consolidando resultados GPON..."
-            df_final = df_pontos.merge(resultados_geo, left_index=True, right_index=True, how="left")
-            df_final.loc[invalidos_mask, 'Status'] = 'Coordenada Inválida'
-            df_final.fillna({'Status': 'Inviável'}, inplace=True)
-            
-            
-            # Preenche colunas GPON vazias
-            df_final.fillna({'Mancha GPON': '---', 'Dist. GPON (mts)': '---'}, inplace=True)
-            
-            # ============================================================
-            # TYPE_BUSCA = 3 → FAZER BUSCA PTP APENAS PARA OS INVIÁVEIS
-            # ============================================================
-            if self.type_busca == 3:
-                df_final["Rede PTP"] = "---"
+                saida = _ResultadoEmMemoria(abas)
 
-                # Fltrar apenas os índices que deram "Inviáveis" na busca GPON
-                indices_inviaveis = df_final[df_final['Status'] == 'Inviável'].index
+            # Índices espaciais das manchas montados aqui: as threads só os consultam
+            for gdf in (gdf_manchas_global, gdf_manchas_proj):
+                if gdf is not None:
+                    gdf.sindex
 
-                total_inviaveis = len(indices_inviaveis)
+            # --- Etapa 4, 5, 6, 7: Análise espacial, consolidação e PTP ---
+            # Cada aba roda em uma thread, bloco a bloco; os blocos prontos chegam
+            # pela fila e só esta thread grava o resultado
+            contagens = {aba: Counter() for aba in abas}
+            processadas = 0
+            threads = min(EnvConfig.ANALYSIS_SHEET_WORKERS, len(abas))
+            fila = queue.Queue(maxsize=2 * threads)
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="aba") as executor:
+                try:
+                    for aba, (modo_coordenadas, _, linhas) in abas.items():
+                        executor.submit(
+                            self._executar_aba, fila, aba, modo_coordenadas, linhas, gdf_manchas_global, gdf_manchas_proj
+                        )
 
-                if total_inviaveis > 0:
-                    yield 96, f"Buscando PTP para {total_inviaveis} pontos sem cobertura GPON..."
-                
-                    # Define a função de busca PTP (similar à do Nível 1)
-                    def buscar_ptp_fallback(idx):
+                    ativas = len(abas)
+                    while ativas:
                         try:
-                            row = df_final.loc[idx]
-                            # Recria geometria se necessário ou usa lat/lon originais
-                            # Assumindo que _extrair_coord funciona com a linha do df_final
-                            lat, lon = self._extrair_coord(row, modo_coordenadas)
-                            
-                            if lat is None or lon is None:
-                                return idx, None
-
-                            resultado = PTPModel.rede_ptp(lat, lon)
-                            if resultado and resultado.get('redes'):
-                                return idx, resultado['redes']
-                            return idx, None
-                        except:
-                            return idx, None
+                            aba, evento = fila.get(timeout=0.5)
+                        except queue.Empty:
+                            self._checar_cancelamento()
+                            continue
 
-                    # Executa em paralelo apenas para os inviáveis
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
-                        futures = [executor.submit(buscar_ptp_fallback, idx) for idx in indices_inviaveis]
-                        
-                        for i, future in enumerate(concurrent.futures.as_completed(futures)):
-                            idx, rede_encontrada = future.result()
-
-                            if rede_encontrada:
-                                # Atualiza o Status e a Rede
-                                df_final.at[idx, 'Status'] = 'Analisar (Rede/SW na Cidade)'
-                                df_final.at[idx, 'Rede PTP'] = rede_encontrada
-
-                            if i % 50 == 0:
-                                yield 96 + int(3 * (i+1)/total_inviaveis), f"Verificando PTP {i+1}/{total_inviaveis}..."
+                        if evento is None:
+                            ativas -= 1
+                        elif isinstance(evento, BaseException):
+                            raise evento
+                        elif isinstance(evento, pd.DataFrame):
+                            processadas += len(evento)
+                            contagens[aba].update(evento['Status'].tolist())
+                            saida.adicionar(aba, evento)
+                            parciais = self._linhas_parciais(evento, colunas_fixas, aba if multiplas else None)
+                            if parciais:
+                                yield -2, parciais
+                        else:
+                            progresso = 40 + int(55 * min(processadas / max(total, 1), 1))
+                            yield progresso, f"[{aba}] {evento}" if multiplas else evento
+                except BaseException:
+                    # Erro, cancelamento ou gerador abandonado: as demais abas param no próximo ponto de verificação
+                    self._interrompido = True
+                    raise
             
             # ============================================================
             # FINALIZAR
             # ============================================================
             # --- Finalização e Organização ---
+            self._checar_cancelamento()
             yield 99, "Finalizando relatório..."
-            
-            df_final = df_final.drop(columns=['geometry'], errors='ignore')
-            
-            resumo = df_final['Status'].value_counts().to_dict()
-            
-            # Organizando Colunas;
-            if self.type_busca == 1:
-                colunas_fixas = ['Status', 'Rede PTP']
-            elif self.type_busca == 2:
-                colunas_fixas = ['Status', 'Mancha GPON', 'Dist. GPON (mts)']
-            elif self.type_busca == 3:
-                colunas_fixas = ['Status', 'Mancha GPON', 'Dist. GPON (mts)', 'Rede PTP']
-
-            colunas_originais = [c for c in df_final.columns if c not in colunas_fixas]
-
-            df_final = df_final[colunas_originais + colunas_fixas]
 
             # Salva os resultados nos atributos da instância
-            self.df_final = df_final
-            self.resumo = resumo
+            resumo_abas = {aba: dict(contagem.most_common()) for aba, contagem in contagens.items()}
+            self.resumo = dict(sum(contagens.values(), Counter()).most_common())
+            abas_final = saida.finalizar(resumo_abas)
+            saida = None
+            if multiplas:
+                self.resumo_abas = resumo_abas
+                self.abas_final = abas_final
+                self.df_final = combinar_abas(abas_final) if abas_final is not None else None
+            elif abas_final is not None:
+                self.df_final = next(iter(abas_final.values()))
 
             yield 100, "Análise Concluída!"
 
+        except AnaliseCancelada:
+            # Cancelamento não é erro: quem chamou decide o que fazer
+            raise
+
         except Exception as e:
             # Em caso de erro, produz uma mensagem de erro
+            if saida is not None:
+                saida.descartar()
+                saida = None
             yield -1, str(e)
             # return None, None
 
+        finally:
+            # Interrompida (cancelamento ou gerador abandonado): nada de resultado pela metade
+            if saida is not None:
+                saida.descartar()
+
+    def _executar_aba(self, fila, aba, modo_coordenadas, linhas, gdf_manchas_global, gdf_manchas_proj):
+        """
+        Roda em uma thread: entrega na fila (aba, evento) para cada mensagem de
+        progresso e bloco pronto, depois (aba, None) ao terminar ou (aba, exceção).
+        """
+        try:
+            for evento in self._analisar_aba(aba, modo_coordenadas, linhas, gdf_manchas_global, gdf_manchas_proj):
+                self._entregar(fila, (aba, evento))
+            self._entregar(fila, (aba, None))
+        except BaseException as e:
+            try:
+                self._entregar(fila, (aba, e))
+            except AnaliseCancelada:
+                # Quem lê a fila já parou (ou vai perceber o cancelamento sozinho)
+                pass
+
+    def _entregar(self, fila, item):
+        # Fila cheia: espera quem grava, sem deixar de atender o cancelamento
+        while True:
+            try:
+                fila.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                self._checar_cancelamento()
+
+    def _analisar_aba(self, aba, modo_coordenadas, linhas, gdf_manchas_global, gdf_manchas_proj):
+        """
+        Gerador da análise de uma aba, bloco a bloco: produz as mensagens de
+        progresso (texto) e cada bloco pronto, com as colunas do resultado.
+        """
+        colunas_fixas = self._colunas_resultado()
+        blocos = ler_blocos_pontos(
+            self.arquivo_excel_path, EnvConfig.ANALYSIS_CHUNK_ROWS,
+            streaming=bool(self.arquivo_resultado), aba=aba
+        )
+        for df_bloco in blocos:
+            self._checar_cancelamento()
+            inicio = df_bloco.index[0] if len(df_bloco) else 0
+            fim = inicio + len(df_bloco)
+            if len(df_bloco):
+                yield f"Analisando pontos {inicio + 1}-{fim} de {max(linhas or 0, fim)}..."
+
+            # A análise só carrega as colunas de coordenada e velocidade
+            df_entrada = df_bloco[self._colunas_analise(df_bloco, modo_coordenadas)]
+            if self.type_busca == 1:
+                df_analisado = yield from self._analisar_bloco_ptp(df_entrada, modo_coordenadas)
+            else:
+                df_analisado = yield from self._analisar_bloco(
+                    df_entrada, modo_coordenadas, gdf_manchas_global, gdf_manchas_proj
+                )
+
+            # Organizando Colunas: as demais colunas da planilha voltam só aqui, na ordem original
+            yield pd.concat(
+                [df_bloco.drop(columns=colunas_fixas, errors='ignore'), df_analisado[colunas_fixas]], axis=1
+            )
+
+    def _analisar_bloco_ptp(self, df_bloco, modo_coordenadas):
+        """
+        Gerador da busca somente PTP (type_busca 1) para um bloco de pontos,
+        em paralelo no pool de I/O. Produz mensagens de progresso e retorna o
+        bloco com Status e Rede PTP.
+        """
+        df_pontos = df_bloco.copy()
+        # Inicializa colunas
+        df_pontos["Status"] = ""
+        df_pontos["Rede PTP"] = ""
+
+        # Função auxiliar para processar uma única linha (será executada em paralelo)
+        def processar_linha(args):
+            index, row = args
+            if self._cancelado or self._interrompido:
+                return index, "", ""
+            try:
+                # Usa sua função _extrair_coord (assumindo que ela existe na classe)
+                lat, lon = self._extrair_coord(row, modo_coordenadas)
+                
+                if lat is None or lon is None:
+                    return index, "Coordenada Inválida", ""
+
+                # Chamada ao banco
+                resultado = PTPModel.rede_ptp(lat, lon) 
+                
+                if resultado and resultado.get('redes'):
+                    return index, "Analisar (Rede/SW na Cidade)", resultado['redes']
+                else:
+                    return index, "Inviável", "---"
+            except Exception:
+                return index, "Coordenada Inválida", ""
+
+        total_linhas = len(df_pontos)
+
+        # Executa em paralelo no pool de I/O compartilhado, dentro da cota deste job
+        with WorkerPools.lote(processar_linha, df_pontos.iterrows()) as lote:
+            # Processa os resultados à medida que ficam prontos
+            for i, (idx, status, rede) in enumerate(lote):
+                if i % 10 == 0:
+                    self._checar_cancelamento()
+                
+                # Atualiza o DataFrame (acesso direto pelo índice é rápido)
+                df_pontos.at[idx, "Status"] = status
+                df_pontos.at[idx, "Rede PTP"] = rede
+
+                # Atualiza o progresso a cada X linhas para não floodar o frontend
+                if (i + 1) % 500 == 0:
+                    yield f"Consultando {i + 1}/{total_linhas} do bloco"
+
+        return df_pontos
+
+    def _analisar_bloco(self, df_bloco, modo_coordenadas, gdf_manchas_global, gdf_manchas_proj):
+        """
+        Gerador com as etapas GPON (dentro/próximo) e o PTP do type_busca 3 para um
+        bloco de pontos. Produz mensagens de progresso e retorna o bloco
+        consolidado, já sem a geometria (usar com `yield from`).
+        """
+        df_pontos = df_bloco.copy()
+        if df_pontos.empty:
+            df_pontos['geometry'] = pd.Series(index=df_pontos.index, dtype=object)
+        else:
+            df_pontos['geometry'] = df_pontos.apply(
+                lambda row: self._criar_ponto(row, modo_coordenadas), 
+                axis=1
+            )
+        
+        invalidos_mask = df_pontos['geometry'].isna()
+            
+        # --- Etapa 4, 5, 6: Análise Espacial ---
+        df_validos = df_pontos[~invalidos_mask]
+
+        # ============================================================
+        # ANÁLISE ESPACIAL (KMZ NORMAL)
+        # ============================================================
+        if not df_validos.empty:
+            gdf_pontos = gpd.GeoDataFrame(df_validos, geometry='geometry', crs=self.CRS_GEOGRAFICO)
+            if self.COLUNA_VELOCIDADE in gdf_pontos.columns:
+                gdf_pontos['velocidade_num'] = pd.to_numeric(gdf_pontos[self.COLUNA_VELOCIDADE].astype(str).str.extract(r'(\d+)')[0], errors='coerce').fillna(0)
+            else:
+                gdf_pontos['velocidade_num'] = 0
+            
+            # Dentro da Mancha
+            self._checar_cancelamento()
+            gdf_dentro_bruto = gpd.sjoin(gdf_pontos, gdf_manchas_global, how="inner", predicate="within")
+            gdf_dentro_agregado = self._aggregate_results(gdf_dentro_bruto, 'dentro', gdf_pontos)
+
+            # Próximo a Mancha
+            self._checar_cancelamento()
+            indices_encontrados = gdf_dentro_agregado.index
+            gdf_pontos_fora = gdf_pontos.drop(indices_encontrados)
+            gdf_proximos_agregado = pd.DataFrame()
+            
+            if not gdf_pontos_fora.empty and self.RAIO_PROXIMIDADE_METROS > 0:
+                gdf_pontos_proj = gdf_pontos_fora.to_crs(self.CRS_PROJETADO)
+                gdf_proximos_bruto = gpd.sjoin_nearest(gdf_pontos_proj, gdf_manchas_proj, max_distance=self.RAIO_PROXIMIDADE_METROS, how="inner")
+                if not gdf_proximos_bruto.empty:
+                    self._checar_cancelamento()
+                    # ... cálculo de distância ...
+                    nearest_polygons = gdf_manchas_proj.loc[gdf_proximos_bruto['index_right'], 'geometry']
+                    aligned_polygons = gpd.GeoSeries(nearest_polygons.values, index=gdf_proximos_bruto.index, crs=self.CRS_PROJETADO)
+                    gdf_proximos_bruto['Dist. GPON (mts)'] = gdf_proximos_bruto.geometry.distance(aligned_polygons)
+                    gdf_proximos_agregado = self._aggregate_results(gdf_proximos_bruto, 'proximo', gdf_pontos)
+
+            resultados_geo = pd.concat([gdf_dentro_agregado, gdf_proximos_agregado])
+        else:
+            resultados_geo = pd.DataFrame()
+        
+        # ============================================================
+        # CONSOLIDAR RESULTADOS
+        # ============================================================
+        
+        # --- Etapa 7: Consolidar ---
+        self._checar_cancelamento()
+        df_final = df_pontos.merge(resultados_geo, left_index=True, right_index=True, how="left")
+        # O bloco pode não ter nenhum ponto dentro ou próximo (nem nenhum ponto)
+        for coluna in ('Status', 'Mancha GPON', 'Dist. GPON (mts)'):
+            if coluna not in df_final.columns:
+                df_final[coluna] = None
+        df_final.loc[invalidos_mask, 'Status'] = 'Coordenada Inválida'
+        df_final.fillna({'Status': 'Inviável'}, inplace=True)
+        
+        
+        # Preenche colunas GPON vazias
+        df_final.fillna({'Mancha GPON': '---', 'Dist. GPON (mts)': '---'}, inplace=True)
+        
+        # ============================================================
+        # TYPE_BUSCA = 3 → FAZER BUSCA PTP APENAS PARA OS INVIÁVEIS
+        # ============================================================
+        if self.type_busca == 3:
+            df_final["Rede PTP"] = "---"
+
+            # Fltrar apenas os índices que deram "Inviáveis" na busca GPON
+            indices_inviaveis = df_final[df_final['Status'] == 'Inviável'].index
+
+            total_inviaveis = len(indices_inviaveis)
+
+            if total_inviaveis > 0:
+                yield f"Buscando PTP para {total_inviaveis} pontos sem cobertura GPON..."
+            
+                # Define a função de busca PTP (similar à do Nível 1)
+                def buscar_ptp_fallback(idx):
+                    if self._cancelado or self._interrompido:
+                        return idx, None
+                    try:
+                        row = df_final.loc[idx]
+                        # Recria geometria se necessário ou usa lat/lon originais
+                        # Assumindo que _extrair_coord funciona com a linha do df_final
+                        lat, lon = self._extrair_coord(row, modo_coordenadas)
+                        
+                        if lat is None or lon is None:
+                            return idx, None
+
+                        resultado = PTPModel.rede_ptp(lat, lon)
+                        if resultado and resultado.get('redes'):
+                            return idx, resultado['redes']
+                        return idx, None
+                    except:
+                        return idx, None
+
+                # Executa em paralelo apenas para os inviáveis
+                with WorkerPools.lote(buscar_ptp_fallback, indices_inviaveis) as lote:
+                    for i, (idx, rede_encontrada) in enumerate(lote):
+                        if i % 10 == 0:
+                            self._checar_cancelamento()
+
+
+                        if rede_encontrada:
+                            # Atualiza o Status e a Rede
+                            df_final.at[idx, 'Status'] = 'Analisar (Rede/SW na Cidade)'
+                            df_final.at[idx, 'Rede PTP'] = rede_encontrada
+
+        return df_final.drop(columns=['geometry'], errors='ignore')
+
     # --- Métodos Auxiliares da Classe ---
+    def _checar_cancelamento(self):
+        """
+        Ponto de verificação: se o cancelamento foi pedido levanta AnaliseCancelada
+        (os lotes do pool de I/O descartam as consultas ainda não iniciadas ao sair).
+        """
+        if not self._cancelado and self.cancelamento is not None and self.cancelamento.is_set():
+            self._cancelado = True
+        if self._cancelado or self._interrompido:
+            raise AnaliseCancelada("Análise cancelada.")
+
+    def _colunas_resultado(self):
+        """Colunas que a análise acrescenta, na ordem do relatório."""
+        if self.type_busca == 1:
+            return ['Status', 'Rede PTP']
+        elif self.type_busca == 2:
+            return ['Status', 'Mancha GPON', 'Dist. GPON (mts)']
+        return ['Status', 'Mancha GPON', 'Dist. GPON (mts)', 'Rede PTP']
+
+    def _colunas_saida(self, colunas):
+        """Colunas do resultado de uma aba: as da planilha, na ordem, e as da análise no fim."""
+        colunas_fixas = self._colunas_resultado()
+        return [c for c in colunas if c not in colunas_fixas] + colunas_fixas
+
+    def _colunas_analise(self, df, modo_coordenadas):
+        """Colunas de entrada que a análise usa (coordenadas e velocidade, se houver)."""
+        if modo_coordenadas == 'latlon':
+            colunas = [self.COLUNA_LATITUDE, self.COLUNA_LONGITUDE]
+        else:
+            colunas = [self.COLUNA_COORDENADAS]
+        if self.COLUNA_VELOCIDADE in df.columns:
+            colunas.append(self.COLUNA_VELOCIDADE)
+        return list(dict.fromkeys(colunas))
+
+    def _linhas_parciais(self, df, colunas, aba=None):
+        """
+        Resultado parcial de um bloco para o stream: a linha da planilha
+        (cabeçalho = linha 1), a aba (planilhas com várias abas) e as colunas
+        da análise. Lista vazia depois de ANALYSIS_PARTIAL_MAX_ROWS linhas enviadas.
+        """
+        restantes = EnvConfig.ANALYSIS_PARTIAL_MAX_ROWS - self.linhas_parciais_enviadas
+        if restantes <= 0 or df.empty:
+            return []
+        df = df.iloc[:restantes]
+        valores = df[colunas].astype(object).where(df[colunas].notna(), None)
+        linhas = [
+            {"linha": int(idx) + 2, **({"aba": aba} if aba is not None else {}), **registro}
+            for idx, registro in zip(df.index, valores.to_dict("records"))
+        ]
+        self.linhas_parciais_enviadas += len(linhas)
+        return linhas
+
     def _extrair_poligonos(self, arquivo_kmz):
-        basename = os.path.basename(arquivo_kmz).split('.')[0]
-        temp_dir = os.path.join(self.pasta_kmz, "temp", basename)
-        os.makedirs(temp_dir, exist_ok=True)
-        caminho_kml = next((os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.lower().endswith('.kml')), None)
-        if not caminho_kml:
-            try:
-                with zipfile.ZipFile(arquivo_kmz, 'r') as kmz:
-                    kml_filename = next((f for f in kmz.namelist() if f.lower().endswith('.kml')), None)
-                    if not kml_filename: return None
-                    print(f"⚠️  Extraindo: '{os.path.basename(arquivo_kmz)}'")
-                    caminho_kml = kmz.extract(kml_filename, path=temp_dir)
-            except Exception as e:
-                print(f"❌ Erro ao extrair '{arquivo_kmz}': {e}")
-                return None
-        try:
-            with fiona.Env():
-                camadas = fiona.listlayers(caminho_kml)
-            lista_de_gdfs = []
-            for camada in camadas:
-                try:
-                    gdf_camada = gpd.read_file(caminho_kml, driver='KML', layer=camada)
-                    gdf_camada = gdf_camada[gdf_camada.geometry.type.isin(['Polygon', 'MultiPolygon']) & gdf_camada.geometry.is_valid]
-                    if not gdf_camada.empty:
-                        lista_de_gdfs.append(gdf_camada)
-                except Exception:
-                    continue
-            if not lista_de_gdfs: return None
-            return gpd.GeoDataFrame(pd.concat(lista_de_gdfs, ignore_index=True), crs=self.CRS_GEOGRAFICO)
-        except Exception as e:
-            print(f"❌ Erro ao ler KML '{caminho_kml}': {e}")
-            return None
+        return extrair_poligonos(arquivo_kmz, self.pasta_kmz)
     
     def _extrair_coord(self, row, mode):
         """
@@ -403,14 +660,24 @@ class GeoAnalyzer:
         
         return None
 
-    def _validar_colunas_pontos(self, df):
-        if self.COLUNA_LATITUDE in df.columns and self.COLUNA_LONGITUDE in df.columns:
+    def _modo_coordenadas(self, colunas):
+        if self.COLUNA_LATITUDE in colunas and self.COLUNA_LONGITUDE in colunas:
             return 'latlon'
-        elif self.COLUNA_COORDENADAS in df.columns:
+        elif self.COLUNA_COORDENADAS in colunas:
             return 'coords'
-        else:
+        return None
+
+    def _abas_com_coordenadas(self):
+        """{aba: (modo, colunas, linhas)} das abas que têm as colunas de coordenada, na ordem da planilha."""
+        abas = {}
+        for nome, colunas, linhas in listar_abas(self.arquivo_excel_path):
+            modo = self._modo_coordenadas(colunas)
+            if modo is not None:
+                abas[nome] = (modo, colunas, linhas)
+        if not abas:
             os.remove(self.arquivo_excel_path)
             raise ValueError(f"Nenhuma coluna de coordenada encontrada.")
+        return abas
     
     def _aggregate_results(self, df_bruto, mode, gdf_pontos):
         if df_bruto.empty:
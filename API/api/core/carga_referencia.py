@@ -0,0 +1,353 @@
+# api/core/carga_referencia.py
+"""
+Carga da base de referência (estados, municipios, redes_ptp) a partir de
+migrations/base_db.sql, sem precisar reexecutar o script manualmente.
+
+Uso:
+    python -m api.core.carga_referencia [--forcar] [--redes-ptp] [--arquivo caminho.sql]
+
+- Cria o esquema quando as tabelas não existem, carregando os dados antes
+  de criar os índices secundários/espaciais e as chaves estrangeiras.
+- Insere em lotes com executemany (estados/municipios fazem upsert pela PK).
+- redes_ptp só é carregada enquanto está vazia: depois da primeira carga
+  quem manda nela é o painel (/ptp/*), e uma nova carga traria de volta as
+  redes removidas por lá. Com --redes-ptp os pares (rede, cidade) do arquivo
+  que faltam na tabela são incluídos mesmo assim.
+- Guarda um checksum por tabela em `carga_referencia`: redeploys com o
+  mesmo arquivo não tocam nas tabelas.
+"""
+import argparse
+import hashlib
+import json
+import re
+from datetime import datetime
+from typing import Dict, List
+
+from api.core.settings import EnvConfig
+
+import logging
+
+
+logger = logging.getLogger("uvicorn.info")
+
+# Linhas por executemany
+LOTE_INSERCAO = 1000
+
+# Ordem de carga (respeita as chaves estrangeiras)
+TABELAS = ("estados", "municipios", "redes_ptp")
+
+COLUNAS = {
+    "estados": ("codigo_uf", "uf", "nome", "latitude", "longitude", "regiao"),
+    "municipios": (
+        "codigo_ibge", "nome", "latitude", "longitude", "capital",
+        "codigo_uf", "siafi_id", "ddd", "fuso_horario"
+    ),
+    "redes_ptp": ("codigo_ibge", "codigo_uf", "rede_ptp"),
+}
+
+CHAVE_PRIMARIA = {"estados": "codigo_uf", "municipios": "codigo_ibge"}
+
+SQL_CHECKSUMS = """
+    CREATE TABLE IF NOT EXISTS carga_referencia (
+        tabela VARCHAR(64) NOT NULL PRIMARY KEY,
+        checksum CHAR(64) NOT NULL,
+        linhas INT NOT NULL,
+        carregado_em VARCHAR(32) NOT NULL
+    )
+"""
+
+# Esquema MySQL equivalente às migrations 001-003, só com a chave primária.
+# Os índices restantes (INDICES_MYSQL) são criados depois da carga.
+DDL_MYSQL = {
+    "estados": """
+        CREATE TABLE `estados` (
+          `codigo_uf` INT NOT NULL,
+          `uf` VARCHAR(2) NOT NULL,
+          `nome` VARCHAR(100) NOT NULL,
+          `latitude` FLOAT NOT NULL,
+          `longitude` FLOAT NOT NULL,
+          `regiao` VARCHAR(12) NOT NULL,
+          PRIMARY KEY (`codigo_uf`))
+        ENGINE = InnoDB
+        DEFAULT CHARACTER SET = utf8mb4
+        COLLATE = utf8mb4_0900_ai_ci
+    """,
+    "municipios": """
+        CREATE TABLE `municipios` (
+          `codigo_ibge` INT NOT NULL PRIMARY KEY,
+          `nome` VARCHAR(100) NOT NULL,
+          `latitude` DOUBLE NOT NULL,
+          `longitude` DOUBLE NOT NULL,
+          `coordenada` POINT NOT NULL,
+          `capital` TINYINT(1) NOT NULL,
+          `codigo_uf` INT NOT NULL,
+          `siafi_id` VARCHAR(4) NOT NULL,
+          `ddd` INT NOT NULL,
+          `fuso_horario` VARCHAR(32) NOT NULL)
+        ENGINE = InnoDB
+        DEFAULT CHARACTER SET = utf8mb4
+        COLLATE = utf8mb4_0900_ai_ci
+    """,
+    "redes_ptp": """
+        CREATE TABLE `redes_ptp` (
+          `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+          `codigo_ibge` INT NOT NULL,
+          `codigo_uf` INT NOT NULL,
+          `rede_ptp` VARCHAR(100) NOT NULL)
+        ENGINE = InnoDB
+        DEFAULT CHARACTER SET = utf8mb4
+        COLLATE = utf8mb4_0900_ai_ci
+    """,
+}
+
+INDICES_MYSQL = {
+    "municipios": """
+        ALTER TABLE `municipios`
+          ADD UNIQUE INDEX `siafi_id` (`siafi_id` ASC),
+          ADD INDEX `codigo_uf` (`codigo_uf` ASC),
+          ADD SPATIAL INDEX `spx_coordenada` (`coordenada`),
+          ADD CONSTRAINT `municipios_ibfk_1`
+            FOREIGN KEY (`codigo_uf`) REFERENCES `estados` (`codigo_uf`)
+    """,
+    "redes_ptp": """
+        ALTER TABLE `redes_ptp`
+          ADD INDEX `codigo_ibge` (`codigo_ibge` ASC),
+          ADD INDEX `codigo_uf` (`codigo_uf` ASC),
+          ADD INDEX `idx_rede_ptp` (`rede_ptp`),
+          ADD CONSTRAINT `redes_ptp_ibfk_1`
+            FOREIGN KEY (`codigo_ibge`) REFERENCES `municipios` (`codigo_ibge`),
+          ADD CONSTRAINT `redes_ptp_ibfk_2`
+            FOREIGN KEY (`codigo_uf`) REFERENCES `estados` (`codigo_uf`)
+    """,
+}
+
+
+# ==============================================================================
+# --- Leitura do base_db.sql ---
+# ==============================================================================
+_RE_INSERT = re.compile(
+    r"INSERT\s+INTO\s+`?(\w+)`?\s*(?:\(([^)]*)\))?\s*VALUES", re.IGNORECASE
+)
+_RE_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<abre>\()
+      | (?P<fecha>\))
+      | (?P<virgula>,)
+      | (?P<fim>;)
+      | '(?P<aspas>(?:[^'\\]|\\.|'')*)'
+      | "(?P<aspas_duplas>(?:[^"\\]|\\.|"")*)"
+      | (?P<numero>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+      | (?P<palavra>TRUE|FALSE|NULL)
+    )""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_PALAVRAS = {"true": 1, "false": 0, "null": None}
+
+
+def _valor(m):
+    if m.group("aspas") is not None:
+        return m.group("aspas").replace("''", "'").replace("\\'", "'")
+    if m.group("aspas_duplas") is not None:
+        return m.group("aspas_duplas").replace('""', '"').replace('\\"', '"')
+    if m.group("numero") is not None:
+        texto = m.group("numero")
+        return float(texto) if any(c in texto for c in ".eE") else int(texto)
+    return _PALAVRAS[m.group("palavra").lower()]
+
+
+def ler_base_sql(caminho: str) -> Dict[str, List[tuple]]:
+    """Extrai as linhas dos INSERTs do script, na ordem de COLUNAS[tabela]."""
+    with open(caminho, encoding="utf-8") as f:
+        texto = f.read()
+
+    dados: Dict[str, List[tuple]] = {t: [] for t in TABELAS}
+    for cab in _RE_INSERT.finditer(texto):
+        tabela = cab.group(1).lower()
+        if tabela not in dados:
+            continue
+        colunas = (
+            [c.strip(" `") for c in cab.group(2).split(",")] if cab.group(2) else list(COLUNAS[tabela])
+        )
+        ordem = [colunas.index(c) for c in COLUNAS[tabela]]
+
+        pos, linha = cab.end(), None
+        while True:
+            m = _RE_TOKEN.match(texto, pos)
+            if m is None:
+                raise ValueError(f"Sintaxe inesperada em '{caminho}' perto de: {texto[pos:pos + 40]!r}")
+            pos = m.end()
+            if m.group("abre"):
+                linha = []
+            elif m.group("fecha"):
+                dados[tabela].append(tuple(linha[i] for i in ordem))
+                linha = None
+            elif m.group("virgula"):
+                continue
+            elif m.group("fim"):
+                break
+            else:
+                linha.append(_valor(m))
+
+    return dados
+
+
+def checksum(tabela: str, linhas: List[tuple]) -> str:
+    conteudo = json.dumps([COLUNAS[tabela], linhas], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+# ==============================================================================
+# --- Carga ---
+# ==============================================================================
+def _em_lotes(linhas: List[tuple]):
+    for i in range(0, len(linhas), LOTE_INSERCAO):
+        yield linhas[i:i + LOTE_INSERCAO]
+
+
+def _tabela_existe(cursor, tabela: str, dialeto: str) -> bool:
+    if dialeto == "sqlite":
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", (tabela,))
+    else:
+        cursor.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            (tabela,),
+        )
+    return cursor.fetchone() is not None
+
+
+def _sql_upsert(tabela: str, dialeto: str) -> str:
+    colunas = list(COLUNAS[tabela])
+    valores = ["%s"] * len(colunas)
+    if tabela == "municipios" and dialeto != "sqlite":
+        # Monta a coluna POINT na própria inserção em lote
+        colunas.append("coordenada")
+        valores.append("ST_SRID(POINT(%s, %s), 4326)")
+
+    pk = CHAVE_PRIMARIA[tabela]
+    atualizar = [c for c in colunas if c != pk]
+    sql = f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join(valores)})"
+    if dialeto == "sqlite":
+        sets = ", ".join(f"{c} = excluded.{c}" for c in atualizar)
+        return f"{sql} ON CONFLICT ({pk}) DO UPDATE SET {sets}"
+    sets = ", ".join(f"{c} = VALUES({c})" for c in atualizar)
+    return f"{sql} ON DUPLICATE KEY UPDATE {sets}"
+
+
+def _tabela_vazia(cursor, tabela: str) -> bool:
+    cursor.execute(f"SELECT 1 AS existe FROM {tabela} LIMIT 1")
+    return cursor.fetchone() is None
+
+
+def _carregar_tabela(cursor, tabela: str, linhas: List[tuple], dialeto: str) -> int:
+    """Grava as linhas da tabela; retorna quantas foram enviadas ao banco."""
+    if tabela == "redes_ptp":
+        # Nunca remove/duplica redes cadastradas pelo painel: só inclui pares novos
+        from api.core.ptp_snapshot import normalizar_texto
+
+        cursor.execute("SELECT rede_ptp, codigo_ibge FROM redes_ptp")
+        existentes = {(normalizar_texto(r["rede_ptp"]), int(r["codigo_ibge"])) for r in cursor.fetchall()}
+        novas = []
+        for codigo_ibge, codigo_uf, rede in linhas:
+            chave = (normalizar_texto(rede), int(codigo_ibge))
+            if chave not in existentes:
+                existentes.add(chave)
+                novas.append((codigo_ibge, codigo_uf, rede))
+        sql = "INSERT INTO redes_ptp (codigo_ibge, codigo_uf, rede_ptp) VALUES (%s, %s, %s)"
+        for lote in _em_lotes(novas):
+            cursor.executemany(sql, lote)
+        return len(novas)
+
+    sql = _sql_upsert(tabela, dialeto)
+    if tabela == "municipios" and dialeto != "sqlite":
+        # latitude = posição 2, longitude = posição 3
+        linhas = [linha + (linha[3], linha[2]) for linha in linhas]
+    for lote in _em_lotes(linhas):
+        cursor.executemany(sql, lote)
+    return len(linhas)
+
+
+def carregar(cursor, dialeto: str, caminho: str = None, forcar: bool = False,
+             redes_ptp: bool = False) -> Dict[str, str]:
+    """
+    Cria o esquema (se preciso) e carrega as tabelas cujo checksum mudou.
+    redes_ptp com dados só é tocada com `redes_ptp=True` (inclui os pares que faltam).
+    `cursor` deve ser dictionary=True com placeholders %s (Database.transaction()).
+    Retorna {tabela: "carregada"|"inalterada"|"preservada"}.
+    """
+    caminho = caminho or EnvConfig.SQLITE_BASE_SQL
+    dados = ler_base_sql(caminho)
+
+    cursor.execute(SQL_CHECKSUMS)
+    cursor.execute("SELECT tabela, checksum FROM carga_referencia")
+    anteriores = {r["tabela"]: r["checksum"] for r in cursor.fetchall()}
+
+    if dialeto != "sqlite":
+        cursor.execute("SET unique_checks = 0")
+
+    situacao = {}
+    try:
+        for tabela in TABELAS:
+            linhas = dados[tabela]
+            soma = checksum(tabela, linhas)
+            nova = not _tabela_existe(cursor, tabela, dialeto)
+
+            if not nova and not forcar and anteriores.get(tabela) == soma:
+                situacao[tabela] = "inalterada"
+                logger.info(f"Tabela '{tabela}' inalterada (checksum {soma[:12]}), pulando.")
+                continue
+
+            if tabela == "redes_ptp" and not nova and not redes_ptp and not _tabela_vazia(cursor, tabela):
+                # O painel é dono da tabela depois da primeira carga
+                situacao[tabela] = "preservada"
+                logger.info(f"Tabela '{tabela}' já tem dados (mantidos pelo painel), pulando. Use --redes-ptp para incluir as que faltam.")
+                continue
+
+            if nova and dialeto != "sqlite":
+                cursor.execute(DDL_MYSQL[tabela])
+
+            enviadas = _carregar_tabela(cursor, tabela, linhas, dialeto)
+
+            # Índices/constraints só depois da carga (build único e ordenado)
+            if nova and dialeto != "sqlite" and tabela in INDICES_MYSQL:
+                cursor.execute(INDICES_MYSQL[tabela])
+
+            cursor.execute("DELETE FROM carga_referencia WHERE tabela = %s", (tabela,))
+            cursor.execute(
+                "INSERT INTO carga_referencia (tabela, checksum, linhas, carregado_em) VALUES (%s, %s, %s, %s)",
+                (tabela, soma, len(linhas), datetime.now().isoformat(timespec="seconds")),
+            )
+            situacao[tabela] = "carregada"
+            logger.info(f"Tabela '{tabela}' carregada: {enviadas} de {len(linhas)} linhas gravadas.")
+    finally:
+        if dialeto != "sqlite":
+            cursor.execute("SET unique_checks = 1")
+
+    return situacao
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga da base de referência (estados, municípios e redes PTP).")
+    parser.add_argument("--arquivo", default=EnvConfig.SQLITE_BASE_SQL, help="Script SQL com os INSERTs de referência.")
+    parser.add_argument("--forcar", action="store_true", help="Recarrega mesmo que o checksum não tenha mudado.")
+    parser.add_argument(
+        "--redes-ptp", action="store_true",
+        help="Inclui em redes_ptp os pares (rede, cidade) do arquivo que faltam, mesmo com a tabela já preenchida "
+             "(traz de volta redes removidas pelo painel).",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from api.core.database import Database
+
+    with Database.transaction() as cursor:
+        situacao = carregar(
+            cursor, Database.dialeto(), caminho=args.arquivo, forcar=args.forcar, redes_ptp=args.redes_ptp
+        )
+
+    for tabela, estado in situacao.items():
+        print(f"{tabela}: {estado}")
+
+
+if __name__ == "__main__":
+    main()
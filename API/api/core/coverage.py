@@ -0,0 +1,245 @@
+# api/core/coverage.py
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from api.core.settings import EnvConfig
+
+import logging
+
+
+CRS_GEOGRAFICO = "EPSG:4326"
+CRS_PROJETADO = "EPSG:5880"
+
+# Acima dessa velocidade (Mbps) um ponto dentro da mancha precisa de verificação PTP
+VELOCIDADE_MAXIMA_EXPRESSA = 500
+
+
+def listar_kmz(pasta_kmz: str):
+    """Arquivos .kmz de cobertura da pasta, em ordem de nome."""
+    if not os.path.isdir(pasta_kmz):
+        return []
+    return sorted(
+        os.path.join(pasta_kmz, f) for f in os.listdir(pasta_kmz) if f.lower().endswith(".kmz")
+    )
+
+
+def assinatura_cobertura(pasta_kmz: str) -> str:
+    """
+    Versão das manchas de cobertura: muda quando um KMZ é incluído, removido
+    ou alterado (nome, tamanho e data de modificação), sem ler os arquivos.
+    """
+    partes = []
+    for caminho in listar_kmz(pasta_kmz):
+        info = os.stat(caminho)
+        partes.append(f"{os.path.basename(caminho)}:{info.st_size}:{info.st_mtime_ns}")
+    return hashlib.sha1("\n".join(partes).encode("utf-8")).hexdigest()
+
+
+def _kml_extraido(arquivo_kmz: str, pasta_kmz: str) -> Optional[str]:
+    """
+    Caminho do KML extraído do KMZ em `pasta_kmz/temp/<nome>`. O nome do arquivo
+    leva o tamanho e o mtime do KMZ: um KMZ substituído gera nova extração em vez
+    de reaproveitar o KML antigo. A escrita vai para um temporário e entra com
+    `os.replace`, pois vários processos podem extrair o mesmo KMZ ao mesmo tempo.
+    """
+    basename = os.path.basename(arquivo_kmz).split('.')[0]
+    temp_dir = os.path.join(pasta_kmz, "temp", basename)
+    try:
+        info = os.stat(arquivo_kmz)
+        os.makedirs(temp_dir, exist_ok=True)
+    except OSError as e:
+        print(f"❌ Erro ao extrair '{arquivo_kmz}': {e}")
+        return None
+    caminho_kml = os.path.join(temp_dir, f"{basename}_{info.st_size}_{info.st_mtime_ns}.kml")
+    if os.path.exists(caminho_kml):
+        return caminho_kml
+
+    temporario = None
+    try:
+        with zipfile.ZipFile(arquivo_kmz, 'r') as kmz:
+            kml_filename = next((f for f in kmz.namelist() if f.lower().endswith('.kml')), None)
+            if not kml_filename: return None
+            print(f"⚠️  Extraindo: '{os.path.basename(arquivo_kmz)}'")
+            fd, temporario = tempfile.mkstemp(dir=temp_dir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as destino, kmz.open(kml_filename) as origem:
+                shutil.copyfileobj(origem, destino)
+        os.replace(temporario, caminho_kml)
+        temporario = None
+    except Exception as e:
+        print(f"❌ Erro ao extrair '{arquivo_kmz}': {e}")
+        return None
+    finally:
+        if temporario:
+            try: os.remove(temporario)
+            except OSError: pass
+
+    # Extrações de versões anteriores do KMZ (e o formato antigo, sem assinatura)
+    for nome in os.listdir(temp_dir):
+        if nome.lower().endswith('.kml') and os.path.join(temp_dir, nome) != caminho_kml:
+            try: os.remove(os.path.join(temp_dir, nome))
+            except OSError: pass
+    return caminho_kml
+
+
+def extrair_poligonos(arquivo_kmz: str, pasta_kmz: str):
+    """
+    Polígonos válidos de um KMZ (todas as camadas do KML), como GeoDataFrame.
+    O KML é extraído para `pasta_kmz/temp/<nome>` e reaproveitado enquanto o KMZ não mudar.
+    """
+    import fiona
+    import geopandas as gpd
+    import pandas as pd
+
+    caminho_kml = _kml_extraido(arquivo_kmz, pasta_kmz)
+    if not caminho_kml:
+        return None
+    try:
+        with fiona.Env():
+            camadas = fiona.listlayers(caminho_kml)
+        lista_de_gdfs = []
+        for camada in camadas:
+            try:
+                gdf_camada = gpd.read_file(caminho_kml, driver='KML', layer=camada)
+                gdf_camada = gdf_camada[gdf_camada.geometry.type.isin(['Polygon', 'MultiPolygon']) & gdf_camada.geometry.is_valid]
+                if not gdf_camada.empty:
+                    lista_de_gdfs.append(gdf_camada)
+            except Exception:
+                continue
+        if not lista_de_gdfs: return None
+        return gpd.GeoDataFrame(pd.concat(lista_de_gdfs, ignore_index=True), crs=CRS_GEOGRAFICO)
+    except Exception as e:
+        print(f"❌ Erro ao ler KML '{caminho_kml}': {e}")
+        return None
+
+
+class CoverageIndex:
+    """
+    Índice em memória das manchas GPON para consultas de um ponto:
+    STRtree dos polígonos em coordenadas geográficas (ponto dentro) e
+    projetadas em EPSG:5880 (mancha mais próxima, distância em metros).
+    Imutável depois de montado; uma nova versão substitui a anterior inteira.
+    """
+
+    def __init__(self, pasta_kmz: str, versao: str):
+        import geopandas as gpd
+        import pandas as pd
+        from pyproj import Transformer
+        from shapely import STRtree
+
+        self.versao = versao
+        gdfs = []
+        for caminho in listar_kmz(pasta_kmz):
+            gdf = extrair_poligonos(caminho, pasta_kmz)
+            if gdf is not None:
+                gdf['Mancha GPON'] = os.path.basename(caminho).split('.')[0]
+                gdfs.append(gdf[['Mancha GPON', 'geometry']])
+
+        if gdfs:
+            manchas = gpd.GeoDataFrame(pd.concat(gdfs, ignore_index=True), crs=CRS_GEOGRAFICO)
+        else:
+            manchas = gpd.GeoDataFrame({'Mancha GPON': []}, geometry=[], crs=CRS_GEOGRAFICO)
+
+        self._nomes = manchas['Mancha GPON'].to_numpy()
+        self._arvore = STRtree(manchas.geometry.values)
+        self._arvore_proj = STRtree(manchas.to_crs(CRS_PROJETADO).geometry.values)
+        self._projetar = Transformer.from_crs(CRS_GEOGRAFICO, CRS_PROJETADO, always_xy=True)
+
+    def __len__(self) -> int:
+        return len(self._nomes)
+
+    def _agrupar(self, pares: np.ndarray, n: int) -> List[List[str]]:
+        """Nomes das manchas de cada ponto a partir dos pares (ponto, polígono) do STRtree."""
+        manchas: List[List[str]] = [[] for _ in range(n)]
+        # Mesma regra da análise: nomes únicos, na ordem dos polígonos
+        ordem = np.lexsort((pares[1], pares[0]))
+        for ponto, poligono in zip(pares[0][ordem].tolist(), pares[1][ordem].tolist()):
+            nome = self._nomes[poligono]
+            if nome not in manchas[ponto]:
+                manchas[ponto].append(nome)
+        return manchas
+
+    def consultar_lote(self, lat: np.ndarray, lon: np.ndarray, raio_metros: float = 0.0,
+                       velocidade: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Situação GPON de vários pontos de uma vez, com as regras da análise em lote:
+        dentro de mancha (Viabilidade Expressa / Verificar PTP), próximo dentro
+        do raio (Próximo à mancha) ou Inviável. Coordenadas devem ser válidas.
+        """
+        import shapely
+
+        n = len(lat)
+        if velocidade is None:
+            velocidade = np.zeros(n)
+        resultados: List[Optional[Dict]] = [None] * n
+
+        dentro = self._arvore.query(shapely.points(lon, lat), predicate="within")
+        for i, manchas in enumerate(self._agrupar(dentro, n)):
+            if manchas:
+                status = "Viabilidade Expressa" if velocidade[i] <= VELOCIDADE_MAXIMA_EXPRESSA else "Verificar PTP"
+                resultados[i] = {"status": status, "manchas": manchas, "dist_gpon_m": 0.0}
+
+        fora = np.array([i for i in range(n) if resultados[i] is None], dtype=np.intp)
+        if raio_metros > 0 and len(self) and len(fora):
+            x, y = self._projetar.transform(lon[fora], lat[fora])
+            pares, distancias = self._arvore_proj.query_nearest(
+                shapely.points(x, y), max_distance=raio_metros, return_distance=True, all_matches=True
+            )
+            manchas_fora = self._agrupar(pares, len(fora))
+            menor = np.full(len(fora), np.inf)
+            np.minimum.at(menor, pares[0], distancias)
+            for j, i in enumerate(fora.tolist()):
+                if manchas_fora[j]:
+                    resultados[i] = {
+                        "status": "Próximo à mancha",
+                        "manchas": manchas_fora[j],
+                        "dist_gpon_m": round(float(menor[j]), 2),
+                    }
+
+        return [r or {"status": "Inviável", "manchas": [], "dist_gpon_m": None} for r in resultados]
+
+    def consultar(self, lat: float, lon: float, raio_metros: float = 0.0, velocidade: float = 0) -> Dict:
+        """Situação GPON de um único ponto (ver consultar_lote)."""
+        return self.consultar_lote(np.array([lat]), np.array([lon]), raio_metros, np.array([velocidade]))[0]
+
+
+class CoverageCache:
+    """
+    Mantém o CoverageIndex do processo e o reconstrói quando os arquivos KMZ
+    mudam (assinatura conferida a cada COVERAGE_INDEX_TTL segundos).
+    """
+
+    __indice: Optional[CoverageIndex] = None
+    __verificado_em = 0.0
+    __lock = threading.Lock()
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def obter(cls) -> Optional[CoverageIndex]:
+        return cls.__indice
+
+    @classmethod
+    def precisa_verificar(cls) -> bool:
+        return cls.__indice is None or time.monotonic() - cls.__verificado_em > EnvConfig.COVERAGE_INDEX_TTL
+
+    @classmethod
+    def verificar_versao(cls) -> CoverageIndex:
+        """Confere a assinatura dos KMZ e reconstrói o índice se ela mudou."""
+        with cls.__lock:
+            if not cls.precisa_verificar():
+                return cls.__indice
+
+            versao = assinatura_cobertura(EnvConfig.KMZ_DIR)
+            if cls.__indice is None or cls.__indice.versao != versao:
+                cls.__indice = CoverageIndex(EnvConfig.KMZ_DIR, versao=versao)
+                cls.logger.info(f"📌 Índice de cobertura carregado ({len(cls.__indice)} polígonos).")
+
+            cls.__verificado_em = time.monotonic()
+            return cls.__indice
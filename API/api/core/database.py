@@ -1,39 +1,225 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector.errors import PoolError
 from .settings import EnvConfig
+from .sqlite_backend import SQLiteBackend
 
 import logging
 
 
+class _PooledConnection:
+    """
+    Conexão emprestada pelo ConnectionPool.
+    Repassa tudo para a conexão real; close() devolve ao pool em vez de fechar.
+    """
+
+    def __init__(self, pool: "ConnectionPool", cnx, criada_em: float):
+        self._pool = pool
+        self._cnx = cnx
+        self._criada_em = criada_em
+        self._devolvida = False
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def close(self):
+        if not self._devolvida:
+            self._devolvida = True
+            self._pool._devolver(self._cnx, self._criada_em)
+
+
+class ConnectionPool:
+    """
+    Pool de conexões MySQL com espera (timeout) quando esgotado,
+    reciclagem por idade, ping em conexões ociosas e métricas de uso.
+    """
+
+    def __init__(self, size: int, recycle: float, ping_interval: float, timeout: float, **connect_args):
+        self.size = size
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.timeout = timeout
+        self._connect_args = connect_args
+
+        self._livres = deque()  # (conexão, criada_em, devolvida_em)
+        self._vagas = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._em_uso = 0
+        self._pico_em_uso = 0
+        self._checkouts = 0
+        self._falhas_checkout = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._criadas = 0
+        self._recicladas = 0
+        self._pings_falhos = 0
+
+    def get_connection(self, timeout: float = None) -> _PooledConnection:
+        """Pega uma conexão, aguardando até `timeout` segundos se o pool estiver esgotado."""
+        timeout = self.timeout if timeout is None else timeout
+        inicio = time.monotonic()
+
+        if not self._vagas.acquire(timeout=timeout):
+            with self._lock:
+                self._falhas_checkout += 1
+            raise PoolError(f"Pool de conexões esgotado: nenhuma conexão livre após {timeout}s.")
+
+        espera = time.monotonic() - inicio
+        try:
+            cnx, criada_em = self._obter_ou_criar()
+        except Exception:
+            self._vagas.release()
+            with self._lock:
+                self._falhas_checkout += 1
+            raise
+
+        with self._lock:
+            self._checkouts += 1
+            self._em_uso += 1
+            self._pico_em_uso = max(self._pico_em_uso, self._em_uso)
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+
+        return _PooledConnection(self, cnx, criada_em)
+
+    def _obter_ou_criar(self):
+        """Reaproveita uma conexão livre (reciclando/pingando se preciso) ou abre uma nova."""
+        while True:
+            with self._lock:
+                item = self._livres.pop() if self._livres else None
+            if item is None:
+                break
+
+            cnx, criada_em, devolvida_em = item
+            agora = time.monotonic()
+
+            if self.recycle and agora - criada_em > self.recycle:
+                self._fechar(cnx)
+                with self._lock:
+                    self._recicladas += 1
+                continue
+
+            if agora - devolvida_em > self.ping_interval:
+                try:
+                    cnx.ping(reconnect=False)
+                except Exception:
+                    self._fechar(cnx)
+                    with self._lock:
+                        self._pings_falhos += 1
+                    continue
+
+            return cnx, criada_em
+
+        cnx = mysql.connector.connect(**self._connect_args)
+        with self._lock:
+            self._criadas += 1
+        return cnx, time.monotonic()
+
+    def _devolver(self, cnx, criada_em: float):
+        try:
+            # Equivalente ao pool_reset_session: não deixa transação aberta para o próximo
+            if cnx.is_connected():
+                if cnx.in_transaction:
+                    cnx.rollback()
+                with self._lock:
+                    self._livres.append((cnx, criada_em, time.monotonic()))
+            else:
+                self._fechar(cnx)
+        except Exception:
+            self._fechar(cnx)
+        finally:
+            with self._lock:
+                self._em_uso -= 1
+            self._vagas.release()
+
+    @staticmethod
+    def _fechar(cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "tamanho": self.size,
+                "em_uso": self._em_uso,
+                "livres": len(self._livres),
+                "pico_em_uso": self._pico_em_uso,
+                "checkouts": self._checkouts,
+                "falhas_checkout": self._falhas_checkout,
+                "espera_total_s": round(self._espera_total, 4),
+                "espera_media_ms": round(1000 * self._espera_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "espera_max_ms": round(1000 * self._espera_max, 3),
+                "conexoes_criadas": self._criadas,
+                "conexoes_recicladas": self._recicladas,
+                "pings_falhos": self._pings_falhos,
+            }
+
+
 class Database:
-    """Gerenciador de conexões MySQL com Pool automático."""
+    """
+    Gerenciador de conexões MySQL com Pool automático.
+    Com DB_BACKEND=sqlite usa o backend embarcado (SQLiteBackend) com a mesma interface.
+    """
 
     __pool = None
+    __executor = None
+    __executor_lock = threading.Lock()
     logger = logging.getLogger("uvicorn.info")
 
+    @classmethod
+    def dialeto(cls) -> str:
+        """'mysql' ou 'sqlite', para os poucos SQLs que diferem entre os bancos."""
+        return EnvConfig.DB_BACKEND
+
     @classmethod
     def init_pool(cls):
         """Inicializa o pool com configurações do .env."""
+        if EnvConfig.DB_BACKEND == "sqlite":
+            SQLiteBackend.inicializar()
+            return
         if cls.__pool is None:
-            cls.__pool = pooling.MySQLConnectionPool(
-                pool_name="analysis_pool",
-                pool_size=EnvConfig.DB_POOL_SIZE,
-                pool_reset_session=True,
+            cls.__pool = ConnectionPool(
+                size=EnvConfig.DB_POOL_SIZE,
+                recycle=EnvConfig.DB_POOL_RECYCLE,
+                ping_interval=EnvConfig.DB_POOL_PING_INTERVAL,
+                timeout=EnvConfig.DB_POOL_TIMEOUT,
                 host=EnvConfig.DB_HOST,
                 port=EnvConfig.DB_PORT,
                 user=EnvConfig.DB_USER,
                 password=EnvConfig.DB_PASS,
                 database=EnvConfig.DB_NAME
             )
-            cls.logger.info("📌 Pool de conexões MySQL inicializado.")
+            cls.logger.info(f"📌 Pool de conexões MySQL inicializado ({EnvConfig.DB_POOL_SIZE} conexões).")
 
     @classmethod
     def get_connection(cls):
-        """Pega uma conexão do Pool (ou inicializa se preciso)."""
+        """Pega uma conexão do Pool (ou inicializa se preciso), aguardando se estiver esgotado."""
+        if EnvConfig.DB_BACKEND == "sqlite":
+            return SQLiteBackend.get_connection()
         if cls.__pool is None:
             cls.init_pool()
         return cls.__pool.get_connection()
 
+    @classmethod
+    def metricas(cls) -> dict:
+        """Métricas de saturação do pool (expostas em /metrics)."""
+        if EnvConfig.DB_BACKEND == "sqlite":
+            return {"backend": "sqlite"}
+        if cls.__pool is None:
+            return {}
+        return cls.__pool.metricas()
+
     @classmethod
     def query(cls, sql: str, params=None, fetchone=False):
         """Executa SELECT, INSERT, UPDATE, DELETE com segurança."""
@@ -55,3 +241,58 @@ class Database:
         finally:
             cursor.close()
             conn.close()
+
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        """
+        Cursor para várias instruções em uma única transação/conexão.
+        Faz commit ao final do bloco e rollback se ocorrer qualquer erro.
+        """
+        conn = cls.get_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Acesso assíncrono (para os endpoints async do FastAPI)
+    # ------------------------------------------------------------------
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Executor dedicado e limitado para as chamadas bloqueantes ao banco."""
+        if cls.__executor is None:
+            with cls.__executor_lock:
+                if cls.__executor is None:
+                    cls.__executor = ThreadPoolExecutor(
+                        max_workers=EnvConfig.DB_EXECUTOR_WORKERS,
+                        thread_name_prefix="db"
+                    )
+        return cls.__executor
+
+    @classmethod
+    async def run(cls, func, *args, **kwargs):
+        """
+        Executa uma função bloqueante de banco (ex: métodos do PTPModel)
+        no executor dedicado, sem travar o event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(cls.get_executor(), functools.partial(func, *args, **kwargs))
+
+    @classmethod
+    async def aquery(cls, sql: str, params=None, fetchone=False):
+        """Versão assíncrona de query(), com a mesma semântica."""
+        return await cls.run(cls.query, sql, params=params, fetchone=fetchone)
+
+    @classmethod
+    def shutdown(cls):
+        """Encerra o executor do banco (chamado no desligamento da API)."""
+        if cls.__executor is not None:
+            cls.__executor.shutdown(wait=True)
+            cls.__executor = None
@@ -1,5 +1,8 @@
-from openpyxl.styles import PatternFill, Border, Side, Alignment, Font
-from openpyxl import load_workbook
+from collections import Counter
+from typing import Dict
+
+import pandas as pd
+import xlsxwriter
 
 # Cores usadas para Status
 STATUS_COLORS = {
@@ -20,73 +23,214 @@ NOVAS_COLUNAS_ANALISE = [
     "Rede PTP"
 ]
 
+# Aba com o resumo por aba (resultado de planilhas com várias abas)
+ABA_RESUMO = "Resumo"
+
 # Cor do cabeçalho para colunas novas
 HEADER_NOVO = "4472C4"  # azul escuro profissional
 
-def autoajuste(path_excel: str):
-    wb = load_workbook(path_excel)
-    ws = wb.active
-
-    # Congelar cabeçalho
-    ws.freeze_panes = "A2"
-
-    # ↓↓↓ Identificar colunas novas ↓↓↓
-    col_novas = {}
-    for col in range(1, ws.max_column + 1):
-        header = ws.cell(row=1, column=col).value
-        if header in NOVAS_COLUNAS_ANALISE:
-            col_novas[header] = col
-
-    col_status = col_novas.get("Status")
-
-    # =====================
-    #  1. COLORIR LINHAS
-    # =====================
-    if col_status:
-        for row in range(2, ws.max_row + 1):
-            status = ws.cell(row=row, column=col_status).value
-            cor = STATUS_COLORS.get(status)
+# Formato das datas (o mesmo que o pandas usa no Excel)
+FORMATO_DATA = "YYYY-MM-DD HH:MM:SS"
+
+# Opções do xlsxwriter: grava linha a linha (memória constante), mantém textos
+# como texto (sem transformar "=..." em fórmula ou "http..." em link) e grava
+# infinitos como erro do Excel, como o pandas faz
+OPCOES_WORKBOOK = {
+    "constant_memory": True,
+    "nan_inf_to_errors": True,
+    "strings_to_formulas": False,
+    "strings_to_urls": False,
+    "strings_to_numbers": False,
+}
+
+
+class _Formatos:
+    """Cache dos formatos do workbook: borda fina e alinhamento vertical em todas as células."""
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.cache = {}
+
+    def obter(self, cor: str = None, data: bool = False, cabecalho: bool = False):
+        chave = (cor, data, cabecalho)
+        if chave not in self.cache:
+            props = {"border": 1, "border_color": "#000000", "valign": "vcenter"}
             if cor:
-                fill = PatternFill(start_color=cor, end_color=cor, fill_type="solid")
-                for header, col in col_novas.items():
-                    ws.cell(row=row, column=col).fill = fill
-
-    # =============================================
-    #  2. APLICAR BORDA EM TODA A PLANILHA
-    # =============================================
-    thin = Side(border_style="thin", color="000000")
-    border = Border(top=thin, left=thin, right=thin, bottom=thin)
-
-    for row in ws.iter_rows():
-        for cell in row:
-            cell.border = border
-            cell.alignment = Alignment(vertical="center")
-
-    # ============================================================
-    #  3. COLORIR CABEÇALHO DAS NOVAS COLUNAS
-    # ============================================================
-    header_fill = PatternFill(start_color=HEADER_NOVO, end_color=HEADER_NOVO, fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-
-    for header, col in col_novas.items():
-        cell = ws.cell(row=1, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-
-    # =============================================
-    #  4. AUTOAJUSTE DE COLUNA
-    # =============================================
-    for column_cells in ws.columns:
-        max_length = 0
-        column_letter = column_cells[0].column_letter
-
-        for cell in column_cells:
-            try:
-                text = str(cell.value)
-                max_length = max(max_length, len(text))
-            except:
-                pass
-
-        ws.column_dimensions[column_letter].width = max_length + 2
-
-    wb.save(path_excel)
+                props.update({"bg_color": f"#{cor}", "pattern": 1})
+            if data:
+                props["num_format"] = FORMATO_DATA
+            if cabecalho and cor:
+                props.update({"bold": True, "font_color": "#FFFFFF"})
+            self.cache[chave] = self.workbook.add_format(props)
+        return self.cache[chave]
+
+
+def _valores_coluna(serie: pd.Series):
+    """Valores da coluna como objetos Python, com None nas células vazias."""
+    if pd.api.types.is_datetime64_any_dtype(serie) and getattr(serie.dt, "tz", None) is not None:
+        # Excel não guarda fuso horário
+        serie = serie.dt.tz_localize(None)
+    valores = serie.astype(object)
+    return valores.where(serie.notna(), None).tolist()
+
+
+def _eh_data(serie: pd.Series) -> bool:
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return True
+    if serie.dtype == object:
+        return pd.api.types.infer_dtype(serie, skipna=True) in ("datetime", "datetime64", "date")
+    return False
+
+
+def _largura(serie: pd.Series) -> int:
+    """Maior texto entre os valores da coluna."""
+    if not len(serie):
+        return 0
+    tamanhos = serie.astype(str).where(serie.notna(), "").str.len()
+    return int(tamanhos.max())
+
+
+def nome_aba_resumo(abas) -> str:
+    """ABA_RESUMO, ou uma variação se a planilha já tiver uma aba com esse nome."""
+    existentes = {str(aba).lower() for aba in abas}
+    nome, n = ABA_RESUMO, 1
+    while nome.lower() in existentes:
+        n += 1
+        nome = f"{ABA_RESUMO} ({n})"
+    return nome
+
+
+class _AbaExcel:
+    """Estado de uma aba sendo gravada: colunas, larguras e próxima linha."""
+
+    def __init__(self, ws, formatos: _Formatos, colunas):
+        self.ws = ws
+        self.formatos = formatos
+        self.colunas = list(colunas)
+        self.novas = [header in NOVAS_COLUNAS_ANALISE for header in self.colunas]
+        self.larguras = [len(str(header)) for header in self.colunas]
+        self.linha = 1
+
+        # Congelar cabeçalho
+        self.ws.freeze_panes(1, 0)
+
+        # =============================================
+        #  1. CABEÇALHO (colunas novas em destaque)
+        # =============================================
+        for i, header in enumerate(self.colunas):
+            self.ws.write(0, i, str(header), self.formatos.obter(HEADER_NOVO if self.novas[i] else None, cabecalho=True))
+
+    def adicionar(self, df: pd.DataFrame):
+        # =============================================
+        #  2. LINHAS (colunas novas na cor do Status)
+        # =============================================
+        colunas = range(len(self.colunas))
+        datas = [_eh_data(df.iloc[:, i]) for i in colunas]
+        for i in colunas:
+            self.larguras[i] = max(self.larguras[i], _largura(df.iloc[:, i]))
+
+        if "Status" in df.columns:
+            cores = [STATUS_COLORS.get(status) for status in df["Status"].tolist()]
+        else:
+            cores = [None] * len(df)
+
+        base = [self.formatos.obter(data=datas[i]) for i in colunas]
+        valores = [_valores_coluna(df.iloc[:, i]) for i in colunas]
+
+        for cor, celulas in zip(cores, zip(*valores)):
+            for i, valor in enumerate(celulas):
+                formato = self.formatos.obter(cor, datas[i]) if cor and self.novas[i] else base[i]
+                self.ws.write(self.linha, i, valor, formato)
+            self.linha += 1
+
+    def ajustar_larguras(self):
+        # =============================================
+        #  3. LARGURA DAS COLUNAS
+        # =============================================
+        for i, largura in enumerate(self.larguras):
+            self.ws.set_column(i, i, largura + 2)
+
+
+class EscritorExcel:
+    """
+    Grava o resultado já formatado, bloco a bloco (memória constante):
+    - cabeçalho congelado; o das colunas novas da análise em azul e negrito;
+    - colunas novas coloridas pela cor do Status de cada linha;
+    - borda fina e alinhamento vertical centralizado em todas as células;
+    - largura das colunas: maior texto entre o cabeçalho e os valores, mais 2
+      (aplicada no fechamento, depois de todos os blocos).
+    Com `colunas`, grava uma única aba ("Sheet1"); sem, as abas são criadas
+    com nova_aba e os blocos podem chegar intercalados entre elas.
+    """
+
+    def __init__(self, path_excel: str, colunas=None):
+        self.workbook = xlsxwriter.Workbook(path_excel, OPCOES_WORKBOOK)
+        self.formatos = _Formatos(self.workbook)
+        self.abas: Dict[str, _AbaExcel] = {}
+        if colunas is not None:
+            self.nova_aba("Sheet1", colunas)
+
+    def nova_aba(self, nome: str, colunas):
+        self.abas[nome] = _AbaExcel(self.workbook.add_worksheet(nome), self.formatos, colunas)
+
+    def adicionar(self, df: pd.DataFrame, aba: str = None):
+        """Acrescenta as linhas de `df` à aba (a primeira, se não informada)."""
+        destino = self.abas[aba] if aba is not None else next(iter(self.abas.values()))
+        destino.adicionar(df)
+
+    def adicionar_resumo(self, nome: str, resumo_abas: Dict[str, Dict[str, int]]):
+        """
+        Aba de resumo: uma linha por aba analisada e a linha Total, com a
+        quantidade de pontos de cada Status (da maior para a menor no total).
+        """
+        total = Counter()
+        for contagem in resumo_abas.values():
+            total.update(contagem)
+        status = [s for s, _ in total.most_common()]
+
+        linhas = [[aba] + [contagem.get(s, 0) for s in status] + [sum(contagem.values())]
+                  for aba, contagem in resumo_abas.items()]
+        linhas.append(["Total"] + [total[s] for s in status] + [sum(total.values())])
+
+        ws = self.workbook.add_worksheet(nome)
+        ws.freeze_panes(1, 1)
+        cabecalho = ["Aba"] + status + ["Total"]
+        for i, header in enumerate(cabecalho):
+            cor = STATUS_COLORS.get(header, HEADER_NOVO if header in status else None)
+            ws.write(0, i, header, self.formatos.obter(cor, cabecalho=True))
+        for n, linha in enumerate(linhas, start=1):
+            for i, valor in enumerate(linha):
+                ws.write(n, i, valor, self.formatos.obter())
+        for i, header in enumerate(cabecalho):
+            largura = max(len(str(linha[i])) for linha in [cabecalho] + linhas)
+            ws.set_column(i, i, largura + 2)
+
+    def fechar(self):
+        try:
+            for aba in self.abas.values():
+                aba.ajustar_larguras()
+        finally:
+            self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+        return False
+
+
+def salvar_excel(df: pd.DataFrame, path_excel: str):
+    """Grava o resultado já formatado em uma única passada (ver EscritorExcel)."""
+    with EscritorExcel(path_excel, df.columns) as escritor:
+        escritor.adicionar(df)
+
+
+def salvar_excel_abas(abas: Dict[str, pd.DataFrame], resumo_abas: Dict[str, Dict[str, int]],
+                      nome_resumo: str, path_excel: str):
+    """Resultado de uma planilha com várias abas: as mesmas abas e o resumo no fim."""
+    with EscritorExcel(path_excel) as escritor:
+        for nome, df in abas.items():
+            escritor.nova_aba(nome, df.columns)
+            escritor.adicionar(df, nome)
+        escritor.adicionar_resumo(nome_resumo, resumo_abas)
@@ -0,0 +1,466 @@
+# api/core/exportacao.py
+import os
+import re
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from api.core.excel_styler import NOVAS_COLUNAS_ANALISE
+
+import logging
+
+
+logger = logging.getLogger("uvicorn.info")
+
+# Formatos de download: extensão do arquivo e media type
+FORMATOS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+    "csv.gz": ("csv.gz", "application/gzip"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "geojson": ("geojson", "application/geo+json"),
+    "gpkg": ("gpkg", "application/geopackage+sqlite3"),
+}
+FORMATO_PADRAO = "xlsx"
+
+# Media types aceitos no header Accept para cada formato
+MEDIA_TYPES = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "text/csv": "csv",
+    "application/gzip": "csv.gz",
+    "application/x-gzip": "csv.gz",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/geo+json": "geojson",
+    "application/geopackage+sqlite3": "gpkg",
+}
+
+CRS_GEOGRAFICO = "EPSG:4326"
+
+# Planilhas com várias abas: colunas que identificam a aba e a linha (na aba) de cada linha do sidecar
+COLUNA_ABA = "Aba"
+COLUNA_LINHA = "Linha na Aba"
+
+
+class FormatoNaoSuportado(Exception):
+    """Nenhum dos formatos pedidos (parâmetro ou Accept) está disponível."""
+
+
+# ==============================================================================
+# --- Negociação ---
+# ==============================================================================
+def negociar_formato(formato: Optional[str], accept: Optional[str]) -> str:
+    """
+    Escolhe o formato do download: o parâmetro `format` tem prioridade; sem ele,
+    vale o media type de maior `q` do header Accept. Sem preferência: xlsx.
+    """
+    if formato:
+        formato = formato.strip().lower().lstrip(".")
+        if formato not in FORMATOS:
+            raise FormatoNaoSuportado(f"Formato '{formato}' não suportado. Disponíveis: {', '.join(FORMATOS)}")
+        return formato
+
+    if not accept:
+        return FORMATO_PADRAO
+
+    pedidos = []
+    for ordem, parte in enumerate(accept.split(",")):
+        campos = [c.strip() for c in parte.split(";")]
+        media_type, q = campos[0].lower(), 1.0
+        for campo in campos[1:]:
+            if campo.startswith("q="):
+                try:
+                    q = float(campo[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type and q > 0:
+            pedidos.append((-q, ordem, media_type))
+
+    for _, _, media_type in sorted(pedidos):
+        if media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+        if media_type in ("*/*", "application/*"):
+            return FORMATO_PADRAO
+    raise FormatoNaoSuportado(
+        f"Nenhum formato aceito está disponível. Disponíveis: {', '.join(MEDIA_TYPES)}"
+    )
+
+
+# ==============================================================================
+# --- Arquivo colunar (Arrow IPC) gravado junto do resultado ---
+# ==============================================================================
+def caminho_sidecar(result_path: str) -> str:
+    return os.path.splitext(result_path)[0] + ".arrow"
+
+
+def caminho_exportacao(result_path: str, formato: str) -> str:
+    return f"{os.path.splitext(result_path)[0]}.{FORMATOS[formato][0]}"
+
+
+def _tabela_arrow(df: pd.DataFrame):
+    """DataFrame como tabela Arrow; colunas com tipos misturados viram texto."""
+    import pyarrow as pa
+
+    colunas = {}
+    for nome in df.columns:
+        serie = df[nome]
+        try:
+            colunas[str(nome)] = pa.array(serie, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Ex.: "Dist. GPON (mts)" com números e "---"
+            colunas[str(nome)] = pa.array(serie.astype(str).where(serie.notna(), None), from_pandas=True)
+    return pa.table(colunas)
+
+
+def _gravar_atomico(destino: str, gravar):
+    """Grava em um arquivo temporário e renomeia: leitores nunca veem o arquivo pela metade."""
+    # Mantém a extensão no nome temporário (o driver do GeoPackage confere)
+    pasta, nome = os.path.split(destino)
+    temporario = os.path.join(pasta, f".tmp-{uuid.uuid4().hex}-{nome}")
+    try:
+        gravar(temporario)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+class EscritorSidecar:
+    """
+    Grava o sidecar Arrow bloco a bloco (análises fora da memória). O primeiro
+    bloco define o esquema (as colunas de `texto` são sempre gravadas como texto);
+    se um bloco seguinte não couber nele (tipos mudaram entre blocos), o sidecar
+    é descartado e ler_sidecar o recria a partir do .xlsx quando for preciso.
+    Com `partes` (ex.: abas gravadas em paralelo), cada parte vai para o seu
+    arquivo temporário e elas são juntadas nessa ordem ao fechar.
+    """
+
+    def __init__(self, result_path: str, texto=(), partes=(None,)):
+        self.texto = set(texto)
+        self.partes = list(partes)
+        self.destino = caminho_sidecar(result_path)
+        # parte -> (temporário, arquivo, writer)
+        self._spools = {}
+        self._esquema = None
+        self.descartado = False
+
+    def _temporario(self) -> str:
+        pasta, nome = os.path.split(self.destino)
+        return os.path.join(pasta, f".tmp-{uuid.uuid4().hex}-{nome}")
+
+    def adicionar(self, df: pd.DataFrame, parte=None):
+        import pyarrow as pa
+
+        if self.descartado:
+            return
+        # Texto como o _tabela_arrow gera para colunas misturadas (0.0 -> "0.0")
+        texto = [nome for nome in df.columns if str(nome) in self.texto]
+        if texto:
+            df = df.assign(**{str(nome): df[nome].astype(str).where(df[nome].notna(), None) for nome in texto})
+        tabela = _tabela_arrow(df)
+        if self._esquema is None:
+            # Colunas só com vazios no primeiro bloco ficam como texto
+            self._esquema = pa.schema([
+                campo.with_type(pa.string())
+                if pa.types.is_null(campo.type) or campo.name in self.texto else campo
+                for campo in tabela.schema
+            ])
+        if parte not in self._spools:
+            temporario = self._temporario()
+            arquivo = pa.OSFile(temporario, "wb")
+            self._spools[parte] = (temporario, arquivo, pa.ipc.new_file(arquivo, self._esquema))
+        try:
+            tabela = tabela.cast(self._esquema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            logger.warning(f"Arquivo colunar de {os.path.basename(self.destino)} descartado: {e}")
+            self.descartar()
+            return
+        self._spools[parte][2].write_table(tabela)
+
+    def _fechar_arquivos(self):
+        for _, arquivo, writer in self._spools.values():
+            if not arquivo.closed:
+                writer.close()
+                arquivo.close()
+
+    def _juntar(self, temporarios: List[str], caminho: str):
+        import pyarrow as pa
+
+        with pa.OSFile(caminho, "wb") as arquivo, pa.ipc.new_file(arquivo, self._esquema) as writer:
+            for temporario in temporarios:
+                with pa.memory_map(temporario, "r") as origem:
+                    leitor = pa.ipc.open_file(origem)
+                    for i in range(leitor.num_record_batches):
+                        writer.write_batch(leitor.get_batch(i))
+
+    def fechar(self) -> Optional[str]:
+        """Publica o sidecar (renomeando ou juntando os temporários). None se ele foi descartado."""
+        if self.descartado:
+            return None
+        self._fechar_arquivos()
+        temporarios = [self._spools[parte][0] for parte in self.partes if parte in self._spools]
+        if not temporarios:
+            return None
+        try:
+            if len(temporarios) == 1:
+                os.replace(temporarios[0], self.destino)
+            else:
+                _gravar_atomico(self.destino, lambda caminho: self._juntar(temporarios, caminho))
+        finally:
+            self._remover_temporarios()
+        return self.destino
+
+    def _remover_temporarios(self):
+        for temporario, _, _ in self._spools.values():
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        self._spools = {}
+
+    def descartar(self):
+        self.descartado = True
+        try:
+            self._fechar_arquivos()
+        finally:
+            self._remover_temporarios()
+
+
+def salvar_sidecar(df: pd.DataFrame, result_path: str) -> str:
+    """
+    Grava as linhas do resultado em Arrow IPC (sem compressão, pode ser mapeado
+    em memória) ao lado do .xlsx. Os demais formatos de download saem dele.
+    """
+    import pyarrow as pa
+
+    tabela = _tabela_arrow(df)
+    destino = caminho_sidecar(result_path)
+
+    def gravar(caminho):
+        with pa.OSFile(caminho, "wb") as arquivo:
+            with pa.ipc.new_file(arquivo, tabela.schema) as writer:
+                writer.write_table(tabela)
+
+    _gravar_atomico(destino, gravar)
+    return destino
+
+
+def colunas_combinadas(colunas_abas: Iterable[List[str]]) -> List[str]:
+    """
+    Colunas da tabela com todas as abas: Aba e Linha na Aba, as colunas das
+    planilhas (sem repetir) e as da análise no fim.
+    """
+    todas = list(dict.fromkeys(c for colunas in colunas_abas for c in colunas))
+    fixas = [c for c in NOVAS_COLUNAS_ANALISE if c in todas]
+    identificacao = [COLUNA_ABA, COLUNA_LINHA]
+    return identificacao + [c for c in todas if c not in fixas and c not in identificacao] + fixas
+
+
+def identificar_linhas(df: pd.DataFrame, aba: str) -> Dict:
+    """Valores de Aba e Linha na Aba de um bloco (índice = posição na aba, cabeçalho = linha 1)."""
+    return {COLUNA_ABA: aba, COLUNA_LINHA: df.index.to_numpy() + 2}
+
+
+def combinar_abas(abas: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Linhas de todas as abas em um DataFrame só, aba por aba (ver colunas_combinadas)."""
+    colunas = colunas_combinadas(df.columns for df in abas.values())
+    partes = [df.assign(**identificar_linhas(df, aba)).reindex(columns=colunas) for aba, df in abas.items()]
+    return pd.concat(partes, ignore_index=True)
+
+
+def _ler_resultado_excel(result_path: str) -> pd.DataFrame:
+    # Com várias abas, a última é o resumo
+    abas = pd.read_excel(result_path, sheet_name=None)
+    if len(abas) == 1:
+        return next(iter(abas.values()))
+    return combinar_abas(dict(list(abas.items())[:-1]))
+
+
+def ler_sidecar(result_path: str):
+    """Tabela Arrow do resultado; recria o sidecar a partir do .xlsx se ele não existir."""
+    import pyarrow as pa
+
+    caminho = caminho_sidecar(result_path)
+    if not os.path.exists(caminho):
+        # Resultados gravados antes do sidecar: lê o Excel uma única vez
+        logger.info(f"Gerando arquivo colunar de {os.path.basename(result_path)}")
+        salvar_sidecar(_ler_resultado_excel(result_path), result_path)
+    with pa.memory_map(caminho, "r") as origem:
+        return pa.ipc.open_file(origem).read_all()
+
+
+# ==============================================================================
+# --- Consulta das linhas (prévia paginada e resumo) ---
+# ==============================================================================
+# Filtros da prévia: parâmetro da API -> coluna do resultado
+FILTROS_LINHAS = {"status": "Status", "mancha": "Mancha GPON"}
+SEPARADOR_MANCHAS = ", "
+
+
+def _coluna(tabela, nome: str):
+    if nome not in tabela.column_names:
+        raise ValueError(f"O resultado não tem a coluna '{nome}'.")
+    return tabela.column(nome)
+
+
+def _filtro_manchas(coluna, manchas):
+    """Linhas em que alguma das manchas aparece na lista "A, B" da coluna (nome exato)."""
+    import pyarrow.compute as pc
+
+    nomes = "|".join(re.escape(m) for m in manchas)
+    padrao = f"(^|{re.escape(SEPARADOR_MANCHAS)})({nomes})({re.escape(SEPARADOR_MANCHAS)}|$)"
+    return pc.fill_null(pc.match_substring_regex(pc.cast(coluna, "string"), padrao), False)
+
+
+def consultar_linhas(result_path: str, status=None, mancha=None, offset: int = 0, limit: int = 100) -> Dict:
+    """
+    Página de linhas do resultado, lida do sidecar Arrow mapeado em memória.
+    Os filtros (Status e/ou Mancha GPON, cada um com um ou mais valores) olham
+    só as suas colunas; apenas as linhas da página são materializadas.
+    `linha` é a linha correspondente na planilha (cabeçalho = linha 1); com
+    várias abas, a linha dentro da aba (coluna Linha na Aba).
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    tabela = ler_sidecar(result_path)
+
+    mascara = None
+    if status:
+        mascara = pc.is_in(pc.cast(_coluna(tabela, "Status"), "string"), value_set=pa.array(status, pa.string()))
+    if mancha:
+        filtro = _filtro_manchas(_coluna(tabela, "Mancha GPON"), mancha)
+        mascara = filtro if mascara is None else pc.and_(mascara, filtro)
+
+    if mascara is None:
+        total = tabela.num_rows
+        posicoes = pa.array(range(offset, min(offset + limit, total)), pa.int64())
+    else:
+        encontradas = pc.indices_nonzero(pc.fill_null(mascara, False))
+        total = len(encontradas)
+        posicoes = encontradas[offset:offset + limit]
+
+    pagina = tabela.take(posicoes)
+    if COLUNA_LINHA in pagina.column_names:
+        numeros = pagina.column(COLUNA_LINHA).to_pylist()
+    else:
+        numeros = [posicao + 2 for posicao in posicoes.to_pylist()]
+    linhas = [{"linha": numero, **registro} for numero, registro in zip(numeros, pagina.to_pylist())]
+    return {"total": total, "offset": offset, "limit": limit, "columns": tabela.column_names, "rows": linhas}
+
+
+def resumir_resultado(result_path: str) -> Dict:
+    """Totais do resultado por Status e por Mancha GPON (uma linha conta para cada mancha da lista)."""
+    import pyarrow.compute as pc
+
+    tabela = ler_sidecar(result_path)
+
+    def contagem(coluna) -> Dict:
+        contagens = pc.value_counts(coluna).to_pylist()
+        pares = [(c["values"], c["counts"]) for c in contagens if c["values"] not in (None, "", "---")]
+        return dict(sorted(pares, key=lambda par: (-par[1], str(par[0]))))
+
+    resumo = {"total": tabela.num_rows, "columns": tabela.column_names}
+    if "Status" in tabela.column_names:
+        resumo["status"] = contagem(pc.cast(tabela.column("Status"), "string"))
+    if "Mancha GPON" in tabela.column_names:
+        manchas = pc.split_pattern(pc.cast(tabela.column("Mancha GPON"), "string"), SEPARADOR_MANCHAS)
+        resumo["manchas"] = contagem(pc.list_flatten(manchas))
+    return resumo
+
+
+# ==============================================================================
+# --- Exportação ---
+# ==============================================================================
+def extrair_coordenadas(df: pd.DataFrame, coluna_coordenadas: Optional[str]) -> Tuple[pd.Series, pd.Series]:
+    """
+    Latitude e longitude de cada linha, com as mesmas colunas da análise:
+    "LAT, LON" (duas colunas) ou uma coluna "lat,lon". Inválidas ou zero viram NaN.
+    """
+    partes = (coluna_coordenadas or "").split(",", 2)
+    if len(partes) == 2:
+        col_lat, col_lon, col_coords = partes[0].strip(), partes[1].strip(), None
+    else:
+        col_lat, col_lon, col_coords = "LATITUDE", "LONGITUDE", coluna_coordenadas or "COORDENADAS"
+
+    if col_lat in df.columns and col_lon in df.columns:
+        lat = pd.to_numeric(df[col_lat], errors="coerce")
+        lon = pd.to_numeric(df[col_lon], errors="coerce")
+    elif col_coords in df.columns:
+        coords = df[col_coords].astype(str).str.replace(" ", "", regex=False).str.split(",", expand=True)
+        coords = coords.reindex(columns=[0, 1, 2])
+        # Exatamente dois valores separados por vírgula
+        dois_valores = coords[2].isna()
+        lat = pd.to_numeric(coords[0], errors="coerce").where(dois_valores)
+        lon = pd.to_numeric(coords[1], errors="coerce").where(dois_valores)
+    else:
+        raise ValueError("Nenhuma coluna de coordenada encontrada no resultado.")
+
+    invalidas = lat.isna() | lon.isna() | (lat == 0) | (lon == 0)
+    return lat.mask(invalidas), lon.mask(invalidas)
+
+
+def _exportar_geo(tabela, destino: str, driver: str, coluna_coordenadas: Optional[str]):
+    import geopandas as gpd
+
+    df = tabela.to_pandas()
+    lat, lon = extrair_coordenadas(df, coluna_coordenadas)
+    geometria = gpd.points_from_xy(lon, lat)
+    # Linhas sem coordenada válida ficam sem geometria
+    geometria[lat.isna().to_numpy()] = None
+    gdf = gpd.GeoDataFrame(df, geometry=geometria, crs=CRS_GEOGRAFICO)
+    if driver == "GPKG":
+        gdf.to_file(destino, driver=driver, layer="resultado")
+    else:
+        gdf.to_file(destino, driver=driver)
+
+
+def exportar(result_path: str, formato: str, coluna_coordenadas: Optional[str] = None) -> str:
+    """
+    Caminho do resultado no `formato` pedido, gerado a partir do sidecar Arrow
+    (sem passar pelo Excel) na primeira vez e reaproveitado depois.
+    """
+    if formato == "xlsx":
+        return result_path
+
+    destino = caminho_exportacao(result_path, formato)
+    if os.path.exists(destino):
+        return destino
+
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    tabela = ler_sidecar(result_path)
+
+    if formato == "csv":
+        gravar = lambda caminho: pa_csv.write_csv(tabela, caminho)
+    elif formato == "csv.gz":
+        def gravar(caminho):
+            with pa.CompressedOutputStream(caminho, "gzip") as saida:
+                pa_csv.write_csv(tabela, saida)
+    elif formato == "parquet":
+        gravar = lambda caminho: pq.write_table(tabela, caminho, compression="zstd")
+    elif formato == "geojson":
+        gravar = lambda caminho: _exportar_geo(tabela, caminho, "GeoJSON", coluna_coordenadas)
+    elif formato == "gpkg":
+        gravar = lambda caminho: _exportar_geo(tabela, caminho, "GPKG", coluna_coordenadas)
+    else:
+        raise FormatoNaoSuportado(f"Formato '{formato}' não suportado.")
+
+    _gravar_atomico(destino, gravar)
+    return destino
+
+
+def remover_resultado(result_path: str) -> bool:
+    """Remove o .xlsx do resultado, o sidecar e as exportações geradas. False se não havia nada."""
+    base = os.path.splitext(result_path)[0]
+    arquivos = [result_path] + [
+        caminho_sidecar(result_path),
+        *(f"{base}.{ext}" for ext, _ in FORMATOS.values() if ext != "xlsx"),
+    ]
+    removido = False
+    for caminho in arquivos:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+            removido = True
+    return removido
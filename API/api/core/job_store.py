@@ -0,0 +1,340 @@
+# api/core/job_store.py
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from api.core.settings import EnvConfig
+
+import logging
+
+
+SCHEMA_JOBS = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        arquivo TEXT,
+        parametros TEXT,
+        input_hash TEXT,
+        criado_em REAL NOT NULL,
+        iniciado_em REAL,
+        concluido_em REAL,
+        resumo TEXT,
+        result_path TEXT,
+        upload_path TEXT,
+        erro TEXT,
+        cancelamento_pedido INTEGER NOT NULL DEFAULT 0,
+        acompanhado_em REAL,
+        chave_resultado TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_criado_em ON jobs (criado_em);
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+
+    -- Eventos de progresso numerados (seq) para retomar o stream (Last-Event-ID)
+    CREATE TABLE IF NOT EXISTS job_eventos (
+        job_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        dados TEXT NOT NULL,
+        criado_em REAL NOT NULL,
+        PRIMARY KEY (job_id, seq)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS meta (
+        chave TEXT PRIMARY KEY,
+        valor TEXT
+    );
+"""
+
+# Estados possíveis de um job
+STATUS_FILA = "queued"
+STATUS_EXECUTANDO = "running"
+STATUS_CONCLUIDO = "complete"
+STATUS_ERRO = "error"
+STATUS_CANCELADO = "cancelled"
+
+# Estados em que o job não muda mais
+STATUS_FINAIS = (STATUS_CONCLUIDO, STATUS_ERRO, STATUS_CANCELADO)
+
+# Colunas acrescentadas depois da primeira versão da tabela jobs
+_COLUNAS_NOVAS = {
+    "cancelamento_pedido": "INTEGER NOT NULL DEFAULT 0",
+    "acompanhado_em": "REAL",
+    "chave_resultado": "TEXT",
+}
+
+# Colunas gravadas como JSON
+_COLUNAS_JSON = ("parametros", "resumo")
+
+
+class JobStore:
+    """
+    Registro persistente das análises (SQLite em RESULTS_DIR/jobs.sqlite3).
+    Guarda parâmetros, hash da entrada, tempos, resumo e caminhos dos arquivos.
+    Cada chamada abre sua própria conexão, então vale para vários workers
+    do uvicorn e para os processos de análise ao mesmo tempo.
+    """
+
+    __init_lock = threading.Lock()
+    __inicializado = False
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def _conectar(cls) -> sqlite3.Connection:
+        cnx = sqlite3.connect(EnvConfig.JOBS_DB_PATH, timeout=30)
+        cnx.row_factory = sqlite3.Row
+        return cnx
+
+    @classmethod
+    def _executar(cls, sql: str, params=(), fetch: Optional[str] = None):
+        if not cls.__inicializado:
+            cls.inicializar()
+        cnx = cls._conectar()
+        try:
+            with cnx:
+                cur = cnx.execute(sql, params)
+                if fetch == "one":
+                    return cur.fetchone()
+                if fetch == "all":
+                    return cur.fetchall()
+                return cur.rowcount
+        finally:
+            cnx.close()
+
+    @staticmethod
+    def _como_dict(row) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        for coluna in _COLUNAS_JSON:
+            if job.get(coluna):
+                job[coluna] = json.loads(job[coluna])
+        return job
+
+    # ------------------------------------------------------------------
+    # Inicialização
+    # ------------------------------------------------------------------
+    @classmethod
+    def inicializar(cls):
+        """Cria o banco de jobs (WAL) e importa, uma única vez, os resultados antigos da pasta."""
+        with cls.__init_lock:
+            if cls.__inicializado:
+                return
+            pasta = os.path.dirname(EnvConfig.JOBS_DB_PATH)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+
+            cnx = cls._conectar()
+            try:
+                cnx.execute("PRAGMA journal_mode = WAL")
+                cnx.executescript(SCHEMA_JOBS)
+                cls._migrar(cnx)
+                cls._importar_legado(cnx)
+            finally:
+                cnx.close()
+
+            cls.__inicializado = True
+
+    @staticmethod
+    def _migrar(cnx: sqlite3.Connection):
+        """Acrescenta em bancos já existentes as colunas criadas depois."""
+        existentes = {row["name"] for row in cnx.execute("PRAGMA table_info(jobs)")}
+        with cnx:
+            for coluna, tipo in _COLUNAS_NOVAS.items():
+                if coluna not in existentes:
+                    cnx.execute(f"ALTER TABLE jobs ADD COLUMN {coluna} {tipo}")
+            # Depende da coluna acima em bancos antigos
+            cnx.execute("CREATE INDEX IF NOT EXISTS jobs_chave_resultado ON jobs (chave_resultado)")
+
+    @classmethod
+    def _importar_legado(cls, cnx: sqlite3.Connection):
+        """Registra os resultado_*.xlsx gerados antes do registro de jobs existir."""
+        with cnx:
+            ja_importado = cnx.execute("SELECT 1 FROM meta WHERE chave = 'legado_importado'").fetchone()
+            if ja_importado:
+                return
+
+            count = 0
+            for full_path in glob.glob(os.path.join(EnvConfig.RESULTS_DIR, "resultado_*.xlsx")):
+                filename = os.path.basename(full_path)
+                # "resultado_" tem 10 caracteres, ".xlsx" tem 5
+                result_id = filename[10:-5]
+                modificado = os.path.getmtime(full_path)
+                count += cnx.execute(
+                    """
+                    INSERT OR IGNORE INTO jobs (id, status, criado_em, concluido_em, result_path)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (result_id, STATUS_CONCLUIDO, modificado, modificado, full_path),
+                ).rowcount
+
+            cnx.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES ('legado_importado', ?)", (str(time.time()),))
+
+        cls.logger.info(f"Registro de jobs: {count} resultados anteriores importados.")
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+    @classmethod
+    def criar(cls, job_id: str, parametros: Dict, arquivo: str = None,
+              input_hash: str = None, upload_path: str = None, chave_resultado: str = None) -> Optional[Dict]:
+        """
+        Registra o job na fila. Com `chave_resultado`, se já houver um job equivalente
+        concluído (com o arquivo ainda presente) ou em andamento, nada é criado e
+        esse job é retornado. A verificação e a inserção ocorrem na mesma transação,
+        então pedidos simultâneos (inclusive de outros workers) geram um único job.
+        """
+        if not cls.__inicializado:
+            cls.inicializar()
+        cnx = cls._conectar()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            try:
+                if chave_resultado:
+                    existente = cls._job_equivalente(cnx, chave_resultado)
+                    if existente is not None:
+                        cnx.rollback()
+                        return existente
+
+                cnx.execute(
+                    """
+                    INSERT INTO jobs (id, status, arquivo, parametros, input_hash, criado_em, upload_path, chave_resultado)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (job_id, STATUS_FILA, arquivo, json.dumps(parametros, ensure_ascii=False),
+                     input_hash, time.time(), upload_path, chave_resultado),
+                )
+                cnx.commit()
+            except BaseException:
+                cnx.rollback()
+                raise
+        finally:
+            cnx.close()
+        return None
+
+    @classmethod
+    def _job_equivalente(cls, cnx: sqlite3.Connection, chave_resultado: str) -> Optional[Dict]:
+        """Job reaproveitável com a mesma chave: resultado pronto primeiro, depois um em andamento."""
+        rows = cnx.execute(
+            """
+            SELECT * FROM jobs
+            WHERE chave_resultado = ? AND cancelamento_pedido = 0 AND status IN (?, ?, ?)
+            ORDER BY status = ? DESC, criado_em DESC
+            """,
+            (chave_resultado, STATUS_CONCLUIDO, STATUS_FILA, STATUS_EXECUTANDO, STATUS_CONCLUIDO),
+        ).fetchall()
+        # Em andamento sem sinal de vida há tempo demais: worker reiniciado, não vai terminar
+        limite_vida = time.time() - EnvConfig.ANALYSIS_DISCONNECT_GRACE - 15
+        for row in rows:
+            if row["status"] == STATUS_CONCLUIDO:
+                # Resultado apagado (/delete) não serve mais
+                if not (row["result_path"] and os.path.exists(row["result_path"])):
+                    continue
+            elif max(row["acompanhado_em"] or 0, row["criado_em"]) < limite_vida:
+                continue
+            return cls._como_dict(row)
+        return None
+
+    @classmethod
+    def marcar_inicio(cls, job_id: str):
+        cls._executar(
+            "UPDATE jobs SET status = ?, iniciado_em = ? WHERE id = ?",
+            (STATUS_EXECUTANDO, time.time(), job_id),
+        )
+
+    @classmethod
+    def concluir(cls, job_id: str, resumo: Dict, result_path: str):
+        cls._executar(
+            "UPDATE jobs SET status = ?, concluido_em = ?, resumo = ?, result_path = ?, erro = NULL WHERE id = ?",
+            (STATUS_CONCLUIDO, time.time(), json.dumps(resumo, ensure_ascii=False), result_path, job_id),
+        )
+
+    @classmethod
+    def falhar(cls, job_id: str, erro: str):
+        cls._executar(
+            "UPDATE jobs SET status = ?, concluido_em = ?, erro = ? WHERE id = ?",
+            (STATUS_ERRO, time.time(), erro, job_id),
+        )
+
+    @classmethod
+    def marcar_cancelado(cls, job_id: str):
+        cls._executar(
+            "UPDATE jobs SET status = ?, concluido_em = ? WHERE id = ?",
+            (STATUS_CANCELADO, time.time(), job_id),
+        )
+
+    @classmethod
+    def pedir_cancelamento(cls, job_id: str) -> bool:
+        """Marca o pedido de cancelamento; o worker dono do job o atende. False se o job já terminou."""
+        placeholders = ", ".join("?" for _ in STATUS_FINAIS)
+        return cls._executar(
+            f"UPDATE jobs SET cancelamento_pedido = 1 WHERE id = ? AND status NOT IN ({placeholders})",
+            (job_id, *STATUS_FINAIS),
+        ) > 0
+
+    @classmethod
+    def marcar_acompanhamento(cls, job_id: str):
+        """Registra que ainda há alguém acompanhando o progresso do job."""
+        cls._executar("UPDATE jobs SET acompanhado_em = ? WHERE id = ?", (time.time(), job_id))
+
+    @classmethod
+    def adicionar_evento(cls, job_id: str, seq: int, evento: Dict):
+        cls._executar(
+            "INSERT OR REPLACE INTO job_eventos (job_id, seq, dados, criado_em) VALUES (?, ?, ?, ?)",
+            (job_id, seq, json.dumps(evento, ensure_ascii=False), time.time()),
+        )
+
+    @classmethod
+    def remover(cls, job_id: str) -> bool:
+        cls._executar("DELETE FROM job_eventos WHERE job_id = ?", (job_id,))
+        return cls._executar("DELETE FROM jobs WHERE id = ?", (job_id,)) > 0
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+    @classmethod
+    def obter(cls, job_id: str) -> Optional[Dict]:
+        return cls._como_dict(cls._executar("SELECT * FROM jobs WHERE id = ?", (job_id,), fetch="one"))
+
+    @classmethod
+    def cancelamento_pedido(cls, job_id: str) -> bool:
+        row = cls._executar("SELECT cancelamento_pedido FROM jobs WHERE id = ?", (job_id,), fetch="one")
+        return bool(row and row["cancelamento_pedido"])
+
+    @classmethod
+    def eventos(cls, job_id: str, apos_seq: int = 0) -> List[tuple]:
+        """Eventos do job com seq maior que `apos_seq`, em ordem: [(seq, evento), ...]."""
+        rows = cls._executar(
+            "SELECT seq, dados FROM job_eventos WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, apos_seq),
+            fetch="all",
+        )
+        return [(row["seq"], json.loads(row["dados"])) for row in rows]
+
+    @classmethod
+    def listar(cls, limit: int = 50, offset: int = 0, status: Optional[str] = None) -> Dict:
+        """Jobs mais recentes primeiro, sem os caminhos internos de arquivo."""
+        filtro, params = "", []
+        if status:
+            filtro, params = "WHERE status = ?", [status]
+
+        total = cls._executar(f"SELECT COUNT(1) AS total FROM jobs {filtro}", params, fetch="one")["total"]
+        rows = cls._executar(
+            f"""
+            SELECT id, status, arquivo, parametros, input_hash, criado_em, iniciado_em, concluido_em, resumo, erro,
+                   cancelamento_pedido
+            FROM jobs {filtro}
+            ORDER BY criado_em DESC
+            LIMIT ? OFFSET ?
+            """,
+            params + [limit, offset],
+            fetch="all",
+        )
+        return {"total": total, "limit": limit, "offset": offset, "data": [cls._como_dict(r) for r in rows]}
+
+    @staticmethod
+    def publico(job: Dict) -> Dict:
+        """Remove os caminhos de arquivo do servidor antes de responder."""
+        return {k: v for k, v in job.items() if k not in ("result_path", "upload_path", "acompanhado_em")}
@@ -0,0 +1,488 @@
+# api/core/jobs.py
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import queue
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from api.core.coverage import assinatura_cobertura
+from api.core.job_store import STATUS_FINAIS, JobStore
+from api.core.scheduler import JobScheduler, estimar_linhas
+from api.core.settings import EnvConfig
+from api.core.workers import WorkerPools
+
+import logging
+
+
+# Evento final de um job cancelado
+EVENTO_CANCELADO = {"status": "cancelled", "message": "Análise cancelada."}
+
+# Parâmetros que mudam o resultado de uma análise (além da planilha)
+PARAMETROS_RESULTADO = ("raio_km", "coordenadas", "col_velocidade", "type_busca")
+
+
+def chave_resultado(input_hash: str, params: Dict, snapshot_ptp) -> str:
+    """
+    Identifica o resultado de uma análise: conteúdo da planilha, parâmetros e
+    versões dos dados usados (manchas KMZ e redes PTP). Só entram as fontes que
+    o tipo de busca consulta (1 = só PTP, 2 = só GPON).
+    """
+    type_busca = params["type_busca"]
+    partes = {
+        "entrada": input_hash,
+        "parametros": {k: params[k] for k in PARAMETROS_RESULTADO},
+        "cobertura": assinatura_cobertura(params["pasta_kmz"]) if type_busca != 1 else None,
+        "ptp": (snapshot_ptp.assinatura if snapshot_ptp is not None else None) if type_busca != 2 else None,
+    }
+    return hashlib.sha256(json.dumps(partes, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# ==============================================================================
+# --- Execução no processo filho ---
+# ==============================================================================
+def _executar_analise(job_id: str, params: Dict, fila, snapshot_ptp, cancelamento) -> Dict:
+    """
+    Roda a análise inteira em um processo do pool (fora do event loop da API).
+    O progresso vai para `fila`; o retorno é o evento final (complete/error/cancelled).
+    `cancelamento` é um Event do Manager verificado entre as etapas da análise.
+    """
+    # Imports aqui para o processo filho carregar só o necessário
+    from api.core.analysis import AnaliseCancelada, GeoAnalyzer
+    from api.core.excel_styler import salvar_excel, salvar_excel_abas
+    from api.core.exportacao import salvar_sidecar
+    from api.core.ptp_snapshot import PTPCache
+    from api.core.scheduler import estimar_linhas
+
+    upload_path = params["upload_path"]
+    try:
+        if cancelamento.is_set():
+            return dict(EVENTO_CANCELADO)
+
+        WorkerPools.preparar_processo_analise()
+
+        # Usa a mesma foto PTP do processo principal (sem ir ao banco)
+        if snapshot_ptp is not None:
+            PTPCache.instalar(snapshot_ptp)
+
+        JobStore.marcar_inicio(job_id)
+
+        result_path = os.path.join(params["results_dir"], f"resultado_{job_id}.xlsx")
+        # Planilha grande: o resultado é gravado bloco a bloco durante a análise
+        fora_da_memoria = estimar_linhas(upload_path) > EnvConfig.ANALYSIS_OUT_OF_CORE_ROWS
+
+        analyzer = GeoAnalyzer(
+            pasta_kmz=params["pasta_kmz"],
+            arquivo_excel_path=upload_path,
+            raio_km=params["raio_km"],
+            coluna_coordenadas=params["coordenadas"],
+            coluna_velocidade=params["col_velocidade"],
+            type_busca=params["type_busca"],
+            cancelamento=cancelamento,
+            arquivo_resultado=result_path if fora_da_memoria else None
+        )
+
+        try:
+            for progress, message in analyzer.run_analysis():
+                if progress == -1:  # Flag de erro
+                    return {"status": "error", "message": message}
+                if progress == -2:  # Resultado parcial: linhas de um bloco já concluído
+                    fila.put({"rows": message})
+                    continue
+                fila.put({"progress": progress, "message": message})
+        except AnaliseCancelada:
+            return dict(EVENTO_CANCELADO)
+
+        df_final = analyzer.df_final
+        resumo = analyzer.resumo
+        if resumo is None or (df_final is None and not fora_da_memoria):
+            return {"status": "error", "message": "A análise não produziu resultado."}
+
+        if not fora_da_memoria:
+            # Último ponto de verificação antes de gravar o Excel
+            if cancelamento.is_set():
+                return dict(EVENTO_CANCELADO)
+
+            # Cópia colunar das linhas: CSV, Parquet e GeoJSON saem dela sem reler o Excel
+            try:
+                salvar_sidecar(df_final, result_path)
+            except Exception as e:
+                logging.getLogger("uvicorn.info").warning(f"Job {job_id}: arquivo colunar não gravado ({e}).")
+
+            # Salva o arquivo de resultado final, já formatado (uma única gravação)
+            if analyzer.abas_final is not None:
+                salvar_excel_abas(analyzer.abas_final, analyzer.resumo_abas, analyzer.nome_resumo, result_path)
+            else:
+                salvar_excel(df_final, result_path)
+
+        evento = {
+            "status": "complete",
+            "summary": resumo,
+            "result_id": job_id,
+            "result_path": result_path
+        }
+        if analyzer.resumo_abas:
+            # Planilha com várias abas: contagem de Status de cada uma
+            evento["summary_sheets"] = analyzer.resumo_abas
+        return evento
+    finally:
+        # Limpa o arquivo de upload
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+# ==============================================================================
+# --- Controle dos jobs no processo da API ---
+# ==============================================================================
+class Job:
+    """Uma análise em execução: parâmetros, eventos já emitidos e resultado."""
+
+    def __init__(self, job_id: str, params: Dict):
+        self.id = job_id
+        self.params = params
+        # Eventos na ordem de emissão; o seq de cada um é a posição + 1
+        self.eventos: List[Dict] = []
+        self.resultado: Optional[Dict] = None
+        self.fila = None
+        self.future = None
+        self.cancelamento = None
+        self.cancelado = False
+        # Foto PTP da submissão (a mesma que entrou na chave do resultado)
+        self.snapshot_ptp = None
+        # Sinalizado quando o escalonador admite o job (ou ele é cancelado na fila)
+        self.despachado = asyncio.Event()
+        self._mudou = asyncio.Condition()
+
+    @property
+    def concluido(self) -> bool:
+        return self.resultado is not None
+
+    async def _publicar(self, evento: Dict, resultado: Optional[Dict] = None):
+        """Grava e libera um evento; `resultado` marca o evento final do job."""
+        seq = len(self.eventos) + 1
+        try:
+            # Grava antes de liberar, para quem reconectar em outro worker achar o evento
+            await asyncio.to_thread(JobStore.adicionar_evento, self.id, seq, evento)
+        except Exception as e:
+            logging.getLogger("uvicorn.info").error(f"Erro ao gravar evento {seq} do job {self.id}: {e}")
+        async with self._mudou:
+            self.eventos.append(evento)
+            if resultado is not None:
+                self.resultado = resultado
+            self._mudou.notify_all()
+
+    async def acompanhar(self, apos_seq: int = 0, heartbeat: Optional[float] = None):
+        """
+        Gera (seq, evento) a partir de `apos_seq` até o evento final.
+        Sem eventos novos por `heartbeat` segundos gera None (para o stream mandar um ping).
+        """
+        seq = apos_seq
+        while True:
+            async with self._mudou:
+                try:
+                    await asyncio.wait_for(
+                        self._mudou.wait_for(lambda: len(self.eventos) > seq), heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    novos = None
+                else:
+                    novos = self.eventos[seq:]
+                    concluido = self.concluido
+
+            if novos is None:
+                yield None
+                continue
+
+            for evento in novos:
+                seq += 1
+                yield seq, evento
+            if concluido and seq >= len(self.eventos):
+                return
+
+
+class JobManager:
+    """
+    Executa as análises em um pool de processos limitado (ANALYSIS_MAX_JOBS).
+    A ordem de início é decidida pelo JobScheduler (menor custo primeiro, com
+    orçamento de memória). Cada job recebe um ID; o progresso do processo filho
+    chega por uma fila e é repassado aos streams SSE sem bloquear o event loop.
+    Jobs sem ninguém acompanhando (após ANALYSIS_DISCONNECT_GRACE) ou com
+    pedido explícito de cancelamento são interrompidos no próximo ponto de verificação.
+    Pedidos idênticos (mesma chave de resultado) reaproveitam o resultado pronto
+    ou passam a acompanhar a análise que já está rodando.
+    """
+
+    jobs: Dict[str, Job] = {}
+    # Tarefas em segundo plano: o loop guarda só referência fraca, então ficam aqui até terminar
+    _tarefas: set = set()
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def _agendar(cls, corrotina) -> asyncio.Task:
+        """Cria a tarefa no loop atual e a mantém referenciada até terminar."""
+        tarefa = asyncio.get_running_loop().create_task(corrotina)
+        cls._tarefas.add(tarefa)
+        tarefa.add_done_callback(cls._tarefas.discard)
+        return tarefa
+
+    @classmethod
+    async def submeter(cls, params: Dict, arquivo: str = None, input_hash: str = None) -> Tuple[str, Optional[str]]:
+        """
+        Registra a análise, estima seu custo e a coloca na fila do escalonador.
+        Retorna (job_id, status do job reaproveitado ou None se um novo foi criado).
+        """
+        from api.core.database import Database
+        from api.core.ptp_snapshot import PTPCache
+
+        # A análise (e a chave de reaproveitamento) usa a foto PTP atual, já conferida com o banco
+        if PTPCache.precisa_verificar():
+            await Database.run(PTPCache.verificar_versao)
+
+        job = Job(str(uuid.uuid4()), params)
+        job.snapshot_ptp = PTPCache.obter()
+
+        chave = None
+        if EnvConfig.ANALYSIS_REUSE_RESULTS and input_hash:
+            chave = await asyncio.to_thread(chave_resultado, input_hash, params, job.snapshot_ptp)
+
+        linhas = await asyncio.to_thread(estimar_linhas, params["upload_path"])
+        estimativa = JobScheduler.estimar(linhas, params["type_busca"])
+
+        registro = {k: v for k, v in params.items() if k not in ("upload_path", "results_dir", "pasta_kmz")}
+        registro["linhas_estimadas"] = linhas
+        existente = await asyncio.to_thread(
+            JobStore.criar,
+            job.id,
+            registro,
+            arquivo=arquivo,
+            input_hash=input_hash,
+            upload_path=params["upload_path"],
+            chave_resultado=chave,
+        )
+        if existente is not None:
+            # Mesmo pedido já concluído ou em andamento: o upload não será usado
+            if os.path.exists(params["upload_path"]):
+                os.remove(params["upload_path"])
+            cls.logger.info(f"Pedido idêntico ao job {existente['id']} ({existente['status']}): reaproveitado.")
+            return existente["id"], existente["status"]
+
+        try:
+            manager = WorkerPools.manager()
+            job.fila = manager.Queue()
+            job.cancelamento = manager.Event()
+            cls.jobs[job.id] = job
+            JobScheduler.enfileirar(job.id, estimativa, lambda: cls._iniciar(job))
+        except Exception as e:
+            # Sem isso o registro ficaria "queued" para sempre (e pedidos idênticos iriam para ele)
+            cls.jobs.pop(job.id, None)
+            JobScheduler.remover(job.id)
+            if os.path.exists(params["upload_path"]):
+                os.remove(params["upload_path"])
+            try:
+                await asyncio.to_thread(JobStore.falhar, job.id, f"Erro ao iniciar a análise: {e}")
+            except Exception as erro_registro:
+                cls.logger.error(f"Erro ao registrar a falha do job {job.id}: {erro_registro}")
+            raise
+
+        cls._agendar(cls._repassar(job))
+        return job.id, None
+
+    @classmethod
+    def _iniciar(cls, job: Job):
+        """Chamado pelo escalonador quando o job é admitido: envia ao pool de processos."""
+        try:
+            job.future = WorkerPools.cpu().submit(
+                _executar_analise, job.id, job.params, job.fila, job.snapshot_ptp, job.cancelamento
+            )
+        except Exception as e:
+            # Pool indisponível (ex.: desligando): o job termina com erro
+            job.future = concurrent.futures.Future()
+            job.future.set_exception(e)
+        job.despachado.set()
+
+    @classmethod
+    async def _aguardar_vez(cls, job: Job):
+        """Enquanto o job está na fila, informa posição e início estimado quando mudam."""
+        ultima_posicao = None
+        while not job.despachado.is_set():
+            posicao = JobScheduler.posicao(job.id)
+            if posicao and posicao["posicao"] != ultima_posicao:
+                ultima_posicao = posicao["posicao"]
+                inicio = datetime.now(timezone.utc) + timedelta(seconds=posicao["inicio_em_s"])
+                await job._publicar({
+                    "progress": 0,
+                    "message": f"Aguardando na fila: posição {posicao['posicao']}, início em ~{posicao['inicio_em_s']:.0f}s",
+                    "queue_position": posicao["posicao"],
+                    "eta_s": posicao["inicio_em_s"],
+                    "estimated_start": inicio.isoformat(timespec="seconds"),
+                })
+
+            try:
+                await asyncio.wait_for(job.despachado.wait(), 1.0)
+            except asyncio.TimeoutError:
+                # Pedido de cancelamento feito por outro worker
+                if await asyncio.to_thread(JobStore.cancelamento_pedido, job.id):
+                    cls.cancelar(job.id)
+
+    @classmethod
+    async def _repassar(cls, job: Job):
+        """Move os eventos da fila do processo filho para o job, até o fim da análise."""
+        await job._publicar({"progress": 0, "message": "Análise enfileirada.", "job_id": job.id})
+        await cls._aguardar_vez(job)
+
+        verificado_em = time.monotonic()
+        while job.future is not None:
+            try:
+                evento = await asyncio.to_thread(job.fila.get, True, 0.5)
+                await job._publicar(evento)
+            except queue.Empty:
+                if job.future.done() and job.fila.empty():
+                    break
+
+            # Pedido de cancelamento feito por outro worker (DELETE /jobs/{id})
+            if not job.cancelado and time.monotonic() - verificado_em >= 1:
+                verificado_em = time.monotonic()
+                try:
+                    if await asyncio.to_thread(JobStore.cancelamento_pedido, job.id):
+                        cls.cancelar(job.id)
+                except Exception as e:
+                    cls.logger.error(f"Erro ao verificar cancelamento do job {job.id}: {e}")
+
+        try:
+            if job.future is None:
+                raise concurrent.futures.CancelledError()
+            resultado = job.future.result()
+        except concurrent.futures.CancelledError:
+            # Cancelado antes de começar: o processo filho nunca viu o upload
+            resultado = dict(EVENTO_CANCELADO)
+            upload_path = job.params["upload_path"]
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+        except Exception as e:
+            cls.logger.error(f"Job {job.id} falhou: {e}")
+            resultado = {"status": "error", "message": str(e)}
+
+        # Libera a vaga (e a memória reservada) para o próximo da fila
+        JobScheduler.finalizar(job.id, calibrar=resultado.get("status") == "complete")
+
+        try:
+            if resultado.get("status") == "complete":
+                await asyncio.to_thread(JobStore.concluir, job.id, resultado["summary"], resultado["result_path"])
+            elif resultado.get("status") == "cancelled":
+                await asyncio.to_thread(JobStore.marcar_cancelado, job.id)
+            else:
+                await asyncio.to_thread(JobStore.falhar, job.id, resultado.get("message"))
+        except Exception as e:
+            cls.logger.error(f"Erro ao registrar o fim do job {job.id}: {e}")
+
+        # O caminho do arquivo fica só no servidor
+        await job._publicar({k: v for k, v in resultado.items() if k != "result_path"}, resultado=resultado)
+        cls.jobs.pop(job.id, None)
+
+    # ------------------------------------------------------------------
+    # Cancelamento
+    # ------------------------------------------------------------------
+    @classmethod
+    def cancelar(cls, job_id: str) -> bool:
+        """Cancela um job deste processo. Jobs na fila nem chegam a rodar."""
+        job = cls.jobs.get(job_id)
+        if job is None or job.concluido:
+            return False
+        if not job.cancelado:
+            job.cancelado = True
+            job.cancelamento.set()
+            if job.future is None:
+                # Ainda na fila do escalonador: sai sem chegar ao pool
+                JobScheduler.remover(job_id)
+                job.despachado.set()
+            else:
+                job.future.cancel()
+            cls.logger.warning(f"Cancelando job {job_id}.")
+        return True
+
+    @classmethod
+    async def pedir_cancelamento(cls, job_id: str) -> bool:
+        """Cancela o job onde quer que ele esteja (este worker ou outro, via registro)."""
+        pedido = await asyncio.to_thread(JobStore.pedir_cancelamento, job_id)
+        return cls.cancelar(job_id) or pedido
+
+    @classmethod
+    async def _cancelar_se_abandonado(cls, job_id: str):
+        """Após a desconexão, cancela o job se ninguém voltou a acompanhá-lo dentro do prazo."""
+        prazo = EnvConfig.ANALYSIS_DISCONNECT_GRACE
+        # O prazo conta a partir da desconexão
+        try:
+            await asyncio.to_thread(JobStore.marcar_acompanhamento, job_id)
+        except Exception as e:
+            cls.logger.error(f"Erro ao registrar desconexão do job {job_id}: {e}")
+        await asyncio.sleep(prazo + 1)
+        try:
+            registro = await asyncio.to_thread(JobStore.obter, job_id)
+            if registro is None or registro["status"] in STATUS_FINAIS:
+                return
+            if time.time() - (registro["acompanhado_em"] or 0) < prazo:
+                return
+            cls.logger.warning(f"Job {job_id} sem clientes há {prazo:.0f}s.")
+            await cls.pedir_cancelamento(job_id)
+        except Exception as e:
+            cls.logger.error(f"Erro ao cancelar job abandonado {job_id}: {e}")
+
+    # ------------------------------------------------------------------
+    # Acompanhamento
+    # ------------------------------------------------------------------
+    @classmethod
+    async def eventos(cls, job_id: str, apos_seq: int = 0):
+        """
+        Eventos de um job a partir de `apos_seq` (Last-Event-ID), como (seq, evento).
+        Jobs deste processo são seguidos em memória; os demais (outro worker ou
+        já concluídos) são lidos do registro. Gera None a cada SSE_HEARTBEAT_SECONDS sem novidades.
+        Enquanto o stream está aberto o job é marcado como acompanhado; ao fechar
+        antes do fim, agenda a verificação de abandono.
+        """
+        intervalo = min(5.0, EnvConfig.ANALYSIS_DISCONNECT_GRACE / 3)
+        marcado_em = 0.0
+        terminou = False
+        try:
+            async for item in cls._eventos(job_id, apos_seq):
+                if time.monotonic() - marcado_em >= intervalo:
+                    marcado_em = time.monotonic()
+                    await asyncio.to_thread(JobStore.marcar_acompanhamento, job_id)
+                yield item
+            terminou = True
+        finally:
+            if not terminou:
+                cls._agendar(cls._cancelar_se_abandonado(job_id))
+
+    @classmethod
+    async def _eventos(cls, job_id: str, apos_seq: int = 0):
+        heartbeat = EnvConfig.SSE_HEARTBEAT_SECONDS
+        job = cls.jobs.get(job_id)
+        if job is not None:
+            async for item in job.acompanhar(apos_seq, heartbeat):
+                yield item
+            return
+
+        ultimo_ping = time.monotonic()
+        while True:
+            novos = await asyncio.to_thread(JobStore.eventos, job_id, apos_seq)
+            for seq, evento in novos:
+                apos_seq = seq
+                yield seq, evento
+                if evento.get("status") in STATUS_FINAIS:
+                    return
+
+            if not novos:
+                registro = await asyncio.to_thread(JobStore.obter, job_id)
+                if registro is None or registro["status"] in STATUS_FINAIS:
+                    return
+                if time.monotonic() - ultimo_ping >= heartbeat:
+                    ultimo_ping = time.monotonic()
+                    yield None
+            else:
+                ultimo_ping = time.monotonic()
+
+            await asyncio.sleep(0.5)
@@ -0,0 +1,252 @@
+# api/core/leitor_pontos.py
+import codecs
+import re
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+# Planilhas que o calamine lê; sem ele, só as do openpyxl
+EXTENSOES_EXCEL = ("xlsx", "xlsm", "xls", "xlsb", "ods")
+EXTENSOES_OPENPYXL = ("xlsx", "xlsm")
+
+# Separadores aceitos no CSV (o mais frequente no cabeçalho vence)
+SEPARADORES_CSV = (";", ",", "\t", "|")
+AMOSTRA_CSV_BYTES = 64 * 1024
+# Números com uma única casa de separação ("-15,5" / "-15.5"): decidem o separador decimal
+NUMERO_DECIMAL_VIRGULA = re.compile(r"^[+-]?\d+,\d+$")
+NUMERO_DECIMAL_PONTO = re.compile(r"^[+-]?\d+\.\d+$")
+
+
+def extensao(caminho: str) -> str:
+    return caminho.rsplit(".", 1)[-1].lower() if "." in caminho else ""
+
+
+def calamine_disponivel() -> bool:
+    try:
+        import python_calamine  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# ==============================================================================
+# --- Planilhas (linha a linha, montadas em blocos) ---
+# ==============================================================================
+def _nomes_colunas(cabecalho) -> List[str]:
+    """Cabeçalho como o pandas monta no read_excel: vazias viram "Unnamed: i" e repetidas ganham ".1", ".2"..."""
+    nomes, vistos = [], {}
+    for i, valor in enumerate(cabecalho):
+        nome = f"Unnamed: {i}" if valor is None or str(valor).strip() == "" else valor
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def _valor(valor):
+    # Como o read_excel: número inteiro gravado como float volta a ser int
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    # O calamine devolve célula vazia como ""
+    if valor == "":
+        return None
+    return valor
+
+
+def _blocos_linhas(linhas, tamanho: int) -> Iterator[pd.DataFrame]:
+    """
+    Linhas (a primeira é o cabeçalho) em DataFrames de até `tamanho` linhas,
+    com o índice continuando entre os blocos (posição da linha, como no read_excel).
+    Sempre gera ao menos um bloco (vazio, só com as colunas, se não houver linhas).
+    """
+    colunas = _nomes_colunas(next(linhas, ()))
+    largura = len(colunas)
+
+    inicio, bloco, vazias = 0, [], 0
+    for linha in linhas:
+        valores = [_valor(v) for v in linha[:largura]]
+        if all(v is None for v in valores):
+            # Linhas vazias só contam se houver dados depois (o read_excel descarta as do fim)
+            vazias += 1
+            continue
+        bloco.extend([[None] * largura] * vazias)
+        vazias = 0
+        bloco.append(valores + [None] * (largura - len(valores)))
+        while len(bloco) >= tamanho:
+            yield pd.DataFrame(bloco[:tamanho], columns=colunas, index=range(inicio, inicio + tamanho))
+            inicio += tamanho
+            bloco = bloco[tamanho:]
+
+    if bloco or inicio == 0:
+        yield pd.DataFrame(bloco, columns=colunas, index=range(inicio, inicio + len(bloco)))
+
+
+def _blocos_openpyxl(caminho: str, tamanho: int, aba: Optional[str]) -> Iterator[pd.DataFrame]:
+    # read_only: o XML da aba é lido aos poucos, a memória depende só do bloco
+    from openpyxl import load_workbook
+
+    wb = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        ws = wb[aba] if aba is not None else wb.worksheets[0]
+        yield from _blocos_linhas(ws.iter_rows(values_only=True), tamanho)
+    finally:
+        wb.close()
+
+
+def _linhas_calamine(folha):
+    # A faixa lida começa na primeira coluna com dados; o read_excel começa na coluna A
+    colunas_antes = [None] * folha.start[1]
+    return (colunas_antes + linha for linha in folha.iter_rows())
+
+
+def _blocos_calamine(caminho: str, tamanho: int, aba: Optional[str]) -> Iterator[pd.DataFrame]:
+    # Leitor nativo (Rust): a aba é carregada de uma vez, mas sem criar objetos Python por célula
+    from python_calamine import CalamineWorkbook
+
+    wb = CalamineWorkbook.from_path(caminho)
+    try:
+        folha = wb.get_sheet_by_name(aba) if aba is not None else wb.get_sheet_by_index(0)
+        yield from _blocos_linhas(_linhas_calamine(folha), tamanho)
+    finally:
+        wb.close()
+
+
+# ==============================================================================
+# --- CSV e Parquet ---
+# ==============================================================================
+def _formato_csv(caminho: str):
+    """(encoding, separador, amostra) pelo início do arquivo: UTF-8 se couber, senão Latin-1."""
+    with open(caminho, "rb") as arquivo:
+        amostra = arquivo.read(AMOSTRA_CSV_BYTES)
+    try:
+        texto = codecs.getincrementaldecoder("utf-8-sig")().decode(amostra)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        texto = amostra.decode("latin-1")
+        encoding = "latin-1"
+    cabecalho = texto.splitlines()[0] if texto.strip() else ""
+    separador = max(SEPARADORES_CSV, key=cabecalho.count)
+    return encoding, separador, texto
+
+
+def _decimal_csv(amostra: str, separador: str) -> str:
+    # Com ";" (padrão do Excel em português) os números usam vírgula decimal; com "," só pode ser ponto
+    if separador in (";", ","):
+        return "," if separador == ";" else "."
+    # Tabulação e "|": vale o formato que mais aparece nas células da amostra
+    celulas = [c.strip().strip('"') for linha in amostra.splitlines()[1:] for c in linha.split(separador)]
+    virgula = sum(1 for c in celulas if NUMERO_DECIMAL_VIRGULA.match(c))
+    ponto = sum(1 for c in celulas if NUMERO_DECIMAL_PONTO.match(c))
+    return "," if virgula > ponto else "."
+
+
+def _opcoes_csv(caminho: str):
+    encoding, separador, amostra = _formato_csv(caminho)
+    return {"sep": separador, "decimal": _decimal_csv(amostra, separador), "encoding": encoding}
+
+
+def contar_linhas_csv(caminho: str) -> int:
+    """Linhas de dados do CSV, contando as quebras de linha em blocos binários (sem interpretar o arquivo)."""
+    linhas, ultimo = 0, b"\n"
+    with open(caminho, "rb") as arquivo:
+        while True:
+            bloco = arquivo.read(1024 * 1024)
+            if not bloco:
+                break
+            linhas += bloco.count(b"\n")
+            ultimo = bloco
+    if not ultimo.endswith(b"\n"):
+        linhas += 1  # última linha sem quebra no fim
+    # Menos o cabeçalho
+    return max(0, linhas - 1)
+
+
+def _blocos_csv(caminho: str, tamanho: int) -> Iterator[pd.DataFrame]:
+    yield from pd.read_csv(caminho, chunksize=tamanho, **_opcoes_csv(caminho))
+
+
+def _blocos_parquet(caminho: str, tamanho: int) -> Iterator[pd.DataFrame]:
+    import pyarrow.parquet as pq
+
+    arquivo = pq.ParquetFile(caminho)
+    inicio = 0
+    for lote in arquivo.iter_batches(batch_size=tamanho):
+        df = lote.to_pandas()
+        df.index = range(inicio, inicio + len(df))
+        inicio += len(df)
+        yield df
+    if inicio == 0:
+        yield arquivo.schema_arrow.empty_table().to_pandas()
+
+
+# ==============================================================================
+# --- Entrada única da análise ---
+# ==============================================================================
+def listar_abas(caminho: str) -> List[Tuple[Optional[str], List[str], Optional[int]]]:
+    """
+    (nome, colunas, linhas) de cada aba, sem ler os dados: só o cabeçalho e a
+    dimensão (linhas None quando a planilha não informa). CSV e Parquet têm uma
+    única "aba", sem nome.
+    """
+    ext = extensao(caminho)
+    if ext == "csv":
+        colunas = pd.read_csv(caminho, nrows=0, **_opcoes_csv(caminho)).columns
+        return [(None, list(colunas), contar_linhas_csv(caminho))]
+    if ext == "parquet":
+        import pyarrow.parquet as pq
+
+        arquivo = pq.ParquetFile(caminho)
+        return [(None, list(arquivo.schema_arrow.names), arquivo.metadata.num_rows)]
+
+    if ext in EXTENSOES_OPENPYXL:
+        from openpyxl import load_workbook
+
+        wb = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            abas = []
+            for ws in wb.worksheets:
+                cabecalho = next(ws.iter_rows(max_row=1, values_only=True), ())
+                linhas = max(0, ws.max_row - 1) if ws.max_row else None
+                abas.append((ws.title, _nomes_colunas(cabecalho), linhas))
+            return abas
+        finally:
+            wb.close()
+
+    if ext in EXTENSOES_EXCEL and calamine_disponivel():
+        from python_calamine import CalamineWorkbook
+
+        wb = CalamineWorkbook.from_path(caminho)
+        try:
+            abas = []
+            for nome in wb.sheet_names:
+                folha = wb.get_sheet_by_name(nome)
+                cabecalho = next(_linhas_calamine(folha), ())
+                abas.append((nome, _nomes_colunas(cabecalho), max(0, folha.height - 1)))
+            return abas
+        finally:
+            wb.close()
+    raise ValueError(f"Formato de arquivo não suportado: .{ext}")
+
+
+def ler_blocos_pontos(caminho: str, tamanho: int, streaming: bool = False,
+                      aba: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    Pontos de uma aba da planilha (a primeira, se `aba` não for informada),
+    CSV ou Parquet em DataFrames de até `tamanho` linhas, com índice contínuo
+    (posição da linha) e ao menos um bloco, mesmo sem linhas. Planilhas usam
+    o calamine quando instalado; com `streaming` (análise fora da memória)
+    .xlsx é lido pelo openpyxl read_only, que não carrega a aba inteira.
+    """
+    ext = extensao(caminho)
+    if ext == "csv":
+        return _blocos_csv(caminho, tamanho)
+    if ext == "parquet":
+        return _blocos_parquet(caminho, tamanho)
+    if ext in EXTENSOES_OPENPYXL and (streaming or not calamine_disponivel()):
+        return _blocos_openpyxl(caminho, tamanho, aba)
+    if ext in EXTENSOES_EXCEL and calamine_disponivel():
+        return _blocos_calamine(caminho, tamanho, aba)
+    raise ValueError(f"Formato de arquivo não suportado: .{ext}")
@@ -1,6 +1,14 @@
 # api/core/models/ptp_model.py
-from typing import Optional, Dict
+import base64
+import json
+import math
+from typing import Optional, Dict, List
+
+import numpy as np
+
 from api.core.database import Database
+from api.core.ptp_snapshot import CacheLimitado, PTPCache, normalizar_texto
+from api.core.municipio_index import MunicipioCache
 
 class PTPModel:
     """
@@ -8,6 +16,9 @@ class PTPModel:
     Usa Database.query(sql, params, fetchone/fetchall).
     """
 
+    # Totais da listagem por filtro (uf, rede), válidos até a próxima escrita (LRU limitado)
+    _totais = CacheLimitado()
+
     @staticmethod
     def rede_ptp(lat: float, lon: float, raio_km: float = 50.0) -> Optional[Dict]:
         """
@@ -15,6 +26,11 @@ class PTPModel:
         Retorno: dict com colunas do DB (ex: rede_ptp, cidade, uf, distancia_km) ou None.
         OBS: ajuste o nome da tabela/colunas conforme sua modelagem.
         """
+        # Atende pela foto em memória quando disponível
+        snapshot = PTPCache.obter()
+        if snapshot is not None:
+            return snapshot.mais_proxima(lat, lon, raio_km=raio_km)
+
         # Query de exemplo otimizada com ST_Distance_Sphere (MySQL)
         # Ajuste 'ptp_redes' e colunas 'latitude'/'longitude' conforme sua tabela real.
         
@@ -46,6 +62,9 @@ class PTPModel:
 
         params = (lon, lat, lon, lat, float(raio_km))
 
+        if Database.dialeto() == "sqlite":
+            sql, params = PTPModel._sql_rede_ptp_sqlite(lat, lon, raio_km)
+
         try:
             row = Database.query(sql, params=params, fetchone=True)
             return row  # None se não encontrado
@@ -55,40 +74,168 @@ class PTPModel:
             return None
 
     @staticmethod
-    def listar_paginado(page: int = 1, limit: int = 50):
-        offset = (page - 1) * limit
+    def _sql_rede_ptp_sqlite(lat: float, lon: float, raio_km: float):
+        """
+        Mesma busca de rede_ptp() para o backend SQLite: a caixa do raio
+        filtra pelo índice R*Tree antes de calcular a distância.
+        """
+        delta_lat = float(raio_km) / 111.32
+        delta_lon = float(raio_km) / max(111.32 * math.cos(math.radians(lat)), 1e-6)
+
         sql = """
             SELECT
-                rp.id,
-                rp.rede_ptp AS redes,
-                c.nome AS cidade, 
-                e.uf, 
-                c.latitude AS lat, 
-                c.longitude AS lon
-            FROM 
-                redes_ptp rp 
-            INNER JOIN 
-                municipios c ON rp.codigo_ibge = c.codigo_ibge 
-            INNER JOIN 
-                estados e ON rp.codigo_uf = e.codigo_uf 
-            ORDER BY 
-                c.nome ASC
-            LIMIT %s OFFSET %s;
+                GROUP_CONCAT_ORDENADO(rp.rede_ptp, ' / ') AS redes
+            FROM
+                redes_ptp rp
+            INNER JOIN (
+                SELECT DISTINCT
+                    c.codigo_ibge,
+                    (ST_Distance_Sphere(POINT(c.longitude, c.latitude), POINT(%s, %s)) / 1000) AS dist_calc
+                FROM
+                    municipios_rtree r
+                INNER JOIN
+                    municipios c ON c.codigo_ibge = r.id
+                INNER JOIN
+                    redes_ptp sub_rp ON sub_rp.codigo_ibge = c.codigo_ibge
+                WHERE
+                    r.min_lat <= %s AND r.max_lat >= %s
+                    AND r.min_lon <= %s AND r.max_lon >= %s
+                    AND ST_Distance_Sphere(POINT(c.longitude, c.latitude), POINT(%s, %s)) <= %s * 1000
+                ORDER BY
+                    dist_calc ASC
+                LIMIT 5
+            ) AS top_5_locais ON rp.codigo_ibge = top_5_locais.codigo_ibge;
         """
-        rows = Database.query(sql, params=(limit, offset))
-        total_row = Database.query("SELECT COUNT(1) AS total FROM redes_ptp;", fetchone=True)
-        total = total_row["total"] if total_row else 0
+        params = (
+            lon, lat,
+            lat + delta_lat, lat - delta_lat,
+            lon + delta_lon, lon - delta_lon,
+            lon, lat, float(raio_km)
+        )
+        return sql, params
+
+    @staticmethod
+    def _encode_cursor(cidade: str, id: int) -> str:
+        """Cursor opaco com a chave (cidade, id) do último item da página."""
+        bruto = json.dumps([cidade, int(id)], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            cidade, id = json.loads(bruto.decode("utf-8"))
+            return str(cidade), int(id)
+        except Exception:
+            raise ValueError("Cursor de paginação inválido.")
+
+    @staticmethod
+    def _invalidar_apos_escrita():
+        """Descarta totais em cache e reconstrói a foto em memória após uma escrita."""
+        PTPModel._totais.clear()
+        PTPCache.invalidar()
+
+    @staticmethod
+    def listar_paginado(
+        page: int = 1,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        uf: Optional[str] = None,
+        rede: Optional[str] = None
+    ):
+        """
+        Lista as redes ordenadas por (cidade, id).
+        Com `cursor` usa paginação por chave (keyset); sem ele mantém o `page` antigo.
+        `uf` e `rede` filtram no servidor. O total é cacheado até a próxima escrita.
+        """
+        offset = (page - 1) * limit
+        chave_cursor = PTPModel._decode_cursor(cursor) if cursor else None
+
+        snapshot = PTPCache.obter()
+        if snapshot is not None:
+            posicoes = snapshot.filtrar(uf=uf, rede=rede)
+            total = len(posicoes)
+            if chave_cursor:
+                inicio = int(np.searchsorted(posicoes, snapshot.posicao_apos(*chave_cursor)))
+            else:
+                inicio = offset
+            rows = snapshot.linhas(posicoes[inicio:inicio + limit])
+        else:
+            filtros, params = [], []
+            if uf:
+                filtros.append("e.uf = %s")
+                params.append(uf)
+            if rede:
+                filtros.append("rp.rede_ptp LIKE %s")
+                params.append(f"%{rede}%")
+
+            filtros_pagina = list(filtros)
+            params_pagina = list(params)
+            if chave_cursor:
+                filtros_pagina.append("(c.nome > %s OR (c.nome = %s AND rp.id > %s))")
+                params_pagina.extend([chave_cursor[0], chave_cursor[0], chave_cursor[1]])
+
+            where = f"WHERE {' AND '.join(filtros_pagina)}" if filtros_pagina else ""
+            sql = f"""
+                SELECT
+                    rp.id,
+                    rp.rede_ptp AS redes,
+                    c.nome AS cidade, 
+                    e.uf, 
+                    c.latitude AS lat, 
+                    c.longitude AS lon
+                FROM 
+                    redes_ptp rp 
+                INNER JOIN 
+                    municipios c ON rp.codigo_ibge = c.codigo_ibge 
+                INNER JOIN 
+                    estados e ON rp.codigo_uf = e.codigo_uf 
+                {where}
+                ORDER BY 
+                    c.nome ASC, rp.id ASC
+                LIMIT %s OFFSET %s;
+            """
+            params_pagina.extend([limit, 0 if chave_cursor else offset])
+            rows = Database.query(sql, params=params_pagina)
+
+            chave_total = (uf or "", rede or "")
+            total = PTPModel._totais.get(chave_total)
+            if total is None:
+                where_total = f"WHERE {' AND '.join(filtros)}" if filtros else ""
+                total_row = Database.query(
+                    f"""
+                    SELECT COUNT(1) AS total
+                    FROM redes_ptp rp
+                    INNER JOIN estados e ON rp.codigo_uf = e.codigo_uf
+                    {where_total};
+                    """,
+                    params=params,
+                    fetchone=True
+                )
+                total = total_row["total"] if total_row else 0
+                PTPModel._totais[chave_total] = total
+
+        next_cursor = None
+        if len(rows) == limit:
+            ultimo = rows[-1]
+            next_cursor = PTPModel._encode_cursor(ultimo["cidade"], ultimo["id"])
+
         return {
             "page": page,
             "limit": limit,
             "total": total,
             "pages": (total + limit - 1) // limit,
+            "next_cursor": next_cursor,
             "data": rows
         }
-        
+
     @staticmethod
     def buscar_cidades(termo: str):
         """Busca cidades para o autocomplete (limitado a 10)"""
+        indice = MunicipioCache.obter()
+        if indice is not None:
+            return indice.buscar(termo, limite=10)
+
         sql = """
             SELECT c.codigo_ibge, c.nome, c.codigo_uf, e.uf
             FROM municipios c
@@ -120,7 +267,9 @@ class PTPModel:
             INSERT INTO redes_ptp (rede_ptp, codigo_ibge, codigo_uf)
             VALUES (%s, %s, %s)
         """
-        return Database.query(sql, params=(rede_ptp, codigo_ibge, codigo_uf))
+        resultado = Database.query(sql, params=(rede_ptp, codigo_ibge, codigo_uf))
+        PTPModel._invalidar_apos_escrita()
+        return resultado
 
     @staticmethod
     def atualizar(id: int, rede_ptp: str):
@@ -129,9 +278,192 @@ class PTPModel:
             SET rede_ptp = %s
             WHERE id = %s
         """
-        return Database.query(sql, params=(rede_ptp, id))
+        resultado = Database.query(sql, params=(rede_ptp, id))
+        PTPModel._invalidar_apos_escrita()
+        return resultado
 
     @staticmethod
     def deletar(id: int):
         sql = "DELETE FROM redes_ptp WHERE id = %s"
-        return Database.query(sql, params=(id,))
\ No newline at end of file
+        resultado = Database.query(sql, params=(id,))
+        PTPModel._invalidar_apos_escrita()
+        return resultado
+    # ------------------------------------------------------------------
+    # Operações em lote
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _em_blocos(valores, tamanho: int = 1000):
+        valores = list(valores)
+        for i in range(0, len(valores), tamanho):
+            yield valores[i:i + tamanho]
+
+    @staticmethod
+    def _selecionar_in(cursor, sql: str, valores) -> List[Dict]:
+        """Executa um SELECT com `IN (...)` em blocos, para listas grandes."""
+        rows = []
+        for bloco in PTPModel._em_blocos(valores):
+            marcadores = ", ".join(["%s"] * len(bloco))
+            cursor.execute(sql.format(marcadores=marcadores), bloco)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    @staticmethod
+    def processar_lote(itens: List[Dict], tudo_ou_nada: bool = False) -> Dict:
+        """
+        Cria, atualiza ou remove várias redes em uma única transação.
+
+        Cada item: {"acao": "create"|"update"|"delete", "id", "rede_ptp", "codigo_ibge"}.
+        - create: rede_ptp + codigo_ibge (UF vem da tabela municipios)
+        - update: id + rede_ptp
+        - delete: id, ou rede_ptp + codigo_ibge
+
+        Duplicidades (no banco e dentro do próprio lote) são detectadas em conjunto,
+        as escritas usam executemany e as estruturas em memória são invalidadas uma vez.
+        Retorna um relatório por linha. Com `tudo_ou_nada`, qualquer erro desfaz o lote.
+        """
+        relatorio = []
+        criar, atualizar, remover = [], [], []
+
+        for n, item in enumerate(itens, start=1):
+            acao = str(item.get("acao") or "create").strip().lower()
+            rede = str(item.get("rede_ptp") or "").strip()
+            linha = {"linha": n, "acao": acao, "status": "erro", "mensagem": ""}
+            relatorio.append(linha)
+
+            try:
+                id = int(item["id"]) if item.get("id") not in (None, "") else None
+                codigo_ibge = int(item["codigo_ibge"]) if item.get("codigo_ibge") not in (None, "") else None
+            except (TypeError, ValueError):
+                linha["mensagem"] = "id/codigo_ibge devem ser numéricos."
+                continue
+
+            linha.update({"id": id, "rede_ptp": rede or None, "codigo_ibge": codigo_ibge})
+
+            if acao == "create" and rede and codigo_ibge:
+                criar.append(linha)
+            elif acao == "update" and id and rede:
+                atualizar.append(linha)
+            elif acao == "delete" and (id or (rede and codigo_ibge)):
+                remover.append(linha)
+            elif acao not in ("create", "update", "delete"):
+                linha["mensagem"] = f"Ação desconhecida: '{acao}'."
+            else:
+                linha["mensagem"] = "Campos obrigatórios ausentes para a ação."
+
+        try:
+            with Database.transaction() as cursor:
+                # --- Estado atual do banco, consultado em conjunto ---
+                ids = {l["id"] for l in atualizar + remover if l["id"]}
+                por_id = {
+                    r["id"]: r
+                    for r in PTPModel._selecionar_in(
+                        cursor, "SELECT id, rede_ptp, codigo_ibge FROM redes_ptp WHERE id IN ({marcadores})", ids
+                    )
+                }
+
+                # Cidades das inclusões/remoções e das redes renomeadas: todas as redes
+                # dessas cidades entram em `ocupados` para detectar nomes repetidos
+                cidades = {l["codigo_ibge"] for l in criar + remover if l["codigo_ibge"]}
+                cidades |= {por_id[l["id"]]["codigo_ibge"] for l in atualizar if l["id"] in por_id}
+
+                municipios = {
+                    r["codigo_ibge"]: r["codigo_uf"]
+                    for r in PTPModel._selecionar_in(
+                        cursor, "SELECT codigo_ibge, codigo_uf FROM municipios WHERE codigo_ibge IN ({marcadores})", cidades
+                    )
+                }
+                existentes = PTPModel._selecionar_in(
+                    cursor, "SELECT id, rede_ptp, codigo_ibge FROM redes_ptp WHERE codigo_ibge IN ({marcadores})", cidades
+                )
+                for r in existentes:
+                    por_id.setdefault(r["id"], r)
+
+                # Pares (rede, cidade) já ocupados, comparados sem acento/caixa como no MySQL
+                ocupados = {(normalizar_texto(r["rede_ptp"]), r["codigo_ibge"]): r["id"] for r in por_id.values()}
+
+                # --- Remoções ---
+                ids_remover = set()
+                for linha in remover:
+                    id = linha["id"] or ocupados.get((normalizar_texto(linha["rede_ptp"]), linha["codigo_ibge"]))
+                    if not id or id not in por_id:
+                        linha["mensagem"] = "Rede não encontrada."
+                        continue
+                    if id in ids_remover:
+                        linha["mensagem"] = "Rede já removida neste lote."
+                        continue
+                    ids_remover.add(id)
+                    linha.update({"id": id, "status": "ok", "mensagem": "Removida."})
+                    atual = por_id[id]
+                    ocupados.pop((normalizar_texto(atual["rede_ptp"]), atual["codigo_ibge"]), None)
+
+                # --- Atualizações ---
+                params_update = []
+                for linha in atualizar:
+                    atual = por_id.get(linha["id"])
+                    if atual is None or linha["id"] in ids_remover:
+                        linha["mensagem"] = "Rede não encontrada."
+                        continue
+                    chave = (normalizar_texto(linha["rede_ptp"]), atual["codigo_ibge"])
+                    if ocupados.get(chave, linha["id"]) != linha["id"]:
+                        linha["mensagem"] = f"A rede '{linha['rede_ptp']}' já está cadastrada nesta cidade."
+                        continue
+                    ocupados.pop((normalizar_texto(atual["rede_ptp"]), atual["codigo_ibge"]), None)
+                    ocupados[chave] = linha["id"]
+                    params_update.append((linha["rede_ptp"], linha["id"]))
+                    linha.update({"status": "ok", "mensagem": "Atualizada."})
+
+                # --- Inclusões ---
+                params_insert = []
+                for linha in criar:
+                    codigo_uf = municipios.get(linha["codigo_ibge"])
+                    if codigo_uf is None:
+                        linha["mensagem"] = "Cidade (codigo_ibge) não encontrada."
+                        continue
+                    chave = (normalizar_texto(linha["rede_ptp"]), linha["codigo_ibge"])
+                    if chave in ocupados:
+                        linha["mensagem"] = f"A rede '{linha['rede_ptp']}' já está cadastrada nesta cidade."
+                        continue
+                    ocupados[chave] = None
+                    params_insert.append((linha["rede_ptp"], linha["codigo_ibge"], codigo_uf))
+                    linha.update({"status": "ok", "mensagem": "Criada."})
+
+                erros = sum(1 for l in relatorio if l["status"] != "ok")
+                if tudo_ou_nada and erros:
+                    for linha in relatorio:
+                        if linha["status"] == "ok":
+                            linha.update({"status": "ignorado", "mensagem": "Lote desfeito por erros em outras linhas."})
+                    raise _LoteDesfeito()
+
+                # --- Escritas em conjunto ---
+                for bloco in PTPModel._em_blocos(ids_remover):
+                    marcadores = ", ".join(["%s"] * len(bloco))
+                    cursor.execute(f"DELETE FROM redes_ptp WHERE id IN ({marcadores})", bloco)
+                if params_update:
+                    cursor.executemany("UPDATE redes_ptp SET rede_ptp = %s WHERE id = %s", params_update)
+                if params_insert:
+                    cursor.executemany(
+                        "INSERT INTO redes_ptp (rede_ptp, codigo_ibge, codigo_uf) VALUES (%s, %s, %s)", params_insert
+                    )
+        except _LoteDesfeito:
+            return PTPModel._resumo_lote(relatorio)
+
+        if params_insert or params_update or ids_remover:
+            PTPModel._invalidar_apos_escrita()
+
+        return PTPModel._resumo_lote(relatorio)
+
+    @staticmethod
+    def _resumo_lote(relatorio: List[Dict]) -> Dict:
+        ok = [l for l in relatorio if l["status"] == "ok"]
+        return {
+            "total": len(relatorio),
+            "criados": sum(1 for l in ok if l["acao"] == "create"),
+            "atualizados": sum(1 for l in ok if l["acao"] == "update"),
+            "removidos": sum(1 for l in ok if l["acao"] == "delete"),
+            "erros": sum(1 for l in relatorio if l["status"] == "erro"),
+            "linhas": relatorio,
+        }
+
+
+class _LoteDesfeito(Exception):
+    """Usada para desfazer a transação de um lote com `tudo_ou_nada`."""
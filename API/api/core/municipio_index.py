@@ -0,0 +1,174 @@
+# api/core/municipio_index.py
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional
+
+from api.core.database import Database
+from api.core.ptp_snapshot import normalizar_texto
+from api.core.settings import EnvConfig
+
+import logging
+
+
+SQL_MUNICIPIOS = """
+    SELECT c.codigo_ibge, c.nome, c.codigo_uf, e.uf, c.capital
+    FROM municipios c
+    INNER JOIN
+        estados e ON c.codigo_uf = e.codigo_uf
+"""
+
+# "Versão" da tabela: muda sempre que algum município é incluído, removido ou alterado
+SQL_VERSAO_MUNICIPIOS = """
+    SELECT
+        COUNT(1) AS total,
+        COALESCE(SUM(CRC32(CONCAT_WS('|', codigo_ibge, nome, codigo_uf, capital))), 0) AS soma
+    FROM municipios
+"""
+
+# Fração mínima de trigramas em comum para aceitar um resultado aproximado (erros de digitação)
+SIMILARIDADE_MINIMA = 0.6
+
+# Faixas de relevância (menor = melhor)
+FAIXA_EXATA, FAIXA_PREFIXO, FAIXA_PALAVRA, FAIXA_CONTEM, FAIXA_APROXIMADA = range(5)
+
+
+def _trigramas(texto: str) -> set:
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class MunicipioIndex:
+    """
+    Índice em memória para o autocomplete de municípios.
+    Busca sem acento/caixa por prefixo (nome completo e início de palavra)
+    e por trigramas, priorizando prefixos e capitais.
+    """
+
+    def __init__(self, rows: List[Dict], versao):
+        self.versao = versao
+        self._registros = [
+            {
+                "codigo_ibge": int(r["codigo_ibge"]),
+                "nome": r["nome"],
+                "codigo_uf": int(r["codigo_uf"]),
+                "uf": r["uf"],
+                "capital": bool(r["capital"]),
+            }
+            for r in rows
+        ]
+        self._nomes = [normalizar_texto(r["nome"]) for r in self._registros]
+
+        # Prefixo do nome completo: lista ordenada (nome_normalizado, posição)
+        self._por_nome = sorted((nome, i) for i, nome in enumerate(self._nomes))
+        self._chaves_nome = [nome for nome, _ in self._por_nome]
+
+        # Prefixo de palavra: "vista" encontra "Boa Vista"
+        self._por_palavra = sorted(
+            (palavra, i) for i, nome in enumerate(self._nomes) for palavra in set(nome.split())
+        )
+        self._chaves_palavra = [palavra for palavra, _ in self._por_palavra]
+
+        # Trigramas → posições
+        self._trigramas: Dict[str, set] = {}
+        for i, nome in enumerate(self._nomes):
+            for tri in _trigramas(nome):
+                self._trigramas.setdefault(tri, set()).add(i)
+
+    def __len__(self) -> int:
+        return len(self._registros)
+
+    @staticmethod
+    def _faixa_prefixo(chaves, pares, termo):
+        inicio = bisect.bisect_left(chaves, termo)
+        fim = bisect.bisect_left(chaves, termo + "\uffff")
+        return (pares[j][1] for j in range(inicio, fim))
+
+    def buscar(self, termo: str, limite: int = 10) -> List[Dict]:
+        termo = normalizar_texto(termo)
+        if not termo:
+            return []
+
+        faixas: Dict[int, int] = {}
+
+        def marcar(pos, faixa):
+            if faixa < faixas.get(pos, FAIXA_APROXIMADA + 1):
+                faixas[pos] = faixa
+
+        for pos in self._faixa_prefixo(self._chaves_nome, self._por_nome, termo):
+            marcar(pos, FAIXA_EXATA if self._nomes[pos] == termo else FAIXA_PREFIXO)
+
+        for pos in self._faixa_prefixo(self._chaves_palavra, self._por_palavra, termo):
+            marcar(pos, FAIXA_PALAVRA)
+
+        # Trigramas: substrings (como o antigo LIKE '%termo%') e nomes com erros de digitação.
+        # Só é necessário quando os prefixos não bastam, pois eles sempre vêm antes.
+        contagem: Dict[int, int] = {}
+        if len(faixas) < limite:
+            tris = _trigramas(termo)
+            for tri in tris:
+                for pos in self._trigramas.get(tri, ()):
+                    contagem[pos] = contagem.get(pos, 0) + 1
+
+            for pos, comuns in contagem.items():
+                if pos in faixas:
+                    continue
+                if termo in self._nomes[pos]:
+                    marcar(pos, FAIXA_CONTEM)
+                elif comuns / len(tris) >= SIMILARIDADE_MINIMA:
+                    marcar(pos, FAIXA_APROXIMADA)
+
+        melhores = sorted(
+            faixas,
+            key=lambda pos: (
+                faixas[pos],
+                not self._registros[pos]["capital"],
+                -contagem.get(pos, 0),
+                len(self._nomes[pos]),
+                self._nomes[pos],
+            ),
+        )[:limite]
+
+        return [dict(self._registros[pos]) for pos in melhores]
+
+
+class MunicipioCache:
+    """
+    Mantém o MunicipioIndex do processo e o recarrega quando a
+    "versão" da tabela municipios muda (verificada a cada MUNICIPIOS_INDEX_TTL segundos).
+    """
+
+    __indice: Optional[MunicipioIndex] = None
+    __verificado_em = 0.0
+    __lock = threading.Lock()
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def obter(cls) -> Optional[MunicipioIndex]:
+        return cls.__indice
+
+    @classmethod
+    def precisa_verificar(cls) -> bool:
+        return cls.__indice is None or time.monotonic() - cls.__verificado_em > EnvConfig.MUNICIPIOS_INDEX_TTL
+
+    @classmethod
+    def verificar_versao(cls) -> Optional[MunicipioIndex]:
+        """
+        Confere a versão da tabela no banco e reconstrói o índice se ela mudou.
+        Se o banco falhar, a próxima tentativa só acontece depois do TTL (o erro é repassado).
+        """
+        with cls.__lock:
+            if not cls.precisa_verificar():
+                return cls.__indice
+
+            try:
+                row = Database.query(SQL_VERSAO_MUNICIPIOS, fetchone=True) or {}
+                versao = (int(row.get("total") or 0), int(row.get("soma") or 0))
+
+                if cls.__indice is None or cls.__indice.versao != versao:
+                    rows = Database.query(SQL_MUNICIPIOS)
+                    cls.__indice = MunicipioIndex(rows, versao=versao)
+                    cls.logger.info(f"📌 Índice de municípios carregado ({len(cls.__indice)} cidades).")
+            finally:
+                cls.__verificado_em = time.monotonic()
+            return cls.__indice
@@ -0,0 +1,317 @@
+# api/core/ptp_snapshot.py
+import bisect
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from api.core.database import Database
+from api.core.settings import EnvConfig
+
+import logging
+
+
+# Mesmo raio usado pelo ST_Distance_Sphere do MySQL (em metros)
+RAIO_TERRA_METROS = 6370986.0
+
+# Quantidade de cidades consideradas na busca de redes próximas
+# (equivalente ao LIMIT 5 da subquery original)
+LIMITE_CIDADES_PROXIMAS = 5
+
+# Combinações de filtros (uf, rede) guardadas em cache; `rede` é texto livre
+LIMITE_CACHE_FILTROS = 128
+
+SQL_SNAPSHOT = """
+    SELECT
+        rp.id,
+        rp.rede_ptp,
+        rp.codigo_ibge,
+        rp.codigo_uf,
+        c.nome AS cidade,
+        e.uf,
+        c.latitude AS lat,
+        c.longitude AS lon
+    FROM
+        redes_ptp rp
+    INNER JOIN
+        municipios c ON rp.codigo_ibge = c.codigo_ibge
+    INNER JOIN
+        estados e ON rp.codigo_uf = e.codigo_uf
+"""
+
+# "Versão" da tabela: muda sempre que alguma rede é incluída, removida ou alterada
+# (em qualquer processo ou worker que escreva no banco)
+SQL_VERSAO_PTP = """
+    SELECT
+        COUNT(1) AS total,
+        COALESCE(SUM(CRC32(CONCAT_WS('|', id, rede_ptp, codigo_ibge, codigo_uf))), 0) AS soma
+    FROM redes_ptp
+"""
+
+
+def normalizar_texto(texto) -> str:
+    """Remove acentos e caixa, aproximando a collation utf8mb4_0900_ai_ci."""
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    return "".join(ch for ch in texto if not unicodedata.combining(ch)).casefold().strip()
+
+
+def _somente_leitura(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+class CacheLimitado:
+    """Dicionário com no máximo `limite` entradas: descarta a usada há mais tempo (LRU). Seguro entre threads."""
+
+    def __init__(self, limite: int = LIMITE_CACHE_FILTROS):
+        self.limite = limite
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            if chave not in self._itens:
+                return padrao
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def __setitem__(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.limite:
+                self._itens.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def __getstate__(self):
+        # Vai para outro processo (ex.: foto PTP enviada a um job) vazio e sem o lock
+        return {"limite": self.limite}
+
+    def __setstate__(self, estado):
+        self.__init__(estado["limite"])
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+
+class PTPSnapshot:
+    """
+    Foto imutável da tabela redes_ptp (com municipios/estados) em colunas numpy.
+    As linhas ficam ordenadas por (cidade, id), a mesma ordem da listagem.
+    Nunca é alterada depois de criada: escritas geram uma nova foto.
+    """
+
+    def __init__(self, rows: List[Dict], versao: int):
+        self.versao = versao
+
+        rows = sorted(rows, key=lambda r: (normalizar_texto(r["cidade"]), int(r["id"])))
+
+        # Assinatura do conteúdo: igual em todos os processos que tiverem os mesmos dados
+        conteudo = "\n".join(
+            f'{r["id"]}|{r["rede_ptp"]}|{r["codigo_ibge"]}|{r["codigo_uf"]}' for r in rows
+        )
+        self.assinatura = hashlib.sha1(conteudo.encode("utf-8")).hexdigest()
+
+        self.id = _somente_leitura(np.array([int(r["id"]) for r in rows], dtype=np.int64))
+        self.rede_ptp = _somente_leitura(np.array([r["rede_ptp"] for r in rows], dtype=object))
+        self.codigo_ibge = _somente_leitura(np.array([int(r["codigo_ibge"]) for r in rows], dtype=np.int64))
+        self.codigo_uf = _somente_leitura(np.array([int(r["codigo_uf"]) for r in rows], dtype=np.int64))
+        self.cidade = _somente_leitura(np.array([r["cidade"] for r in rows], dtype=object))
+        self.uf = _somente_leitura(np.array([r["uf"] for r in rows], dtype=object))
+        self.lat = _somente_leitura(np.array([float(r["lat"]) for r in rows], dtype=np.float64))
+        self.lon = _somente_leitura(np.array([float(r["lon"]) for r in rows], dtype=np.float64))
+
+        # Colunas auxiliares para filtros sem acento/caixa
+        self.rede_norm = _somente_leitura(np.array([normalizar_texto(v) for v in self.rede_ptp], dtype=object))
+        self.uf_norm = _somente_leitura(np.array([normalizar_texto(v) for v in self.uf], dtype=object))
+        self.cidade_norm = _somente_leitura(np.array([normalizar_texto(v) for v in self.cidade], dtype=object))
+
+        # Chave de ordenação (cidade, id) usada na paginação por cursor
+        self._chaves = list(zip(self.cidade_norm.tolist(), self.id.tolist()))
+
+        # Resultados de filtros já calculados (a foto é imutável, então só saem pelo limite do LRU)
+        self._filtros = CacheLimitado()
+
+        # --- Índice por cidade (uma entrada por município com rede) ---
+        cidades, inverso = np.unique(self.codigo_ibge, return_inverse=True)
+        self._cidades_ibge = _somente_leitura(cidades)
+        lat_cidade = np.zeros(len(cidades))
+        lon_cidade = np.zeros(len(cidades))
+        lat_cidade[inverso] = self.lat
+        lon_cidade[inverso] = self.lon
+        self._cidades_lat_rad = _somente_leitura(np.radians(lat_cidade))
+        self._cidades_lon_rad = _somente_leitura(np.radians(lon_cidade))
+
+        redes_por_cidade: List[set] = [set() for _ in range(len(cidades))]
+        for pos, rede in zip(inverso, self.rede_ptp):
+            redes_por_cidade[pos].add(rede)
+        self._redes_por_cidade = tuple(tuple(sorted(r, key=normalizar_texto)) for r in redes_por_cidade)
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def filtrar(self, uf: Optional[str] = None, rede: Optional[str] = None) -> np.ndarray:
+        """Retorna as posições (já ordenadas) que atendem aos filtros."""
+        chave = (normalizar_texto(uf), normalizar_texto(rede))
+        posicoes = self._filtros.get(chave)
+        if posicoes is None:
+            posicoes = _somente_leitura(self._filtrar(uf, rede))
+            self._filtros[chave] = posicoes
+        return posicoes
+
+    def _filtrar(self, uf: Optional[str], rede: Optional[str]) -> np.ndarray:
+        mascara = np.ones(len(self), dtype=bool)
+        if uf:
+            mascara &= self.uf_norm == normalizar_texto(uf)
+        if rede:
+            termo = normalizar_texto(rede)
+            mascara &= np.fromiter((termo in v for v in self.rede_norm), dtype=bool, count=len(self))
+        return np.flatnonzero(mascara)
+
+    def posicao_apos(self, cidade: str, id: int) -> int:
+        """Primeira posição depois da chave (cidade, id) na ordem da listagem."""
+        return bisect.bisect_right(self._chaves, (normalizar_texto(cidade), int(id)))
+
+    def linhas(self, posicoes) -> List[Dict]:
+        """Monta as linhas no mesmo formato retornado pela listagem via SQL."""
+        return [
+            {
+                "id": int(self.id[i]),
+                "redes": self.rede_ptp[i],
+                "cidade": self.cidade[i],
+                "uf": self.uf[i],
+                "lat": float(self.lat[i]),
+                "lon": float(self.lon[i]),
+            }
+            for i in posicoes
+        ]
+
+    def distancias_km(self, lat: float, lon: float) -> np.ndarray:
+        """Distância (haversine, km) do ponto até cada cidade com rede."""
+        lat1 = np.radians(lat)
+        lon1 = np.radians(lon)
+        dlat = self._cidades_lat_rad - lat1
+        dlon = self._cidades_lon_rad - lon1
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(self._cidades_lat_rad) * np.sin(dlon / 2) ** 2
+        return 2 * RAIO_TERRA_METROS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) / 1000
+
+    def mais_proxima(self, lat: float, lon: float, raio_km: float = 50.0) -> Dict:
+        """
+        Equivalente em memória de PTPModel.rede_ptp: junta as redes das
+        5 cidades mais próximas dentro do raio. Retorna {"redes": None} se nada.
+        """
+        if len(self._cidades_ibge) == 0:
+            return {"redes": None}
+
+        dist = self.distancias_km(lat, lon)
+        dentro = np.flatnonzero(dist <= float(raio_km))
+        if dentro.size == 0:
+            return {"redes": None}
+
+        if dentro.size > LIMITE_CIDADES_PROXIMAS:
+            parcial = np.argpartition(dist[dentro], LIMITE_CIDADES_PROXIMAS - 1)[:LIMITE_CIDADES_PROXIMAS]
+            dentro = dentro[parcial]
+
+        redes = set()
+        for pos in dentro:
+            redes.update(self._redes_por_cidade[pos])
+
+        return {"redes": " / ".join(sorted(redes, key=normalizar_texto))}
+
+
+class PTPCache:
+    """
+    Mantém a foto de redes_ptp compartilhada pelo processo.
+    Leitores pegam a referência atual e nunca são bloqueados; após uma escrita
+    a nova foto é montada à parte e trocada de uma vez (copy-on-write).
+    Escritas feitas por outros workers são percebidas conferindo a "versão" da
+    tabela no banco a cada PTP_SNAPSHOT_TTL segundos (precisa_verificar/verificar_versao).
+    O MySQL continua sendo a fonte da verdade.
+    """
+
+    __snapshot: Optional[PTPSnapshot] = None
+    __versao = 0
+    __versao_banco = None
+    __verificado_em = 0.0
+    __lock = threading.Lock()
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def _versao_banco(cls) -> tuple:
+        row = Database.query(SQL_VERSAO_PTP, fetchone=True) or {}
+        return int(row.get("total") or 0), int(row.get("soma") or 0)
+
+    @classmethod
+    def _carregar(cls, versao_banco: tuple) -> PTPSnapshot:
+        # Chamado com o lock: lê as linhas e publica a nova foto
+        rows = Database.query(SQL_SNAPSHOT)
+        cls.__versao += 1
+        snapshot = PTPSnapshot(rows, versao=cls.__versao)
+        cls.__snapshot = snapshot
+        cls.__versao_banco = versao_banco
+        cls.__verificado_em = time.monotonic()
+        cls.logger.info(f"📌 Snapshot PTP v{snapshot.versao} carregado ({len(snapshot)} redes).")
+        return snapshot
+
+    @classmethod
+    def carregar(cls) -> PTPSnapshot:
+        """(Re)carrega a foto a partir do banco e publica a nova versão."""
+        with cls.__lock:
+            # A versão é lida antes das linhas: uma escrita no meio faz a próxima verificação recarregar
+            return cls._carregar(cls._versao_banco())
+
+    @classmethod
+    def obter(cls) -> Optional[PTPSnapshot]:
+        """Foto atual (ou None se ainda não foi carregada)."""
+        return cls.__snapshot
+
+    @classmethod
+    def precisa_verificar(cls) -> bool:
+        return time.monotonic() - cls.__verificado_em > EnvConfig.PTP_SNAPSHOT_TTL
+
+    @classmethod
+    def verificar_versao(cls) -> Optional[PTPSnapshot]:
+        """
+        Confere a versão da tabela no banco e recarrega a foto se ela mudou.
+        Com o banco fora do ar mantém a foto atual (e só tenta de novo depois do TTL).
+        """
+        with cls.__lock:
+            if not cls.precisa_verificar():
+                return cls.__snapshot
+            try:
+                versao = cls._versao_banco()
+                if cls.__snapshot is None or versao != cls.__versao_banco:
+                    return cls._carregar(versao)
+            except Exception as e:
+                cls.logger.error(f"Erro ao verificar a versão das redes PTP, mantendo o snapshot atual: {e}")
+            cls.__verificado_em = time.monotonic()
+            return cls.__snapshot
+
+    @classmethod
+    def instalar(cls, snapshot: PTPSnapshot):
+        """
+        Publica uma foto já montada (ex.: recebida do processo principal por um job).
+        O processo da análise não confere a versão: o job usa a foto do momento em que foi submetido.
+        """
+        with cls.__lock:
+            cls.__snapshot = snapshot
+            cls.__versao = max(cls.__versao, snapshot.versao)
+
+    @classmethod
+    def invalidar(cls):
+        """Reconstrói a foto após uma escrita. Em caso de falha descarta a foto antiga."""
+        try:
+            cls.carregar()
+        except Exception as e:
+            cls.__snapshot = None
+            cls.logger.error(f"Erro ao recarregar snapshot PTP, usando o banco diretamente: {e}")
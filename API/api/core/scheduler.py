@@ -0,0 +1,188 @@
+# api/core/scheduler.py
+import os
+import time
+from typing import Dict, List, Optional
+
+from api.core.settings import EnvConfig
+
+import logging
+
+
+# Custo estimado por tipo de busca: segundos fixos + segundos por linha
+# (1 = só PTP, 2 = só GPON, 3 = GPON + PTP para os inviáveis)
+CUSTO_BASE_S = {1: 1.0, 2: 5.0, 3: 6.0}
+CUSTO_POR_LINHA_S = {1: 0.0004, 2: 0.0010, 3: 0.0014}
+
+# Memória estimada: fixa + por linha (DataFrame, geometrias e Excel de saída)
+MEMORIA_BASE_MB = {1: 60.0, 2: 250.0, 3: 260.0}
+MEMORIA_POR_LINHA_KB = {1: 2.0, 2: 6.0, 3: 7.0}
+
+# Peso da última análise na correção do custo estimado (média móvel exponencial)
+PESO_CALIBRACAO = 0.3
+
+
+def estimar_linhas(caminho: str) -> int:
+    """Quantidade de linhas de todas as abas (ou do CSV/Parquet) sem carregá-las (só dimensão e metadados)."""
+    from api.core.leitor_pontos import listar_abas
+
+    try:
+        abas = listar_abas(caminho)
+        if all(linhas is not None for _, _, linhas in abas):
+            return sum(linhas for _, _, linhas in abas)
+    except Exception:
+        pass
+    # Sem dimensão na planilha: aproximação pelo tamanho do arquivo
+    return os.path.getsize(caminho) // 50
+
+
+class Estimativa:
+    """Custo previsto de uma análise: duração (s) e memória (MB)."""
+
+    def __init__(self, linhas: int, type_busca: int):
+        tipo = type_busca if type_busca in CUSTO_BASE_S else 3
+        self.linhas = linhas
+        self.type_busca = tipo
+        self.duracao_s = CUSTO_BASE_S[tipo] + linhas * CUSTO_POR_LINHA_S[tipo]
+        # Fora da memória só um bloco por aba em análise fica carregado por vez
+        em_memoria = linhas if linhas <= EnvConfig.ANALYSIS_OUT_OF_CORE_ROWS else (
+            EnvConfig.ANALYSIS_CHUNK_ROWS * EnvConfig.ANALYSIS_SHEET_WORKERS
+        )
+        self.memoria_mb = MEMORIA_BASE_MB[tipo] + em_memoria * MEMORIA_POR_LINHA_KB[tipo] / 1024
+
+
+class _Entrada:
+    def __init__(self, job_id: str, estimativa: Estimativa, iniciar):
+        self.job_id = job_id
+        self.estimativa = estimativa
+        self.iniciar = iniciar
+        self.enfileirado_em = time.monotonic()
+        self.iniciado_em: Optional[float] = None
+
+
+class JobScheduler:
+    """
+    Fila de admissão na frente do pool de análises (um por worker).
+    - Limita as análises simultâneas (ANALYSIS_MAX_JOBS) e a memória estimada
+      somada (ANALYSIS_MEMORY_BUDGET_MB).
+    - Ordena pela menor duração estimada (shortest-job-first), com envelhecimento:
+      cada segundo de espera desconta ANALYSIS_SJF_AGING segundos do custo,
+      então análises grandes não ficam esperando para sempre.
+    - Não pula a fila: se a primeira não couber na memória, as demais aguardam.
+    Usado apenas a partir do event loop, por isso não precisa de lock.
+    Os limites valem por worker do uvicorn: com `--workers N` o host pode ter
+    até N × ANALYSIS_MAX_JOBS análises e N × ANALYSIS_MEMORY_BUDGET_MB de memória
+    estimada (dimensione esses valores dividindo o total da máquina por N).
+    """
+
+    __fila: List[_Entrada] = []
+    __rodando: Dict[str, _Entrada] = {}
+    # Correção aprendida (real / estimado) por tipo de busca
+    __calibracao: Dict[int, float] = {}
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def estimar(cls, linhas: int, type_busca: int) -> Estimativa:
+        estimativa = Estimativa(linhas, type_busca)
+        estimativa.duracao_s *= cls.__calibracao.get(estimativa.type_busca, 1.0)
+        return estimativa
+
+    @classmethod
+    def _prioridade(cls, entrada: _Entrada, agora: float) -> float:
+        espera = agora - entrada.enfileirado_em
+        return entrada.estimativa.duracao_s - espera * EnvConfig.ANALYSIS_SJF_AGING
+
+    @classmethod
+    def _ordenar(cls):
+        agora = time.monotonic()
+        cls.__fila.sort(key=lambda e: (cls._prioridade(e, agora), e.enfileirado_em))
+
+    @classmethod
+    def memoria_em_uso_mb(cls) -> float:
+        return sum(e.estimativa.memoria_mb for e in cls.__rodando.values())
+
+    # ------------------------------------------------------------------
+    # Fila
+    # ------------------------------------------------------------------
+    @classmethod
+    def enfileirar(cls, job_id: str, estimativa: Estimativa, iniciar):
+        """Coloca o job na fila; `iniciar()` é chamado quando ele for admitido."""
+        cls.__fila.append(_Entrada(job_id, estimativa, iniciar))
+        cls.despachar()
+
+    @classmethod
+    def remover(cls, job_id: str) -> bool:
+        """Tira da fila um job que ainda não começou."""
+        for entrada in cls.__fila:
+            if entrada.job_id == job_id:
+                cls.__fila.remove(entrada)
+                return True
+        return False
+
+    @classmethod
+    def despachar(cls):
+        """Inicia os próximos jobs enquanto houver vaga e memória."""
+        cls._ordenar()
+        while cls.__fila and len(cls.__rodando) < EnvConfig.ANALYSIS_MAX_JOBS:
+            entrada = cls.__fila[0]
+            # Um job maior que o orçamento inteiro roda sozinho
+            cabe = cls.memoria_em_uso_mb() + entrada.estimativa.memoria_mb <= EnvConfig.ANALYSIS_MEMORY_BUDGET_MB
+            if not cabe and cls.__rodando:
+                break
+
+            cls.__fila.pop(0)
+            entrada.iniciado_em = time.monotonic()
+            cls.__rodando[entrada.job_id] = entrada
+            try:
+                entrada.iniciar()
+            except Exception as e:
+                cls.__rodando.pop(entrada.job_id, None)
+                cls.logger.error(f"Erro ao iniciar job {entrada.job_id}: {e}")
+
+    @classmethod
+    def finalizar(cls, job_id: str, calibrar: bool = False):
+        """Libera a vaga do job; com `calibrar`, ajusta as próximas estimativas pela duração real."""
+        entrada = cls.__rodando.pop(job_id, None)
+        if entrada is not None and calibrar and entrada.estimativa.linhas > 0:
+            real = time.monotonic() - entrada.iniciado_em
+            tipo = entrada.estimativa.type_busca
+            atual = cls.__calibracao.get(tipo, 1.0)
+            # duracao_s já inclui a correção atual; volta à estimativa bruta
+            bruta = entrada.estimativa.duracao_s / atual
+            if bruta > 0:
+                cls.__calibracao[tipo] = (1 - PESO_CALIBRACAO) * atual + PESO_CALIBRACAO * (real / bruta)
+        cls.despachar()
+
+    # ------------------------------------------------------------------
+    # Posição e previsão de início
+    # ------------------------------------------------------------------
+    @classmethod
+    def posicao(cls, job_id: str) -> Optional[Dict]:
+        """
+        Posição na fila (1 = próximo) e segundos estimados até o início,
+        simulando as vagas com as durações estimadas. None se não estiver na fila.
+        """
+        cls._ordenar()
+        agora = time.monotonic()
+        vagas = [
+            max(0.0, e.estimativa.duracao_s - (agora - e.iniciado_em)) for e in cls.__rodando.values()
+        ]
+        vagas += [0.0] * max(0, EnvConfig.ANALYSIS_MAX_JOBS - len(vagas))
+
+        for i, entrada in enumerate(cls.__fila):
+            vagas.sort()
+            inicio = vagas.pop(0)
+            if entrada.job_id == job_id:
+                return {"posicao": i + 1, "inicio_em_s": round(inicio, 1)}
+            vagas.append(inicio + entrada.estimativa.duracao_s)
+        return None
+
+    @classmethod
+    def metricas(cls) -> Dict:
+        return {
+            "max_jobs": EnvConfig.ANALYSIS_MAX_JOBS,
+            "rodando": len(cls.__rodando),
+            "na_fila": len(cls.__fila),
+            "memoria_estimada_mb": round(cls.memoria_em_uso_mb(), 1),
+            "orcamento_memoria_mb": EnvConfig.ANALYSIS_MEMORY_BUDGET_MB,
+            "calibracao": {str(k): round(v, 3) for k, v in cls.__calibracao.items()},
+        }
@@ -13,7 +13,7 @@ class EnvConfig:
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
     # Extensões permitidas
-    RAW_EXTENSIONS = os.getenv("ALLOWED_EXTENSIONS", "xlsx")
+    RAW_EXTENSIONS = os.getenv("ALLOWED_EXTENSIONS", "xlsx,csv,parquet")
     ALLOWED_EXTENSIONS = [ext.strip().lower() for ext in RAW_EXTENSIONS.split(",")]
     
     # CORS
@@ -31,18 +31,77 @@ class EnvConfig:
     RESULTS_DIR = os.path.join(PROJECT_ROOT, os.getenv("RESULTS_DIR", "results"))
     KMZ_DIR = os.path.join(PROJECT_ROOT, os.getenv("KMZ_DIR", "kmzs"))
 
+    # Registro persistente das análises (compartilhado entre workers)
+    JOBS_DB_PATH = os.path.join(RESULTS_DIR, os.getenv("JOBS_DB_FILE", "jobs.sqlite3"))
+
     # Limite de upload
     MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50"))
     MAX_UPLOAD_SIZE_BYTES = MAX_UPLOAD_SIZE_MB * 1024 * 1024
+    # Tamanho dos blocos na gravação do upload em disco
+    UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
 
     # Servidor
     API_PORT = int(os.getenv("API_PORT", "8000"))
 
     # Banco de dados
+    # "mysql" (padrão) ou "sqlite" (embarcado, sem servidor)
+    DB_BACKEND = os.getenv("DB_BACKEND", "mysql").strip().lower()
+    SQLITE_PATH = os.path.join(PROJECT_ROOT, os.getenv("SQLITE_PATH", "analysis_db.sqlite3"))
+    SQLITE_BASE_SQL = os.path.join(API_DIR, "migrations", "base_db.sql")
+
     DB_HOST = os.getenv("DB_HOST", "localhost")
     DB_PORT = int(os.getenv("DB_PORT", "3306"))
     DB_USER = os.getenv("DB_USER", "root")
     DB_PASS = os.getenv("DB_PASS", "")
     DB_NAME = os.getenv("DB_NAME", "")
-    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
     DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "280"))
+    # Threads do executor usado pelos endpoints async
+    DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "5"))
+    # Tempo máximo (s) aguardando uma conexão livre antes de falhar
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    # Conexões ociosas há mais que isso (s) recebem um ping antes do uso
+    DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "60"))
+
+    # Intervalo (s) entre verificações de versão da tabela municipios (autocomplete)
+    MUNICIPIOS_INDEX_TTL = float(os.getenv("MUNICIPIOS_INDEX_TTL", "300"))
+    # Intervalo (s) entre verificações de versão da tabela redes_ptp (escritas de outros workers)
+    PTP_SNAPSHOT_TTL = float(os.getenv("PTP_SNAPSHOT_TTL", "30"))
+    # Intervalo (s) entre verificações de mudança nos KMZ (índice de cobertura do /viability)
+    COVERAGE_INDEX_TTL = float(os.getenv("COVERAGE_INDEX_TTL", "60"))
+    # /analyze/batch: pontos avaliados (e devolvidos) por bloco
+    BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "1000"))
+
+    # Análise: threads de consulta PTP compartilhadas pelas análises
+    # (divididas igualmente entre os ANALYSIS_MAX_JOBS processos), por worker do uvicorn
+    PTP_MAX_WORKERS = int(os.getenv("PTP_MAX_WORKERS", "30"))
+    # Análises executadas ao mesmo tempo (processos); as demais aguardam na fila.
+    # Este limite e o orçamento de memória valem POR WORKER do uvicorn: com
+    # --workers N o host admite N vezes esses valores
+    ANALYSIS_MAX_JOBS = int(os.getenv("ANALYSIS_MAX_JOBS", "2"))
+    # Memória estimada somada das análises simultâneas (MB, por worker) e envelhecimento
+    # da fila (segundos de custo descontados por segundo de espera)
+    ANALYSIS_MEMORY_BUDGET_MB = float(os.getenv("ANALYSIS_MEMORY_BUDGET_MB", "2048"))
+    ANALYSIS_SJF_AGING = float(os.getenv("ANALYSIS_SJF_AGING", "1.0"))
+    # Intervalo (s) entre comentários de heartbeat nos streams SSE
+    SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+    # Sem ninguém acompanhando por esse tempo (s) após a desconexão, a análise é cancelada
+    ANALYSIS_DISCONNECT_GRACE = float(os.getenv("ANALYSIS_DISCONNECT_GRACE", "30"))
+    # Reaproveita resultados (e análises em andamento) de pedidos idênticos
+    ANALYSIS_REUSE_RESULTS = os.getenv("ANALYSIS_REUSE_RESULTS", "true").lower() == "true"
+    # Pontos processados por bloco na análise; cada bloco concluído vai para o
+    # stream como evento parcial ("rows"), até ANALYSIS_PARTIAL_MAX_ROWS linhas por job (0 = desliga)
+    ANALYSIS_CHUNK_ROWS = max(1, int(os.getenv("ANALYSIS_CHUNK_ROWS", "5000")))
+    ANALYSIS_PARTIAL_MAX_ROWS = int(os.getenv("ANALYSIS_PARTIAL_MAX_ROWS", "50000"))
+    # Planilhas com mais linhas que isso são analisadas fora da memória: lidas e
+    # gravadas (Excel e sidecar) bloco a bloco, sem carregar o arquivo inteiro
+    ANALYSIS_OUT_OF_CORE_ROWS = int(os.getenv("ANALYSIS_OUT_OF_CORE_ROWS", "200000"))
+    # Abas de uma mesma planilha analisadas ao mesmo tempo (threads no processo da análise)
+    ANALYSIS_SHEET_WORKERS = max(1, int(os.getenv("ANALYSIS_SHEET_WORKERS", "4")))
+
+    # Pool: "auto" acompanha a quantidade de threads que usam o banco no processo
+    # (na API, o executor do banco; nos processos de análise, a cota de threads de consulta)
+    RAW_DB_POOL_SIZE = os.getenv("DB_POOL_SIZE", "auto").strip().lower()
+    if RAW_DB_POOL_SIZE == "auto":
+        DB_POOL_SIZE = DB_EXECUTOR_WORKERS
+    else:
+        DB_POOL_SIZE = int(RAW_DB_POOL_SIZE)
@@ -0,0 +1,258 @@
+# api/core/sqlite_backend.py
+import math
+import os
+import sqlite3
+import threading
+import zlib
+
+from .settings import EnvConfig
+
+import logging
+
+
+# Esquema equivalente às migrations 001-003, sem a coluna POINT:
+# o índice espacial fica na tabela R*Tree municipios_rtree.
+SCHEMA_SQLITE = """
+    CREATE TABLE IF NOT EXISTS estados (
+        codigo_uf INTEGER PRIMARY KEY,
+        uf TEXT NOT NULL,
+        nome TEXT NOT NULL COLLATE ai_ci,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        regiao TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS municipios (
+        codigo_ibge INTEGER PRIMARY KEY,
+        nome TEXT NOT NULL COLLATE ai_ci,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        capital INTEGER NOT NULL,
+        codigo_uf INTEGER NOT NULL REFERENCES estados (codigo_uf),
+        siafi_id TEXT NOT NULL UNIQUE,
+        ddd INTEGER NOT NULL,
+        fuso_horario TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS municipios_codigo_uf ON municipios (codigo_uf);
+
+    CREATE TABLE IF NOT EXISTS redes_ptp (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codigo_ibge INTEGER NOT NULL REFERENCES municipios (codigo_ibge),
+        codigo_uf INTEGER NOT NULL REFERENCES estados (codigo_uf),
+        rede_ptp TEXT NOT NULL COLLATE ai_ci
+    );
+    CREATE INDEX IF NOT EXISTS redes_ptp_codigo_ibge ON redes_ptp (codigo_ibge);
+    CREATE INDEX IF NOT EXISTS redes_ptp_codigo_uf ON redes_ptp (codigo_uf);
+    CREATE INDEX IF NOT EXISTS redes_ptp_rede_ptp ON redes_ptp (rede_ptp);
+
+    -- Índice espacial (caixa = ponto) mantido por triggers
+    CREATE VIRTUAL TABLE IF NOT EXISTS municipios_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+
+    CREATE TRIGGER IF NOT EXISTS municipios_rtree_ins AFTER INSERT ON municipios BEGIN
+        INSERT INTO municipios_rtree VALUES (NEW.codigo_ibge, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END;
+    CREATE TRIGGER IF NOT EXISTS municipios_rtree_upd AFTER UPDATE OF latitude, longitude ON municipios BEGIN
+        UPDATE municipios_rtree
+        SET min_lat = NEW.latitude, max_lat = NEW.latitude, min_lon = NEW.longitude, max_lon = NEW.longitude
+        WHERE id = NEW.codigo_ibge;
+    END;
+    CREATE TRIGGER IF NOT EXISTS municipios_rtree_del AFTER DELETE ON municipios BEGIN
+        DELETE FROM municipios_rtree WHERE id = OLD.codigo_ibge;
+    END;
+"""
+
+# Mesmo raio usado pelo ST_Distance_Sphere do MySQL (em metros)
+RAIO_TERRA_METROS = 6370986.0
+
+
+# ==============================================================================
+# --- Funções do MySQL registradas no SQLite ---
+# ==============================================================================
+def _point(x, y):
+    """POINT(lon, lat) → texto 'lon lat' (consumido por ST_Distance_Sphere)."""
+    if x is None or y is None:
+        return None
+    return f"{float(x)} {float(y)}"
+
+
+def _st_srid(ponto, srid=None):
+    return ponto
+
+
+def _st_distance_sphere(p1, p2):
+    """Distância em metros entre dois POINT(lon, lat), como no MySQL."""
+    if p1 is None or p2 is None:
+        return None
+    lon1, lat1 = map(float, p1.split())
+    lon2, lat2 = map(float, p2.split())
+    lat1, lat2 = math.radians(lat1), math.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * RAIO_TERRA_METROS * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _crc32(valor):
+    if valor is None:
+        return None
+    return zlib.crc32(str(valor).encode("utf-8"))
+
+
+def _concat_ws(sep, *valores):
+    return sep.join(str(v) for v in valores if v is not None)
+
+
+def _colacao_ai_ci(a: str, b: str) -> int:
+    """Collation sem acento/caixa, como utf8mb4_0900_ai_ci."""
+    from api.core.ptp_snapshot import normalizar_texto
+
+    a, b = normalizar_texto(a), normalizar_texto(b)
+    return (a > b) - (a < b)
+
+
+class _GroupConcatOrdenado:
+    """GROUP_CONCAT(DISTINCT x ORDER BY x SEPARATOR sep) do MySQL."""
+
+    def __init__(self):
+        self.valores = set()
+        self.sep = ","
+
+    def step(self, valor, sep):
+        self.sep = sep
+        if valor is not None:
+            self.valores.add(valor)
+
+    def finalize(self):
+        if not self.valores:
+            return None
+        from api.core.ptp_snapshot import normalizar_texto
+
+        return self.sep.join(sorted(self.valores, key=normalizar_texto))
+
+
+def _preparar_conexao(cnx: sqlite3.Connection):
+    cnx.create_collation("ai_ci", _colacao_ai_ci)
+    cnx.create_function("POINT", 2, _point, deterministic=True)
+    cnx.create_function("ST_SRID", 2, _st_srid, deterministic=True)
+    cnx.create_function("ST_Distance_Sphere", 2, _st_distance_sphere, deterministic=True)
+    cnx.create_function("CRC32", 1, _crc32, deterministic=True)
+    cnx.create_function("CONCAT_WS", -1, _concat_ws, deterministic=True)
+    cnx.create_aggregate("GROUP_CONCAT_ORDENADO", 2, _GroupConcatOrdenado)
+    cnx.execute("PRAGMA foreign_keys = ON")
+
+
+# ==============================================================================
+# --- Adaptadores com a mesma interface usada do mysql-connector ---
+# ==============================================================================
+class _SQLiteCursor:
+    """Cursor com placeholders `%s` e linhas como dict (como cursor(dictionary=True))."""
+
+    def __init__(self, cnx: sqlite3.Connection):
+        self._cur = cnx.cursor()
+
+    @staticmethod
+    def _traduzir(sql: str) -> str:
+        return sql.replace("%s", "?")
+
+    def execute(self, sql: str, params=None):
+        self._cur.execute(self._traduzir(sql), tuple(params or ()))
+
+    def executemany(self, sql: str, seq_params):
+        self._cur.executemany(self._traduzir(sql), [tuple(p) for p in seq_params])
+
+    def _como_dict(self, row):
+        if row is None:
+            return None
+        return {d[0]: v for d, v in zip(self._cur.description, row)}
+
+    def fetchone(self):
+        return self._como_dict(self._cur.fetchone())
+
+    def fetchall(self):
+        return [self._como_dict(r) for r in self._cur.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    def close(self):
+        self._cur.close()
+
+
+class _SQLiteConnection:
+    """Conexão da thread atual; close() apenas encerra a transação pendente."""
+
+    def __init__(self, cnx: sqlite3.Connection):
+        self._cnx = cnx
+
+    def cursor(self, dictionary=True):
+        return _SQLiteCursor(self._cnx)
+
+    def commit(self):
+        self._cnx.commit()
+
+    def rollback(self):
+        self._cnx.rollback()
+
+    def close(self):
+        if self._cnx.in_transaction:
+            self._cnx.rollback()
+
+
+class SQLiteBackend:
+    """
+    Backend embarcado (SQLite) para uso sem servidor MySQL:
+    máquinas de desenvolvimento, GUI desktop, CI e benchmarks.
+    Carrega migrations/base_db.sql via carga_referencia (pulando tabelas inalteradas).
+    """
+
+    __local = threading.local()
+    __init_lock = threading.Lock()
+    __inicializado = False
+    logger = logging.getLogger("uvicorn.info")
+
+    @classmethod
+    def _conectar(cls) -> sqlite3.Connection:
+        cnx = sqlite3.connect(EnvConfig.SQLITE_PATH, timeout=30, check_same_thread=False)
+        _preparar_conexao(cnx)
+        cnx.execute("PRAGMA journal_mode = WAL")
+        return cnx
+
+    @classmethod
+    def inicializar(cls):
+        """Cria o esquema e carrega a base de referência se o arquivo ainda estiver vazio."""
+        with cls.__init_lock:
+            if cls.__inicializado:
+                return
+            pasta = os.path.dirname(EnvConfig.SQLITE_PATH)
+            if pasta:
+                os.makedirs(pasta, exist_ok=True)
+
+            cnx = cls._conectar()
+            try:
+                cnx.executescript(SCHEMA_SQLITE)
+                if os.path.exists(EnvConfig.SQLITE_BASE_SQL):
+                    # Idempotente: só grava as tabelas cujo checksum mudou
+                    from api.core.carga_referencia import carregar
+
+                    carregar(_SQLiteCursor(cnx), "sqlite", caminho=EnvConfig.SQLITE_BASE_SQL)
+                    cnx.commit()
+            finally:
+                cnx.close()
+
+            cls.__inicializado = True
+            cls.logger.info(f"📌 Backend SQLite inicializado ({EnvConfig.SQLITE_PATH}).")
+
+    @classmethod
+    def get_connection(cls) -> _SQLiteConnection:
+        if not cls.__inicializado:
+            cls.inicializar()
+        cnx = getattr(cls.__local, "cnx", None)
+        if cnx is None:
+            cnx = cls._conectar()
+            cls.__local.cnx = cnx
+        return _SQLiteConnection(cnx)
@@ -0,0 +1,103 @@
+# api/core/upload.py
+import asyncio
+import hashlib
+import os
+from typing import Dict, Iterable
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from api.core.settings import EnvConfig
+
+
+# Folga para os campos do formulário e delimitadores do multipart
+MARGEM_MULTIPART_BYTES = 64 * 1024
+
+
+def _mensagem_limite(limite_bytes: int) -> str:
+    return f"Arquivo excede o limite de {limite_bytes // 1024 // 1024}MB"
+
+
+class LimiteUploadMiddleware:
+    """
+    Middleware ASGI que limita o corpo das requisições de upload enquanto ele chega,
+    inclusive em uploads chunked (sem Content-Length): a contagem de bytes
+    interrompe a leitura assim que o limite é ultrapassado, antes de o arquivo
+    inteiro ser recebido. Vale só para os caminhos exatos em `caminhos`.
+    """
+
+    def __init__(self, app, limite_bytes: int, caminhos: Iterable[str]):
+        self.app = app
+        self.limite_corpo = limite_bytes + MARGEM_MULTIPART_BYTES
+        self.limite_bytes = limite_bytes
+        self.caminhos = frozenset(caminhos)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.caminhos:
+            await self.app(scope, receive, send)
+            return
+
+        # Com Content-Length a recusa é imediata
+        for nome, valor in scope.get("headers", []):
+            if nome == b"content-length":
+                try:
+                    tamanho = int(valor)
+                except ValueError:
+                    break
+                if tamanho > self.limite_corpo:
+                    await self._recusar(send)
+                    return
+                break
+
+        recebido = 0
+
+        async def receive_limitado():
+            nonlocal recebido
+            mensagem = await receive()
+            if mensagem["type"] == "http.request":
+                recebido += len(mensagem.get("body", b""))
+                if recebido > self.limite_corpo:
+                    raise HTTPException(413, _mensagem_limite(self.limite_bytes))
+            return mensagem
+
+        await self.app(scope, receive_limitado, send)
+
+    async def _recusar(self, send):
+        resposta = JSONResponse(status_code=413, content={"detail": _mensagem_limite(self.limite_bytes)})
+        await resposta({"type": "http"}, None, send)
+
+
+async def salvar_upload(file: UploadFile, destino: str, limite_bytes: int = None) -> Dict:
+    """
+    Copia o upload para `destino` em blocos, sem bloquear o event loop,
+    contando os bytes (limite `limite_bytes`) e calculando o SHA-256 durante a cópia.
+    Retorna {"sha256": ..., "bytes": ...}. Se o limite for excedido remove o arquivo parcial (413).
+
+    Quando esta função roda o Starlette já recebeu o corpo multipart inteiro no
+    arquivo temporário do UploadFile (em memória até 1MB, depois em disco): o
+    arquivo é gravado duas vezes e esta cópia não economiza a primeira. O que
+    corta uploads grandes enquanto chegam é o LimiteUploadMiddleware.
+    """
+    limite_bytes = EnvConfig.MAX_UPLOAD_SIZE_BYTES if limite_bytes is None else limite_bytes
+    sha256 = hashlib.sha256()
+    total = 0
+
+    buffer = await asyncio.to_thread(open, destino, "wb")
+    try:
+        while True:
+            bloco = await file.read(EnvConfig.UPLOAD_CHUNK_BYTES)
+            if not bloco:
+                break
+            total += len(bloco)
+            if total > limite_bytes:
+                raise HTTPException(413, _mensagem_limite(limite_bytes))
+            sha256.update(bloco)
+            await asyncio.to_thread(buffer.write, bloco)
+    except BaseException:
+        await asyncio.to_thread(buffer.close)
+        if os.path.exists(destino):
+            os.remove(destino)
+        raise
+    await asyncio.to_thread(buffer.close)
+
+    return {"sha256": sha256.hexdigest(), "bytes": total}
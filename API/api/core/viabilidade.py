@@ -0,0 +1,264 @@
+# api/core/viabilidade.py
+import codecs
+import json
+import math
+import re
+from typing import AsyncIterator, Dict, List, Optional
+
+import numpy as np
+
+from api.core.coverage import CoverageCache
+from api.core.models.ptp_model import PTPModel
+from api.core.ptp_snapshot import PTPCache
+from api.core.workers import WorkerPools
+
+# Um item do lote (objeto JSON) maior que isso é rejeitado: evita acumular
+# um corpo malformado inteiro em memória esperando o fim do objeto
+TAMANHO_MAXIMO_ITEM = 64 * 1024
+
+
+class LoteInvalido(ValueError):
+    """Corpo do /analyze/batch que não é um array JSON nem NDJSON de objetos."""
+
+
+# ==============================================================================
+# --- Avaliação (mesmas regras do GeoAnalyzer) ---
+# ==============================================================================
+def velocidade_numerica(valor) -> float:
+    """Velocidade em Mbps como na análise: primeiros dígitos do texto ("500 Mbps" -> 500), senão 0."""
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return float(valor) if math.isfinite(valor) else 0.0
+    encontrado = re.search(r"\d+", str(valor or ""))
+    return float(encontrado.group()) if encontrado else 0.0
+
+
+def coordenada_numerica(valor) -> float:
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return math.nan
+    return numero if math.isfinite(numero) else math.nan
+
+
+def _rede_ptp(lat: float, lon: float) -> List[str]:
+    ptp = PTPModel.rede_ptp(lat, lon)
+    if ptp and ptp.get("redes"):
+        return ptp["redes"].split(" / ")
+    return []
+
+
+def avaliar_pontos(lat, lon, velocidade, raio_km: float = 0.0, type_busca: int = 3) -> List[Dict]:
+    """
+    Viabilidade de vários pontos com as regras do /analyze/:
+    - coordenada ausente, zerada ou fora do intervalo: "Coordenada Inválida";
+    - GPON (type_busca 2 e 3) pelo índice de cobertura em memória, de uma vez;
+    - PTP para todos (type_busca 1) ou só para os inviáveis no GPON (type_busca 3).
+    Bloqueante: nos endpoints async, chamar via asyncio.to_thread.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    velocidade = np.asarray(velocidade, dtype=float)
+
+    validos = (
+        np.isfinite(lat) & np.isfinite(lon) & (lat != 0) & (lon != 0)
+        & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    )
+    resultados = [
+        {"status": "Coordenada Inválida", "manchas": [], "dist_gpon_m": None, "rede_ptp": []}
+        for _ in range(len(lat))
+    ]
+    posicoes = np.flatnonzero(validos)
+    if not len(posicoes):
+        return resultados
+
+    if type_busca == 1:
+        gpon = [{"status": "Inviável", "manchas": [], "dist_gpon_m": None}] * len(posicoes)
+    else:
+        indice = CoverageCache.verificar_versao() if CoverageCache.precisa_verificar() else CoverageCache.obter()
+        gpon = indice.consultar_lote(lat[posicoes], lon[posicoes], raio_km * 1000, velocidade[posicoes])
+
+    for i, situacao in zip(posicoes.tolist(), gpon):
+        resultados[i] = {**situacao, "rede_ptp": []}
+
+    buscar_ptp = [
+        i for i in posicoes.tolist()
+        if type_busca == 1 or (type_busca == 3 and resultados[i]["status"] == "Inviável")
+    ]
+    if buscar_ptp:
+        if PTPCache.precisa_verificar():
+            PTPCache.verificar_versao()
+        if PTPCache.obter() is not None:
+            # Foto em memória: a busca é só numpy, não compensa despachar para threads
+            redes = ((i, _rede_ptp(lat[i], lon[i])) for i in buscar_ptp)
+        else:
+            redes = WorkerPools.lote(lambda i: (i, _rede_ptp(lat[i], lon[i])), buscar_ptp)
+        for i, encontradas in redes:
+            if encontradas:
+                resultados[i]["rede_ptp"] = encontradas
+                resultados[i]["status"] = "Analisar (Rede/SW na Cidade)"
+
+    return resultados
+
+
+def pronto_para_consulta(type_busca: int) -> bool:
+    """True quando avaliar um ponto só usa memória (pode rodar direto no event loop)."""
+    cobertura = type_busca == 1 or not CoverageCache.precisa_verificar()
+    ptp = type_busca == 2 or (PTPCache.obter() is not None and not PTPCache.precisa_verificar())
+    return cobertura and ptp
+
+
+# ==============================================================================
+# --- Leitura incremental do corpo (array JSON ou NDJSON) ---
+# ==============================================================================
+async def _textos(corpo: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decodificador = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        async for pedaco in corpo:
+            texto = decodificador.decode(pedaco)
+            if texto:
+                yield texto
+        final = decodificador.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise LoteInvalido("Corpo não está em UTF-8.")
+    if final:
+        yield final
+
+
+async def _proximo(textos: AsyncIterator[str]) -> Optional[str]:
+    try:
+        return await textos.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def _objeto(item, posicao: int) -> Dict:
+    if not isinstance(item, dict):
+        raise LoteInvalido(f"Item {posicao} não é um objeto JSON.")
+    return item
+
+
+async def _itens_ndjson(buffer: str, textos: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    posicao = 0
+
+    def linhas_prontas(final: bool):
+        nonlocal buffer, posicao
+        partes = buffer.split("\n")
+        buffer = "" if final else partes.pop()
+        if len(buffer) > TAMANHO_MAXIMO_ITEM:
+            raise LoteInvalido(f"Linha {posicao + 1} maior que {TAMANHO_MAXIMO_ITEM} bytes.")
+        for linha in partes:
+            if linha.strip():
+                try:
+                    item = json.loads(linha)
+                except json.JSONDecodeError as e:
+                    raise LoteInvalido(f"Linha {posicao + 1}: JSON inválido ({e.msg}).")
+                yield _objeto(item, posicao)
+                posicao += 1
+
+    for item in linhas_prontas(False):
+        yield item
+    async for texto in textos:
+        buffer += texto
+        for item in linhas_prontas(False):
+            yield item
+    for item in linhas_prontas(True):
+        yield item
+
+
+async def _itens_array(buffer: str, textos: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    decoder = json.JSONDecoder()
+    posicao = 0
+    inicio = buffer.index("[") + 1
+    esperando_item = True  # depois de "[" ou ","
+    acabou = False
+    fim_corpo = False
+
+    while True:
+        # Pula espaços e separadores; pede mais dados quando o buffer acaba
+        while inicio < len(buffer) and buffer[inicio].isspace():
+            inicio += 1
+        if inicio >= len(buffer):
+            if fim_corpo:
+                if acabou:
+                    return
+                raise LoteInvalido("Array JSON incompleto.")
+            texto = await _proximo(textos)
+            buffer = buffer[inicio:] + (texto or "")
+            inicio, fim_corpo = 0, texto is None
+            continue
+
+        if acabou:
+            raise LoteInvalido("Conteúdo após o fim do array JSON.")
+
+        caractere = buffer[inicio]
+        if caractere == "]":
+            if esperando_item and posicao > 0:
+                raise LoteInvalido(f"Vírgula sobrando após o item {posicao - 1}.")
+            acabou = True
+            inicio += 1
+            continue
+        if not esperando_item:
+            if caractere != ",":
+                raise LoteInvalido(f"Esperado ',' ou ']' após o item {posicao - 1}.")
+            esperando_item = True
+            inicio += 1
+            continue
+
+        try:
+            item, fim = decoder.raw_decode(buffer, inicio)
+        except json.JSONDecodeError as e:
+            # Objeto ainda pela metade: junta mais dados (até o limite por item)
+            if fim_corpo or len(buffer) - inicio > TAMANHO_MAXIMO_ITEM:
+                raise LoteInvalido(f"Item {posicao}: JSON inválido ({e.msg}).")
+            texto = await _proximo(textos)
+            buffer = buffer[inicio:] + (texto or "")
+            inicio, fim_corpo = 0, texto is None
+            continue
+
+        yield _objeto(item, posicao)
+        posicao += 1
+        inicio, esperando_item = fim, False
+
+
+async def ler_lotes(corpo: AsyncIterator[bytes], tamanho: int) -> AsyncIterator[List[Dict]]:
+    """
+    Objetos do corpo (array JSON ou NDJSON, detectado pelo primeiro caractere)
+    em blocos de até `tamanho`, lidos conforme chegam: a memória não depende
+    do tamanho do pedido. Erros de formato levantam LoteInvalido.
+    """
+    textos = _textos(corpo).__aiter__()
+    buffer = ""
+    while not buffer.strip():
+        texto = await _proximo(textos)
+        if texto is None:
+            return
+        buffer += texto
+
+    if buffer.lstrip().startswith("["):
+        itens = _itens_array(buffer, textos)
+    else:
+        itens = _itens_ndjson(buffer, textos)
+
+    bloco = []
+    async for item in itens:
+        bloco.append(item)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def avaliar_bloco(itens: List[Dict], inicio: int, raio_km: float, type_busca: int) -> List[Dict]:
+    """Resultados de um bloco do /analyze/batch, na ordem dos itens (id ausente = posição)."""
+    resultados = avaliar_pontos(
+        [coordenada_numerica(item.get("lat")) for item in itens],
+        [coordenada_numerica(item.get("lon")) for item in itens],
+        [velocidade_numerica(item.get("velocidade")) for item in itens],
+        raio_km=raio_km,
+        type_busca=type_busca,
+    )
+    return [
+        {"id": item.get("id", inicio + n), "lat": item.get("lat"), "lon": item.get("lon"), **resultado}
+        for n, (item, resultado) in enumerate(zip(itens, resultados))
+    ]
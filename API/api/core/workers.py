@@ -0,0 +1,161 @@
+# api/core/workers.py
+import concurrent.futures
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+from api.core.settings import EnvConfig
+
+import logging
+
+
+class _Lote:
+    """
+    Execução de `func` sobre `itens` no pool de I/O, com no máximo `cota`
+    tarefas em andamento. Itera os resultados na ordem em que ficam prontos;
+    ao sair do `with` (fim, erro ou cancelamento) descarta o que não começou.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, func: Callable, itens: Iterable, cota: int):
+        self._executor = executor
+        self._func = func
+        self._itens = iter(itens)
+        self._cota = cota
+        self._pendentes = set()
+
+    def _completar(self):
+        while len(self._pendentes) < self._cota:
+            try:
+                item = next(self._itens)
+            except StopIteration:
+                return
+            self._pendentes.add(self._executor.submit(self._func, item))
+
+    def __iter__(self):
+        self._completar()
+        while self._pendentes:
+            prontos, self._pendentes = concurrent.futures.wait(
+                self._pendentes, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            self._completar()
+            for future in prontos:
+                yield future.result()
+
+    def cancelar(self):
+        for future in self._pendentes:
+            future.cancel()
+        self._pendentes = set()
+        self._itens = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cancelar()
+        return False
+
+
+class WorkerPools:
+    """
+    Pools de trabalho compartilhados pela aplicação (um conjunto por worker do uvicorn):
+    - CPU: processos das análises (ANALYSIS_MAX_JOBS), uma análise por processo.
+    - I/O: PTP_MAX_WORKERS threads de consulta no total, divididas igualmente entre
+      os processos de análise (cota por job). Cada processo cria suas threads uma
+      única vez e as reaproveita em todas as análises que executar.
+    Nada disso é coordenado entre workers: com `--workers N` o host tem N pools
+    de processos e até N × PTP_MAX_WORKERS threads de consulta ao banco.
+    """
+
+    __cpu: Optional[ProcessPoolExecutor] = None
+    __manager = None
+    __io: Optional[ThreadPoolExecutor] = None
+    __lock = threading.Lock()
+    logger = logging.getLogger("uvicorn.info")
+
+    @staticmethod
+    def cota_io() -> int:
+        """Threads de consulta de cada análise (a soma não passa de PTP_MAX_WORKERS)."""
+        return max(1, EnvConfig.PTP_MAX_WORKERS // max(1, EnvConfig.ANALYSIS_MAX_JOBS))
+
+    # ------------------------------------------------------------------
+    # Pool de CPU (processos das análises)
+    # ------------------------------------------------------------------
+    @classmethod
+    def cpu(cls) -> ProcessPoolExecutor:
+        with cls.__lock:
+            if cls.__cpu is None:
+                # "spawn": o filho não herda sockets do pool MySQL nem threads do servidor
+                contexto = multiprocessing.get_context("spawn")
+                cls.__manager = contexto.Manager()
+                cls.__cpu = ProcessPoolExecutor(max_workers=EnvConfig.ANALYSIS_MAX_JOBS, mp_context=contexto)
+            return cls.__cpu
+
+    @classmethod
+    def manager(cls):
+        """Manager do multiprocessing para filas e eventos compartilhados com os processos."""
+        cls.cpu()
+        return cls.__manager
+
+    # ------------------------------------------------------------------
+    # Pool de I/O (threads, por processo)
+    # ------------------------------------------------------------------
+    @classmethod
+    def io(cls) -> ThreadPoolExecutor:
+        with cls.__lock:
+            if cls.__io is None:
+                cls.__io = ThreadPoolExecutor(max_workers=cls.cota_io(), thread_name_prefix="ptp")
+            return cls.__io
+
+    @classmethod
+    def lote(cls, func: Callable, itens: Iterable) -> _Lote:
+        """Executa `func` para cada item no pool de I/O respeitando a cota do job."""
+        return _Lote(cls.io(), func, itens, cls.cota_io())
+
+    @classmethod
+    def preparar_processo_analise(cls):
+        """
+        Ajustes no início de um processo de análise: com DB_POOL_SIZE=auto o pool
+        de conexões do processo acompanha a cota de threads de consulta.
+        """
+        if EnvConfig.RAW_DB_POOL_SIZE == "auto":
+            EnvConfig.DB_POOL_SIZE = cls.cota_io()
+        elif EnvConfig.DB_POOL_SIZE < cls.cota_io():
+            cls.logger.warning(
+                f"DB_POOL_SIZE={EnvConfig.DB_POOL_SIZE} é menor que a cota de {cls.cota_io()} threads por análise: "
+                "as consultas PTP vão aguardar conexões livres."
+            )
+
+    # ------------------------------------------------------------------
+    # Informações e encerramento
+    # ------------------------------------------------------------------
+    @classmethod
+    def metricas(cls) -> Dict:
+        return {
+            "cpu_processos": EnvConfig.ANALYSIS_MAX_JOBS,
+            "io_threads_total": EnvConfig.PTP_MAX_WORKERS,
+            "io_threads_por_job": cls.cota_io(),
+            "db_executor_threads": EnvConfig.DB_EXECUTOR_WORKERS,
+        }
+
+    @classmethod
+    def descrever(cls) -> str:
+        m = cls.metricas()
+        return (
+            f"{m['cpu_processos']} processos de análise, {m['io_threads_por_job']} threads de consulta por análise "
+            f"({m['io_threads_total']} no total), {m['db_executor_threads']} threads para o banco na API"
+        )
+
+    @classmethod
+    def shutdown(cls):
+        with cls.__lock:
+            if cls.__cpu is not None:
+                cls.__cpu.shutdown(wait=False, cancel_futures=True)
+                cls.__cpu = None
+            if cls.__manager is not None:
+                cls.__manager.shutdown()
+                cls.__manager = None
+            if cls.__io is not None:
+                cls.__io.shutdown(wait=False, cancel_futures=True)
+                cls.__io = None
@@ -1,29 +1,41 @@
 # api/main.py
 
 import asyncio
+import hashlib
 import json
 import os
-import shutil
 import uuid
-from typing import Dict
+from typing import Dict, List, Optional
 from contextlib import asynccontextmanager  # <-- 1. Importar
-import glob  # <-- 1. Importar
+import io
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
+import pandas as pd
 
 import logging
 
-from api.schemas.models import PTPCreate, PTPUpdate
+from api.schemas.models import PTPBulkItem, PTPCreate, PTPUpdate
 
 from api.core.settings import EnvConfig
 from api.core.database import Database
-from api.core.excel_styler import autoajuste
 
-from api.core.analysis import GeoAnalyzer
 from api.core.models.ptp_model import PTPModel
+from api.core.ptp_snapshot import PTPCache
+from api.core.municipio_index import MunicipioCache
+from api.core.coverage import CoverageCache
+from api.core.jobs import JobManager
+from api.core.job_store import STATUS_FINAIS, JobStore
+from api.core.scheduler import JobScheduler
+from api.core.upload import LimiteUploadMiddleware, salvar_upload
+from api.core.exportacao import (
+    FORMATOS, FormatoNaoSuportado, consultar_linhas, exportar, negociar_formato, remover_resultado, resumir_resultado
+)
+from api.core.workers import WorkerPools
+from api.core.viabilidade import LoteInvalido, avaliar_bloco, avaliar_pontos, ler_lotes, pronto_para_consulta
 
 
 
@@ -38,10 +50,6 @@ KMZ_DIR = EnvConfig.KMZ_DIR
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
-# 2. Definir o dicionário que será populado no startup
-analysis_results: Dict[str, str] = {}
-
-
 # ==============================================================================
 # --- 3. Função de Ciclo de Vida (Lifespan) ---
 # ==============================================================================
@@ -62,34 +70,43 @@ async def lifespan(app: FastAPI):
     logger.info("")
     
     # --- CÓDIGO A SER EXECUTADO ANTES DO SERVIDOR INICIAR ---
-    logger.info("Servidor iniciando... Populando cache de resultados existentes...")
-    
-    # Define o padrão de busca (ex: C:\..._geoespacial\API\results\resultado_*.xlsx)
-    pattern = os.path.join(RESULTS_DIR, "resultado_*.xlsx")
-    
-    count = 0
-    # Usa glob para encontrar todos os arquivos que correspondem ao padrão
-    for full_path in glob.glob(pattern):
-        try:
-            filename = os.path.basename(full_path)
-            
-            # Extrai o result_id do nome do arquivo
-            # "resultado_" tem 10 caracteres, ".xlsx" tem 5
-            result_id = filename[10:-5]
-            
-            # Adiciona ao dicionário em memória
-            analysis_results[result_id] = full_path
-            count += 1
-        except Exception as e:
-            logger.error(f"Erro ao carregar o resultado '{filename}' no cache: {e}")
-            
-    logger.info(f"Cache populado com {count} resultados anteriores.")
+    # Registro de jobs (na primeira vez importa os resultado_*.xlsx já existentes)
+    try:
+        await asyncio.to_thread(JobStore.inicializar)
+    except Exception as e:
+        logger.error(f"Erro ao abrir o registro de jobs: {e}")
+
+    # Carrega a foto em memória das redes PTP (o banco segue como fonte da verdade)
+    try:
+        await Database.run(PTPCache.carregar)
+    except Exception as e:
+        logger.error(f"Não foi possível carregar o snapshot PTP, consultas irão ao banco: {e}")
+
+    try:
+        await Database.run(MunicipioCache.verificar_versao)
+    except Exception as e:
+        logger.error(f"Não foi possível carregar o índice de municípios, autocomplete irá ao banco: {e}")
+
+    # Manchas GPON em memória para as consultas de um ponto (/viability)
+    try:
+        await asyncio.to_thread(CoverageCache.verificar_versao)
+    except Exception as e:
+        logger.error(f"Não foi possível carregar o índice de cobertura: {e}")
     
+    # Sobe os processos de análise já no startup (o spawn é lento para o primeiro upload)
+    try:
+        await asyncio.to_thread(WorkerPools.cpu)
+    except Exception as e:
+        logger.error(f"Erro ao iniciar o pool de análises: {e}")
+    logger.info(f"📌 Pools de trabalho: {WorkerPools.descrever()}.")
+
     # O 'yield' é o ponto onde a aplicação FastAPI fica "rodando"
     yield
     
     # --- CÓDIGO A SER EXECUTADO QUANDO O SERVIDOR DESLIGAR (opcional) ---
     logger.warning("Servidor desligando...")
+    WorkerPools.shutdown()
+    Database.shutdown()
 
 
 # ==============================================================================
@@ -102,6 +119,15 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# --- Limite de tamanho aplicado enquanto o corpo do upload chega ---
+# Registrado antes do CORS: o último middleware adicionado fica por fora, e as
+# respostas 413 precisam passar pelo CORS para o navegador conseguir lê-las
+app.add_middleware(
+    LimiteUploadMiddleware,
+    limite_bytes=EnvConfig.MAX_UPLOAD_SIZE_BYTES,
+    caminhos=("/analyze/", "/ptp/bulk/upload"),
+)
+
 # --- Configuração de CORS ---
 app.add_middleware(
     CORSMiddleware,
@@ -121,6 +147,16 @@ def is_allowed_extension(filename: str) -> bool:
     ext = filename.rsplit(".", 1)[-1].lower()
     return ext in EnvConfig.ALLOWED_EXTENSIONS
 
+# --- Formatação dos eventos SSE (id = seq do evento no registro do job) ---
+HEADERS_SSE = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def formatar_evento_sse(item) -> str:
+    if item is None:
+        # Comentário SSE: mantém proxies e balanceadores com a conexão aberta
+        return ": ping\n\n"
+    seq, evento = item
+    return f"id: {seq}\ndata: {json.dumps(evento)}\n\n"
+
 # --- Endpoints da API ---
 
 @app.post("/analyze/")
@@ -134,16 +170,15 @@ async def analyze_viability(
     """
     Inicia uma análise de viabilidade.
     - **raio_km**: Raio de proximidade em quilômetros.
-    - **file**: Arquivo .xlsx com os pontos para análise.
+    - **file**: Planilha (.xlsx), .csv ou .parquet com os pontos para análise.
     
     Retorna um stream de Server-Sent Events (SSE) com o progresso.
-    O último evento conterá o resumo e o ID para download do resultado.
+    O primeiro evento traz o `job_id`; o último conterá o resumo e o ID
+    para download do resultado (igual ao `job_id`).
+    Um pedido idêntico a outro (mesma planilha, parâmetros e versões de KMZ/PTP)
+    recebe o stream do job existente, indicado no header `X-Job-Reused`.
     """
     
-    # Verificando se arquivo é maior que tamanho estabelecido
-    if file.size and file.size > EnvConfig.MAX_UPLOAD_SIZE_BYTES:
-        raise HTTPException(413, f"Arquivo excede o limite de {EnvConfig.MAX_UPLOAD_SIZE_BYTES // 1024 // 1024}MB")
-
     # Verificação da extensão
     if not is_allowed_extension(file.filename):
         allowed = ", ".join(EnvConfig.ALLOWED_EXTENSIONS)
@@ -152,98 +187,186 @@ async def analyze_viability(
             detail=f"Extensão não permitida. Permitidas: {allowed}"
         )
     
-    # Salva o arquivo enviado temporariamente
+    # Salva o arquivo enviado temporariamente (em blocos, contando bytes e calculando o hash)
     file_id = str(uuid.uuid4())
     upload_path = os.path.join(UPLOADS_DIR, f"{file_id}_{file.filename}")
-    with open(upload_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    upload = await salvar_upload(file, upload_path)
+    input_hash = upload["sha256"]
 
-    async def event_stream_generator():
-        analyzer = GeoAnalyzer(
-            pasta_kmz=KMZ_DIR,
-            arquivo_excel_path=upload_path,
-            raio_km=raio_km,
-            coluna_coordenadas=coordenadas,
-            coluna_velocidade=col_velocidade,
-            type_busca=type_busca
+    # A análise roda em um processo do pool; aqui só repassamos o progresso
+    try:
+        job_id, reaproveitado = await JobManager.submeter(
+            {
+                "pasta_kmz": KMZ_DIR,
+                "upload_path": upload_path,
+                "results_dir": RESULTS_DIR,
+                "raio_km": raio_km,
+                "coordenadas": coordenadas,
+                "col_velocidade": col_velocidade,
+                "type_busca": type_busca,
+            },
+            arquivo=file.filename,
+            input_hash=input_hash
         )
-        
-        df_final, resumo = None, None
-        
-        # O gerador da classe de análise produz o progresso
-        for progress, message in analyzer.run_analysis():
-            if progress == -1: # Flag de erro
-                error_event = {"status": "error", "message": message}
-                yield f"data: {json.dumps(error_event)}\n\n"
-                os.remove(upload_path)
-                return
-
-            event_data = {"progress": progress, "message": message}
-            yield f"data: {json.dumps(event_data)}\n\n"
-            await asyncio.sleep(0.1) # Pequeno delay para a UI respirar
-
-            # Acessa o resultado final quando o gerador termina
-            # df_final, resumo = analyzer.run_analysis().__closure__[0].cell_contents
-
-            # --- CORREÇÃO APLICADA AQUI ---
-            # Após o loop, pegamos os resultados que foram salvos na instância do analyzer
-            df_final = analyzer.df_final
-            resumo = analyzer.resumo
-            # --- FIM DA CORREÇÃO ---
-
-        if df_final is not None:
-            # Salva o arquivo de resultado final
-            result_id = str(uuid.uuid4())
-            result_path = os.path.join(RESULTS_DIR, f"resultado_{result_id}.xlsx")
-            df_final.to_excel(result_path, index=False, engine='openpyxl')
-            analysis_results[result_id] = result_path
-
-            
-            # Aplicando Cores
-            df_final.to_excel(result_path, index=False, engine='openpyxl')
-
-            # Aplicar cores no arquivo Excel
-            autoajuste(result_path)
-
-            analysis_results[result_id] = result_path
-            
-            # Envia o evento final com o resumo e o ID de download
-            final_event = {
-                "status": "complete",
-                "summary": resumo,
-                "result_id": result_id
-            }
-            yield f"data: {json.dumps(final_event)}\n\n"
-        
-        # Limpa o arquivo de upload
-        os.remove(upload_path)
+    except Exception:
+        # Falhou antes de a análise assumir o arquivo: o upload não será usado
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        raise
 
-    return StreamingResponse(event_stream_generator(), media_type="text/event-stream")
+    async def event_stream_generator():
+        async for item in JobManager.eventos(job_id):
+            yield formatar_evento_sse(item)
 
+    headers = dict(HEADERS_SSE)
+    if reaproveitado:
+        # Pedido idêntico: resultado pronto (complete) ou análise já em andamento (queued/running)
+        headers["X-Job-Reused"] = reaproveitado
+    return StreamingResponse(event_stream_generator(), media_type="text/event-stream", headers=headers)
 
-@app.get("/download/{result_id}")
-async def download_result(result_id: str):
+
+class RespostaNDJSON(StreamingResponse):
     """
-    Baixa o arquivo Excel de resultado da análise.
-    - **result_id**: O ID retornado pelo endpoint /analyze/ no evento final.
+    Stream NDJSON que lê o corpo do pedido enquanto responde. O StreamingResponse
+    padrão (ASGI < 2.4) disputa o `receive` com o corpo para detectar desconexão;
+    aqui a desconexão chega pela própria leitura do corpo (ClientDisconnect).
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    request: Request,
+    raio_km: float = Query(0.0, ge=0),
+    type_busca: int = Query(3, ge=1, le=3)
+):
+    """
+    Análise de pontos enviados no corpo, sem planilha: array JSON ou NDJSON
+    de objetos `{id, lat, lon, velocidade}`.
+    Os pontos são avaliados em blocos de BATCH_CHUNK_SIZE com as regras do
+    /analyze/ e cada bloco é devolvido (NDJSON, um resultado por linha, na
+    ordem do pedido) assim que fica pronto; a memória não cresce com o pedido.
+    Erro de formato no meio do corpo encerra o stream com `{"ok": false, "error": ...}`.
+    """
+    async def ndjson_generator():
+        inicio = 0
+        try:
+            async for bloco in ler_lotes(request.stream(), EnvConfig.BATCH_CHUNK_SIZE):
+                resultados = await asyncio.to_thread(avaliar_bloco, bloco, inicio, raio_km, type_busca)
+                inicio += len(bloco)
+                yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in resultados)
+        except LoteInvalido as e:
+            yield json.dumps({"ok": False, "error": str(e)}, ensure_ascii=False) + "\n"
+        except ClientDisconnect:
+            return
+
+    return RespostaNDJSON(ndjson_generator(), headers={"X-Accel-Buffering": "no"})
+
+
+@app.get("/viability")
+async def check_viability(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    raio_km: float = Query(0.0, ge=0),
+    type_busca: int = Query(3, ge=1, le=3),
+    velocidade: float = Query(0, ge=0)
+):
     """
-    file_path = analysis_results.get(result_id)
+    Viabilidade de um único ponto, na hora (sem planilha nem stream).
+    Usa as mesmas regras do /analyze/ sobre o índice de cobertura e a foto PTP em memória.
+    - **type_busca**: 1=Só PTP, 2=Só GPON, 3=Híbrido (PTP só quando inviável no GPON).
+    - **velocidade**: velocidade pedida (Mbps); acima de 500 dentro da mancha vira "Verificar PTP".
+    """
+    if pronto_para_consulta(type_busca):
+        # Tudo em memória: mais rápido responder direto do que trocar de thread
+        resultado = avaliar_pontos([lat], [lon], [velocidade], raio_km, type_busca)[0]
+    else:
+        resultado = (await asyncio.to_thread(avaliar_pontos, [lat], [lon], [velocidade], raio_km, type_busca))[0]
+
+    return {"ok": True, "data": {"lat": lat, "lon": lon, "type_busca": type_busca, **resultado}}
+
+
+async def caminho_resultado(result_id: str):
+    """(registro do job, caminho do resultado) ou 404 se o resultado não existe mais."""
+    job = await asyncio.to_thread(JobStore.obter, result_id)
+    file_path = job.get("result_path") if job else None
     if not file_path or not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Resultado não encontrado ou expirado.")
-    
+    return job, file_path
+
+
+@app.get("/download/{result_id}")
+async def download_result(result_id: str, request: Request, format: Optional[str] = Query(None)):
+    """
+    Baixa o resultado da análise.
+    - **result_id**: O ID retornado pelo endpoint /analyze/ no evento final.
+    - **format**: `xlsx` (padrão), `csv`, `csv.gz`, `parquet`, `geojson` ou `gpkg`.
+    Sem `format`, o formato sai do header `Accept` (ex.: `text/csv`, `application/vnd.apache.parquet`).
+    Os formatos além do xlsx são gerados do arquivo colunar do resultado, sem abrir o Excel.
+    """
+    try:
+        formato = negociar_formato(format, request.headers.get("accept"))
+    except FormatoNaoSuportado as e:
+        raise HTTPException(status_code=400 if format else 406, detail=str(e))
+
+    job, file_path = await caminho_resultado(result_id)
+
+    coordenadas = (job.get("parametros") or {}).get("coordenadas")
+    try:
+        file_path = await asyncio.to_thread(exportar, file_path, formato, coordenadas)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     return FileResponse(
         path=file_path,
         filename=os.path.basename(file_path),
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        media_type=FORMATOS[formato][1],
+        headers={"Vary": "Accept"}
     )
     
+@app.get("/results/{result_id}/rows")
+async def result_rows(
+    result_id: str,
+    status: Optional[List[str]] = Query(None),
+    mancha: Optional[List[str]] = Query(None),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Prévia paginada das linhas do resultado, sem baixar o Excel.
+    - **status** / **mancha**: filtros por Status e Mancha GPON (podem ser repetidos).
+    Lida do arquivo colunar do resultado mapeado em memória: só as linhas da página são carregadas.
+    """
+    _, file_path = await caminho_resultado(result_id)
+    try:
+        data = await asyncio.to_thread(consultar_linhas, file_path, status, mancha, offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"ok": True, "data": data}
+
+
+@app.get("/results/{result_id}/summary")
+async def result_summary(result_id: str):
+    """Totais do resultado por Status e por Mancha GPON."""
+    _, file_path = await caminho_resultado(result_id)
+    data = await asyncio.to_thread(resumir_resultado, file_path)
+    return {"ok": True, "data": data}
+
+    
 @app.get("/delete/{result_id}")
 async def delete_result(result_id: str):
     """
     Deletar o arquivo Excel de resultado da análise.
     - **result_id**: O ID retornado pelo endpoint /analyze/ no evento final.
     """
-    file_path = analysis_results.get(result_id)
+    job = await asyncio.to_thread(JobStore.obter, result_id)
+    file_path = job.get("result_path") if job else None
     
     async def event_delete():
         if not file_path or not os.path.exists(file_path):
@@ -255,8 +378,9 @@ async def delete_result(result_id: str):
             }
             yield f"data: {json.dumps(result_delete)}\n\n"
         else:
-            # Limpa o arquivo solicitado
-            os.remove(file_path)
+            # Limpa o arquivo solicitado (e os outros formatos) e o registro do job
+            remover_resultado(file_path)
+            await asyncio.to_thread(JobStore.remover, result_id)
             # Envia o evento final com o resumo e o ID de download
             result_delete = {
                 "status": "success",
@@ -268,6 +392,92 @@ async def delete_result(result_id: str):
     return StreamingResponse(event_delete(), media_type="text/event-stream")
     
 
+@app.get("/jobs")
+async def list_jobs(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    status: Optional[str] = Query(None)
+):
+    """
+    Lista as análises registradas (mais recentes primeiro).
+    - **status**: filtro opcional (`queued`, `running`, `complete`, `error`, `cancelled`).
+    """
+    jobs = await asyncio.to_thread(JobStore.listar, limit, offset, status)
+    return {"ok": True, "data": jobs}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Detalhes de uma análise: parâmetros, hash da entrada, tempos, status e resumo."""
+    job = await asyncio.to_thread(JobStore.obter, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return {"ok": True, "data": JobStore.publico(job)}
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """
+    Cancela uma análise em andamento ou remove uma análise terminada.
+    - Em andamento: a análise para no próximo ponto de verificação e o stream recebe `status: cancelled`.
+    - Terminada: remove o arquivo de resultado e o registro.
+    """
+    job = await asyncio.to_thread(JobStore.obter, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+
+    if job["status"] not in STATUS_FINAIS:
+        await JobManager.pedir_cancelamento(job_id)
+        return JSONResponse(status_code=202, content={"ok": True, "data": {"id": job_id, "status": "cancelling"}})
+
+    file_path = job.get("result_path")
+    if file_path:
+        remover_resultado(file_path)
+    await asyncio.to_thread(JobStore.remover, job_id)
+    return {"ok": True, "data": {"id": job_id, "status": "deleted"}}
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, last_event_id: Optional[int] = Query(None)):
+    """
+    Stream SSE do progresso de uma análise, para reconectar sem reenviar o arquivo.
+    - **Last-Event-ID** (header) ou **last_event_id**: último `id` recebido; só os eventos seguintes são enviados.
+    Sem eles o stream recomeça do primeiro evento. Comentários `: ping` são enviados como heartbeat.
+    """
+    job = await asyncio.to_thread(JobStore.obter, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+
+    if last_event_id is None:
+        try:
+            last_event_id = int(request.headers.get("last-event-id", 0))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID inválido.")
+
+    async def event_stream_generator():
+        async for item in JobManager.eventos(job_id, apos_seq=max(0, last_event_id)):
+            yield formatar_evento_sse(item)
+
+    return StreamingResponse(event_stream_generator(), media_type="text/event-stream", headers=HEADERS_SSE)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Métricas operacionais da API.
+    - **db_pool**: uso do pool de conexões (em uso, espera, falhas de checkout).
+    - **analises**: análises rodando e na fila, memória estimada e orçamento.
+    - **workers**: tamanho dos pools de processos (CPU) e threads (I/O) e a cota por análise.
+    """
+    return {"db_pool": Database.metricas(), "analises": JobScheduler.metricas(), "workers": WorkerPools.metricas()}
+
+
+async def verificar_snapshot_ptp():
+    """Confere (a cada PTP_SNAPSHOT_TTL) se outro worker alterou as redes PTP no banco."""
+    if PTPCache.precisa_verificar():
+        await Database.run(PTPCache.verificar_versao)
+
+
 @app.get("/ptp/find")
 async def find_ptp(lat: float = Query(...), lon: float = Query(...), raio_km: float = Query(50.0)):
     """
@@ -275,16 +485,51 @@ async def find_ptp(lat: float = Query(...), lon: float = Query(...), raio_km: fl
     GET /ptp/find?lat=...&lon=...&raio_km=50
     """
     try:
-        row = PTPModel.rede_ptp(lat, lon, raio_km=raio_km)
+        await verificar_snapshot_ptp()
+        row = await Database.run(PTPModel.rede_ptp, lat, lon, raio_km=raio_km)
         return {"ok": True, "data": row}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
+def etag_listagem(**params) -> Optional[str]:
+    """ETag da listagem PTP: muda quando a foto em memória ou os parâmetros mudam."""
+    snapshot = PTPCache.obter()
+    if snapshot is None:
+        return None
+    chave = json.dumps([snapshot.assinatura, params], sort_keys=True, ensure_ascii=False)
+    return f'W/"{hashlib.sha1(chave.encode("utf-8")).hexdigest()}"'
+
+
 @app.get("/ptp/list")
-async def list_ptp(page: int = Query(1), limit: int = Query(50)):
+async def list_ptp(
+    request: Request,
+    page: int = Query(1),
+    limit: int = Query(50),
+    cursor: Optional[str] = Query(None),
+    uf: Optional[str] = Query(None),
+    rede: Optional[str] = Query(None)
+):
+    """
+    Lista paginada das redes PTP.
+    - **cursor**: `next_cursor` da página anterior (paginação por chave). Sem ele usa `page`.
+    - **uf** / **rede**: filtros opcionais por UF e nome da rede.
+
+    Responde 304 quando o `If-None-Match` enviado ainda corresponde aos dados atuais.
+    """
     try:
-        data = PTPModel.listar_paginado(page=page, limit=limit)
-        return {"ok": True, "data": data}
+        await verificar_snapshot_ptp()
+        etag = etag_listagem(page=page, limit=limit, cursor=cursor, uf=uf, rede=rede)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+
+        if etag:
+            enviados = [t.strip() for t in request.headers.get("if-none-match", "").split(",")]
+            if etag in enviados or "*" in enviados:
+                return Response(status_code=304, headers=headers)
+
+        data = await Database.run(
+            PTPModel.listar_paginado, page=page, limit=limit, cursor=cursor, uf=uf, rede=rede
+        )
+        return JSONResponse({"ok": True, "data": data}, headers=headers)
     except Exception as e:
         return {"ok": False, "error": str(e)}
     
@@ -293,7 +538,18 @@ async def list_ptp(page: int = Query(1), limit: int = Query(50)):
 @app.get("/ptp/municipios/search")
 async def search_municipios(q: str = Query(..., min_length=3)):
     try:
-        cidades = PTPModel.buscar_cidades(q)
+        # Só vai ao banco quando é hora de conferir a versão da tabela municipios
+        if MunicipioCache.precisa_verificar():
+            try:
+                await Database.run(MunicipioCache.verificar_versao)
+            except Exception as e:
+                # Banco indisponível: segue com o índice já carregado (se houver)
+                logging.getLogger("uvicorn.info").error(f"Erro ao verificar a versão dos municípios: {e}")
+
+        if MunicipioCache.obter() is not None:
+            cidades = PTPModel.buscar_cidades(q)  # Índice em memória
+        else:
+            cidades = await Database.run(PTPModel.buscar_cidades, q)
         return {"ok": True, "data": cidades}
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -302,7 +558,7 @@ async def search_municipios(q: str = Query(..., min_length=3)):
 @app.post("/ptp/create")
 async def create_ptp(ptp: PTPCreate):
     try:
-        PTPModel.criar(ptp.rede_ptp, ptp.codigo_ibge, ptp.codigo_uf)
+        await Database.run(PTPModel.criar, ptp.rede_ptp, ptp.codigo_ibge, ptp.codigo_uf)
         return {"ok": True, "msg": "Rede adicionada à cidade com sucesso!"}
     except ValueError as ve:
         return {"ok": False, "error": str(ve)} # Erro de duplicidade
@@ -312,7 +568,7 @@ async def create_ptp(ptp: PTPCreate):
 @app.post("/ptp/update")
 async def update_ptp(ptp: PTPUpdate):
     try:
-        PTPModel.atualizar(ptp.id, ptp.rede_ptp)
+        await Database.run(PTPModel.atualizar, ptp.id, ptp.rede_ptp)
         return {"ok": True, "msg": "Atualizado com sucesso"}
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -320,7 +576,73 @@ async def update_ptp(ptp: PTPUpdate):
 @app.post("/ptp/delete")
 async def delete_ptp(id: int = Query(...)):
     try:
-        PTPModel.deletar(id)
+        await Database.run(PTPModel.deletar, id)
         return {"ok": True, "msg": "Deletado com sucesso"}
     except Exception as e:
         return {"ok": False, "error": str(e)}
+
+
+
+# --- Operações em lote ---
+EXTENSOES_LOTE = ("csv", "xlsx")
+
+
+def ler_lote_ptp(conteudo: bytes, filename: str, acao_padrao: str) -> List[Dict]:
+    """Lê um CSV/XLSX com as colunas (acao, id, rede_ptp, codigo_ibge) em uma lista de itens."""
+    ext = filename.rsplit(".", 1)[-1].lower()
+    if ext == "csv":
+        df = pd.read_csv(io.BytesIO(conteudo), sep=None, engine="python", dtype=str)
+    else:
+        df = pd.read_excel(io.BytesIO(conteudo), dtype=str)
+
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    if "acao" not in df.columns:
+        df["acao"] = acao_padrao
+    df = df.astype(object).where(df.notna(), None)
+
+    colunas = [c for c in ("acao", "id", "rede_ptp", "codigo_ibge") if c in df.columns]
+    return df[colunas].to_dict(orient="records")
+
+
+@app.post("/ptp/bulk")
+async def bulk_ptp(itens: List[PTPBulkItem], tudo_ou_nada: bool = Query(False)):
+    """
+    Cria/atualiza/remove várias redes em uma única transação.
+    - Corpo: lista JSON de `{acao, id, rede_ptp, codigo_ibge}`.
+    - **tudo_ou_nada**: se qualquer linha falhar, nada é gravado.
+
+    Retorna um relatório por linha.
+    """
+    try:
+        data = await Database.run(
+            PTPModel.processar_lote, [item.model_dump() for item in itens], tudo_ou_nada=tudo_ou_nada
+        )
+        return {"ok": data["erros"] == 0, "data": data}
+    except Exception as e:
+        return {"ok": False, "error": f"Erro interno: {str(e)}"}
+
+
+@app.post("/ptp/bulk/upload")
+async def bulk_ptp_upload(
+    acao: str = Form("create"),
+    tudo_ou_nada: bool = Form(False),
+    file: UploadFile = File(...)
+):
+    """
+    Igual a /ptp/bulk, a partir de um arquivo .csv ou .xlsx.
+    - Colunas: `rede_ptp`, `codigo_ibge`, `id` e opcionalmente `acao`.
+    - **acao**: ação usada nas linhas sem a coluna `acao` (padrão: create).
+    """
+    if not file.filename or file.filename.rsplit(".", 1)[-1].lower() not in EXTENSOES_LOTE:
+        raise HTTPException(400, detail=f"Extensão não permitida. Permitidas: {', '.join(EXTENSOES_LOTE)}")
+
+    conteudo = await file.read(EnvConfig.MAX_UPLOAD_SIZE_BYTES + 1)
+    if len(conteudo) > EnvConfig.MAX_UPLOAD_SIZE_BYTES:
+        raise HTTPException(413, f"Arquivo excede o limite de {EnvConfig.MAX_UPLOAD_SIZE_BYTES // 1024 // 1024}MB")
+
+    try:
+        itens = await asyncio.to_thread(ler_lote_ptp, conteudo, file.filename, acao)
+        data = await Database.run(PTPModel.processar_lote, itens, tudo_ou_nada=tudo_ou_nada)
+        return {"ok": data["erros"] == 0, "data": data}
+    except Exception as e:
+        return {"ok": False, "error": f"Erro interno: {str(e)}"}
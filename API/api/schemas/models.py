@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, List, Optional
 
 class AnalysisSummary(BaseModel):
     total_pontos: int
@@ -12,4 +12,10 @@ class PTPCreate(BaseModel):
 
 class PTPUpdate(BaseModel):
     id: int
-    rede_ptp: str
\ No newline at end of file
+    rede_ptp: str
+
+class PTPBulkItem(BaseModel):
+    acao: str = "create"  # create | update | delete
+    id: Optional[int] = None
+    rede_ptp: Optional[str] = None
+    codigo_ibge: Optional[int] = None